@@ -0,0 +1,115 @@
+""" Compare the OCR inference backends for latency and recognition quality on a fixed page corpus.
+
+The corpus is a directory of page images (.png / .jpg). A `<page>.txt` next to an image is its ground
+truth; without one, pages are scored by agreement with the reference backend (fp32 when it is run,
+stock otherwise). Without --corpus a fixed synthetic handwriting corpus is generated (same seeds every run).
+
+The fastest backend whose quality is within --tolerance of the reference is reported at the end.
+Needs the EasyOCR models, and onnxruntime for the onnx backend.
+
+Run with: python -m src.app.benchmarks.bench_backends [--corpus DIR] [--threads 4]
+"""
+
+import argparse
+import difflib
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from src.app.benchmarks.bench_two_pass import handwritten_page
+from src.app.utilities.document_ocr import DocumentOCR, OCRArguments
+from src.app.utilities.ocr_backend import BACKENDS
+
+
+def load_corpus(corpus: Path) -> list[tuple[Path, Optional[str]]]:
+    pages = sorted(p for p in corpus.iterdir() if p.suffix.lower() in (".png", ".jpg", ".jpeg"))
+    return [(p, p.with_suffix(".txt").read_text(encoding="utf-8") if p.with_suffix(".txt").exists() else None) for p in pages]
+
+
+def synthetic_corpus(out_dir: Path, pages: int) -> list[tuple[Path, Optional[str]]]:
+    corpus: list[tuple[Path, Optional[str]]] = []
+    for i in range(pages):
+        image, truth = handwritten_page(i)
+        path = out_dir / f"page_{i + 1}.png"
+        cv2.imwrite(str(path), image)
+        corpus.append((path, truth))
+    return corpus
+
+
+def page_text(blocks: list[dict]) -> str:
+    return " ".join(" ".join(b["text"] for b in blocks).split())
+
+
+def similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a, " ".join(b.split())).ratio()
+
+
+def run_backend(name: str, threads: int, corpus: list[tuple[Path, Optional[str]]]) -> dict:
+    start = time.perf_counter()
+    ocr = DocumentOCR(OCRArguments(backend=name, num_threads=threads))
+    load_s = time.perf_counter() - start
+
+    ocr.ocr_image(corpus[0][0])  # warm up, the first call pays for lazy allocations
+    texts: list[str] = []
+    latencies: list[float] = []
+    for path, _ in corpus:
+        start = time.perf_counter()
+        texts.append(page_text(ocr.ocr_image(path)))
+        latencies.append(time.perf_counter() - start)
+    return {"load_s": load_s, "latencies": latencies, "texts": texts}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, help="directory of page images, optional <page>.txt ground truth")
+    parser.add_argument("--pages", type=int, default=6, help="size of the synthetic corpus when --corpus is not given")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads, 0 keeps the library default")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="allowed quality drop against the reference")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(Path(tmp), args.pages)
+        if not corpus:
+            parser.error(f"no page images in {args.corpus}")
+
+        results: dict[str, dict] = {}
+        for name in args.backends:
+            try:
+                results[name] = run_backend(name, args.threads, corpus)
+            except RuntimeError as e:
+                print(f"{name}: skipped, {e}")
+
+    if not results:
+        return
+    reference = "fp32" if "fp32" in results else next(iter(results))
+    ref_texts = results[reference]["texts"]
+
+    print(f"\n{len(corpus)} pages, reference backend: {reference}")
+    print(f"{'backend':<12} {'load s':>7} {'mean s':>7} {'p95 s':>7} {'quality':>8} {'agreement':>10}")
+    for name, r in results.items():
+        # Quality against the ground truth where there is one, against the reference elsewhere
+        r["quality"] = float(np.mean([
+            similarity(text, truth if truth is not None else ref)
+            for text, ref, (_, truth) in zip(r["texts"], ref_texts, corpus)
+        ]))
+        agreement = float(np.mean([similarity(t, ref) for t, ref in zip(r["texts"], ref_texts)]))
+        r["mean_s"] = float(np.mean(r["latencies"]))
+        print(
+            f"{name:<12} {r['load_s']:>7.1f} {r['mean_s']:>7.2f} {np.percentile(r['latencies'], 95):>7.2f} "
+            f"{r['quality']:>8.3f} {agreement:>10.3f}"
+        )
+
+    floor = results[reference]["quality"] - args.tolerance
+    eligible = [name for name, r in results.items() if r["quality"] >= floor]
+    best = min(eligible, key=lambda name: results[name]["mean_s"])
+    print(f"\nfastest backend within {args.tolerance:.3f} of {reference}: {best} (DOC_OCR_BACKEND={best})")
+
+
+if __name__ == "__main__":
+    main()
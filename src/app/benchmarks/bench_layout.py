@@ -0,0 +1,99 @@
+""" Benchmark the reading order on synthetic multi column pages.
+
+Run with: python -m src.app.benchmarks.bench_layout
+"""
+
+import argparse
+import random
+import time
+
+from typing import Any, Callable
+
+from src.app.utilities.layout_analysis import XYCutLayout
+
+
+def synthetic_page(n_blocks: int, columns: int, seed: int = 0) -> list[dict[str, Any]]:
+    """
+    Fake a page of `columns` side by side columns with lines of words that line up across columns,
+    which is exactly the case where the grid order interleaves.
+    """
+    rng = random.Random(seed)
+    page_w, gutter, line_h, word_w = 2100.0, 120.0, 40.0, 90.0
+    col_w = (page_w - gutter * (columns - 1)) / columns
+    words_per_line = max(1, int(col_w // (word_w + 20)))
+
+    blocks: list[dict[str, Any]] = []
+    line = 0
+    while len(blocks) < n_blocks:
+        y = 100.0 + line * line_h * 1.4 + rng.uniform(-3, 3)
+        for col in range(columns):
+            x0 = col * (col_w + gutter)
+            for w in range(words_per_line):
+                if len(blocks) >= n_blocks:
+                    break
+                x = x0 + w * (word_w + 20) + rng.uniform(0, 5)
+                blocks.append(
+                    {
+                        "text": f"c{col}l{line}w{w}",
+                        "column": col,
+                        "x_min": x,
+                        "y_min": y,
+                        "x_max": x + word_w,
+                        "y_max": y + line_h,
+                        "cx": x + word_w / 2.0,
+                        "cy": y + line_h / 2.0,
+                        "w": word_w,
+                        "h": line_h,
+                    }
+                )
+        line += 1
+
+    rng.shuffle(blocks)
+    return blocks
+
+
+def grid_order(blocks: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """ The old DocumentOCR._sort_reading_order, copied so this runs without easyocr installed """
+    heights = sorted(b["h"] for b in blocks)
+    median_h = heights[len(heights) // 2] if heights else 10.0
+    y_tol = max(8.0, 0.6 * median_h)
+    return sorted(blocks, key=lambda b: (int(b["cy"] // y_tol), b["cx"]))
+
+
+def column_switches(ordered: list[dict[str, Any]]) -> int:
+    """ How many times the reading order jumps between columns, columns - 1 is perfect """
+    return sum(1 for a, b in zip(ordered, ordered[1:]) if a["column"] != b["column"])
+
+
+def time_it(fn: Callable[[list[dict[str, Any]]], list[dict[str, Any]]], blocks: list[dict[str, Any]], repeats: int) -> tuple[float, list[dict[str, Any]]]:
+    best = float("inf")
+    out: list[dict[str, Any]] = []
+    for _ in range(repeats):
+        page = [dict(b) for b in blocks]
+        start = time.perf_counter()
+        out = fn(page)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--blocks", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--columns", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    layout = XYCutLayout()
+    print(f"{'blocks':>8} {'grid ms':>10} {'xycut ms':>10} {'grid switches':>14} {'xycut switches':>15}")
+    for n in args.blocks:
+        blocks = synthetic_page(n, args.columns)
+        grid_s, grid_out = time_it(grid_order, blocks, args.repeats)
+        xy_s, xy_out = time_it(layout.order, blocks, args.repeats)
+        print(
+            f"{n:>8} {grid_s * 1e3:>10.2f} {xy_s * 1e3:>10.2f} "
+            f"{column_switches(grid_out):>14} {column_switches(xy_out):>15}"
+        )
+
+
+if __name__ == "__main__":
+    main()
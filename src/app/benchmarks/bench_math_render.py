@@ -0,0 +1,75 @@
+""" Benchmark DOCX rendering on math dense pages, with and without the OMML cache.
+
+Run with: python -m src.app.benchmarks.bench_math_render
+"""
+
+import argparse
+import random
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Any
+
+from src.app.utilities.docx_tool import DocxConfig, DocxTool
+from src.app.utilities.math_render import MathRenderConfig, MathRenderer
+from src.app.utilities.omml_pass import MathPass
+
+
+EXPRESSIONS = [
+    "x² + 3x - 4 = 0", "y = mx + b", "dy/dx = 2x", "F = -kx", "E = mc^2", "a_1 + a_2 ≤ 5",
+    "√(x+1)/2", "sin θ + cos(2θ)", "V = IR", "P = V^2/R", "x = -b/(2a)", "f(x) = 1/2 x^2",
+    "Δx = v_0 t + 1/2 a t^2", "ln(x) = 2", "3.5*10^-3", "ω = 2πf", "λ = c/f",
+]
+PROSE = ["Problem 2", "Solve for x below", "Therefore", "Given the circuit shown", "Answer"]
+
+
+def synthetic_document(pages: int, blocks_per_page: int, distinct: int, seed: int = 0) -> dict[str, Any]:
+    """ `distinct` controls how many different expressions the whole document has """
+    rng = random.Random(seed)
+    pool = [f"{rng.choice(EXPRESSIONS)} + {i}" if i >= len(EXPRESSIONS) else EXPRESSIONS[i] for i in range(distinct)]
+
+    out_pages = []
+    for idx in range(1, pages + 1):
+        blocks = []
+        for _ in range(blocks_per_page):
+            text = rng.choice(pool) if rng.random() < 0.8 else rng.choice(PROSE)
+            blocks.append({"text": text, "confidence": 0.9})
+        out_pages.append({"page_index": idx, "image_path": "", "blocks": blocks})
+
+    ocr = {"page_count": pages, "total_blocks": pages * blocks_per_page, "pages": out_pages}
+    return MathPass().tag_blocks(ocr)
+
+
+def time_render(tool: DocxTool, doc: dict[str, Any], out: Path) -> float:
+    start = time.perf_counter()
+    tool.render_document(doc, out)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--blocks-per-page", type=int, default=40)
+    parser.add_argument("--distinct", type=int, default=60)
+    args = parser.parse_args()
+
+    print(f"{'pages':>6} {'text only s':>12} {'omml no cache s':>16} {'omml cached s':>14} {'hit rate':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / "bench.docx"
+        for pages in args.pages:
+            doc = synthetic_document(pages, args.blocks_per_page, args.distinct)
+
+            text_only = time_render(DocxTool(DocxConfig(render_math=False)), doc, out)
+            no_cache = time_render(DocxTool(math_renderer=MathRenderer(MathRenderConfig(cache_size=1))), doc, out)
+
+            renderer = MathRenderer()
+            cached = time_render(DocxTool(math_renderer=renderer), doc, out)
+            stats = renderer.cache.stats()
+            hit_rate = stats["hits"] / max(1, stats["hits"] + stats["misses"])
+
+            print(f"{pages:>6} {text_only:>12.2f} {no_cache:>16.2f} {cached:>14.2f} {hit_rate:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
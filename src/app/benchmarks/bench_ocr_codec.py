@@ -0,0 +1,126 @@
+""" Compare the columnar OCR codec with JSON (the page store's format) and BSON (Mongo's) for size and speed.
+
+Pages are synthetic ocr_page() records after the math pass: a few hundred blocks each with easyocr style
+integer boxes, float confidences, layout regions and short words (OCR text repeats a lot, the codec keeps
+each distinct string once). Reported per format: encoded size (raw and zlib), encode and decode time of
+the whole document, reading a single page, and the mean confidence of every block.
+
+Run with: python -m src.app.benchmarks.bench_ocr_codec [--pages 200] [--blocks 300]
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import time
+import zlib
+
+from pathlib import Path
+from typing import Any, Callable
+
+import bson
+import numpy as np
+
+from src.app.utilities.ocr_codec import ColumnarPages, decode_pages, encode_pages, write_pages
+from src.app.utilities.page_store import jsonable
+
+
+WORDS = "the of and to in is that for it as with was on be by this are at from or an which x = y + 2 f(x) dx".split()
+
+
+def synthetic_pages(pages: int, blocks: int, seed: int = 0) -> list[dict[str, Any]]:
+    rng = random.Random(seed)
+    records = []
+    for page_index in range(1, pages + 1):
+        page_blocks = []
+        for i in range(blocks):
+            x, y = rng.randint(0, 2000), rng.randint(0, 2800)
+            w, h = rng.randint(20, 400), rng.randint(18, 60)
+            x_min, y_min, x_max, y_max = float(x), float(y), float(x + w), float(y + h)
+            page_blocks.append({
+                "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 5))),
+                "confidence": rng.random(),
+                "bbox": [[x, y], [x + w, y], [x + w, y + h], [x, y + h]],
+                "x_min": x_min, "y_min": y_min, "x_max": x_max, "y_max": y_max,
+                "cx": (x_min + x_max) / 2.0, "cy": (y_min + y_max) / 2.0, "w": x_max - x_min, "h": y_max - y_min,
+                "region": i // 40,
+                "is_math": rng.random() < 0.1,
+            })
+        records.append({
+            "page_index": page_index,
+            "image_path": f"/tmp/jobs/job/pages/page_{page_index}.jpg",
+            "blocks": page_blocks,
+            "refined_blocks": 0,
+            "improved_blocks": 0,
+        })
+    return records
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> tuple[float, Any]:
+    """ Best of `repeat` runs in ms, and the last result """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--blocks", type=int, default=300, help="blocks per page")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = synthetic_pages(args.pages, args.blocks)
+    middle = args.pages // 2
+    rows = []
+
+    # JSON Lines, one page per line like the page store
+    def json_encode() -> bytes:
+        return "\n".join(json.dumps(p, default=jsonable, separators=(",", ":")) for p in pages).encode("utf-8")
+
+    enc_ms, blob = timed(json_encode, args.repeat)
+    dec_ms, _ = timed(lambda: [json.loads(line) for line in blob.splitlines()], args.repeat)
+    # Without an index, one page still means scanning to its line
+    page_ms, _ = timed(lambda: json.loads(blob.splitlines()[middle]), args.repeat)
+    conf_ms, _ = timed(
+        lambda: np.mean([b["confidence"] for line in blob.splitlines() for b in json.loads(line)["blocks"]]),
+        args.repeat,
+    )
+    rows.append(("json", len(blob), len(zlib.compress(blob)), enc_ms, dec_ms, page_ms, conf_ms))
+
+    # BSON, one document per page like the Mongo checkpoints used to be
+    enc_ms, docs = timed(lambda: [bson.encode(p) for p in pages], args.repeat)
+    dec_ms, _ = timed(lambda: [bson.decode(d) for d in docs], args.repeat)
+    page_ms, _ = timed(lambda: bson.decode(docs[middle]), args.repeat)
+    conf_ms, _ = timed(lambda: np.mean([b["confidence"] for d in docs for b in bson.decode(d)["blocks"]]), args.repeat)
+    joined = b"".join(docs)
+    rows.append(("bson", len(joined), len(zlib.compress(joined)), enc_ms, dec_ms, page_ms, conf_ms))
+
+    # Columnar codec, from a memory mapped file for the page and column reads
+    enc_ms, blob = timed(lambda: encode_pages(pages), args.repeat)
+    dec_ms, decoded = timed(lambda: decode_pages(blob), args.repeat)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "pages.npz"
+        write_pages(path, pages)
+        page_ms, _ = timed(lambda: ColumnarPages.open(path).page(middle), args.repeat)
+        conf_ms, _ = timed(lambda: float(np.mean(ColumnarPages.open(path).column("confidence"))), args.repeat)
+    rows.append(("codec", len(blob), len(zlib.compress(blob)), enc_ms, dec_ms, page_ms, conf_ms))
+
+    drift = max(
+        abs(a["confidence"] - b["confidence"])
+        for pa, pb in zip(pages, decoded) for a, b in zip(pa["blocks"], pb["blocks"])
+    )
+
+    print(f"\n{args.pages} pages x {args.blocks} blocks")
+    print(f"{'format':<7} {'bytes':>11} {'zlib':>11} {'encode ms':>10} {'decode ms':>10} {'1 page ms':>10} {'conf ms':>9}")
+    for name, size, packed, enc_ms, dec_ms, page_ms, conf_ms in rows:
+        print(f"{name:<7} {size:>11,} {packed:>11,} {enc_ms:>10.1f} {dec_ms:>10.1f} {page_ms:>10.2f} {conf_ms:>9.2f}")
+    print(f"\nlargest confidence change through float32: {drift:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+""" Benchmark the page preprocessing (deskew, denoise, binarize) on synthetic phone-scan-like pages.
+
+Without --ocr this reports the cost of each stage and how well the skew is recovered.
+With --ocr it also runs EasyOCR on every page raw and preprocessed and compares the OCR time,
+the mean confidence and how many blocks survive the min_confidence filter.
+
+Run with: python -m src.app.benchmarks.bench_preprocess [--ocr]
+"""
+
+import argparse
+import random
+import time
+
+from typing import Any
+
+import cv2
+import numpy as np
+
+from src.app.utilities.image_preprocess import ImagePreprocessor, PreprocessConfig
+
+
+LINES = [
+    "Lab 3: projectile motion, v0 = 12.5 m/s",
+    "x(t) = v0 cos(theta) t",
+    "y(t) = v0 sin(theta) t - g t^2 / 2",
+    "the range is R = v0^2 sin(2 theta) / g",
+    "measured R = 14.2 m, expected 14.6 m",
+    "error is about 3 percent",
+]
+
+
+def synthetic_scan(seed: int, skew: float, width: int = 2125, height: int = 2750) -> np.ndarray:
+    """ A text page rotated by `skew` degrees with uneven lighting, sensor noise and specks """
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width), 255, np.uint8)
+    y = 160
+    while y < height - 150:
+        text = LINES[int(rng.integers(len(LINES)))]
+        cv2.putText(page, text, (120, y), cv2.FONT_HERSHEY_SIMPLEX, 1.8, 30, 3, cv2.LINE_AA)
+        y += int(rng.integers(70, 95))
+
+    page = ImagePreprocessor.rotate(page, skew)
+
+    # Phone photos: light falls off towards one corner, plus noise and dust
+    h, w = page.shape
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    shade = 1.0 - 0.35 * (xx / w + yy / h) / 2.0
+    noisy = page.astype(np.float32) * shade + rng.normal(0.0, 12.0, page.shape)
+    specks = rng.random(page.shape) < 0.002
+    noisy[specks] = rng.uniform(0, 80, int(specks.sum()))
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def time_stages(pre: ImagePreprocessor, gray: np.ndarray, cfg: PreprocessConfig) -> dict[str, float]:
+    out: dict[str, float] = {}
+
+    start = time.perf_counter()
+    angle = pre.estimate_skew(gray, cfg)
+    out["skew_ms"] = (time.perf_counter() - start) * 1e3
+
+    start = time.perf_counter()
+    rotated = pre.rotate(gray, -angle)
+    out["rotate_ms"] = (time.perf_counter() - start) * 1e3
+
+    start = time.perf_counter()
+    denoised = cv2.medianBlur(rotated, cfg.median_ksize)
+    out["denoise_ms"] = (time.perf_counter() - start) * 1e3
+
+    start = time.perf_counter()
+    cv2.adaptiveThreshold(denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, cfg.block_size, cfg.threshold_c)
+    out["binarize_ms"] = (time.perf_counter() - start) * 1e3
+
+    out["angle"] = angle
+    return out
+
+
+def ocr_stats(ocr: Any, image: np.ndarray) -> tuple[float, float, int, int]:
+    """ (seconds, mean confidence, blocks returned, blocks kept) for one EasyOCR run """
+    start = time.perf_counter()
+    raw = ocr.reader.readtext(image, decoder=ocr.args.decoder)
+    took = time.perf_counter() - start
+
+    blocks = ocr._normalize_easyocr_result(raw)
+    kept = ocr._filter_blocks(blocks, min_conf=ocr.args.min_confidence)
+    mean_conf = float(np.mean([b["confidence"] for b in blocks])) if blocks else 0.0
+    return took, mean_conf, len(blocks), len(kept)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=6)
+    parser.add_argument("--max-skew", type=float, default=6.0)
+    parser.add_argument("--ocr", action="store_true", help="also run EasyOCR raw vs preprocessed (loads the models)")
+    args = parser.parse_args()
+
+    cfg = PreprocessConfig(enabled=True)
+    pre = ImagePreprocessor(cfg)
+    rng = random.Random(0)
+    skews = [rng.uniform(-args.max_skew, args.max_skew) for _ in range(args.pages)]
+    pages = [synthetic_scan(i, s) for i, s in enumerate(skews)]
+
+    print(f"{'page':>4} {'skew':>6} {'found':>6} {'skew ms':>8} {'rotate ms':>10} {'denoise ms':>11} {'binarize ms':>12} {'total ms':>9}")
+    totals: list[float] = []
+    for i, (skew, page) in enumerate(zip(skews, pages)):
+        t = time_stages(pre, page, cfg)
+        total = t["skew_ms"] + t["rotate_ms"] + t["denoise_ms"] + t["binarize_ms"]
+        totals.append(total)
+        print(
+            f"{i + 1:>4} {skew:>6.2f} {t['angle']:>6.2f} {t['skew_ms']:>8.1f} {t['rotate_ms']:>10.1f} "
+            f"{t['denoise_ms']:>11.1f} {t['binarize_ms']:>12.1f} {total:>9.1f}"
+        )
+    print(f"mean preprocessing cost: {np.mean(totals):.1f} ms/page")
+
+    if not args.ocr:
+        return
+
+    from src.app.utilities.document_ocr import DocumentOCR
+
+    ocr = DocumentOCR()
+    print(f"\n{'page':>4} {'raw s':>7} {'pre s':>7} {'raw conf':>9} {'pre conf':>9} {'raw kept':>9} {'pre kept':>9}")
+    raw_s = pre_s = 0.0
+    for i, page in enumerate(pages):
+        r = ocr_stats(ocr, page)
+        start = time.perf_counter()
+        cleaned = pre.process(page, cfg)
+        p = ocr_stats(ocr, cleaned)
+        pre_total = time.perf_counter() - start
+        raw_s += r[0]
+        pre_s += pre_total
+        print(f"{i + 1:>4} {r[0]:>7.2f} {pre_total:>7.2f} {r[1]:>9.3f} {p[1]:>9.3f} {r[3]:>4}/{r[2]:<4} {p[3]:>4}/{p[2]:<4}")
+    print(f"OCR time per page: raw {raw_s / len(pages):.2f}s, preprocessed (incl. preprocessing) {pre_s / len(pages):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
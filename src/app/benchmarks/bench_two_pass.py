@@ -0,0 +1,105 @@
+""" Benchmark the two pass OCR mode against greedy only and beam search only runs.
+
+Pages are synthetic handwriting: script fonts, uneven stroke width, blur and noise, with known text,
+so accuracy is measured as the character similarity of the OCR output to the ground truth.
+Needs the EasyOCR models.
+
+Run with: python -m src.app.benchmarks.bench_two_pass [--pages 4]
+"""
+
+import argparse
+import difflib
+import tempfile
+import time
+
+from dataclasses import replace
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.app.utilities.document_ocr import DocumentOCR, OCRArguments, RefineConfig
+
+
+LINES = [
+    "Problem 4: find the tension in each rope",
+    "T1 cos 30 = T2 cos 45",
+    "T1 sin 30 + T2 sin 45 = 98 N",
+    "so T1 = 71.7 N and T2 = 87.8 N",
+    "check: the sum of forces is zero",
+    "the block does not move",
+]
+FONTS = [cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, cv2.FONT_HERSHEY_SCRIPT_COMPLEX, cv2.FONT_HERSHEY_SIMPLEX]
+
+
+def handwritten_page(seed: int, width: int = 2125, height: int = 2750) -> tuple[np.ndarray, str]:
+    """ A page of script lines with wobbly baselines, blur and noise, plus its text """
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width), 255, np.uint8)
+    truth: list[str] = []
+    y = 180
+    while y < height - 200:
+        text = LINES[int(rng.integers(len(LINES)))]
+        x = int(rng.integers(100, 220))
+        scale = float(rng.uniform(1.4, 2.0))
+        font = FONTS[int(rng.integers(len(FONTS)))]
+        for word in text.split():
+            cv2.putText(page, word, (x, y + int(rng.integers(-6, 7))), font, scale, 20, int(rng.integers(2, 5)), cv2.LINE_AA)
+            (w, _), _ = cv2.getTextSize(word, font, scale, 3)
+            x += w + int(rng.integers(18, 40))
+        truth.append(text)
+        y += int(rng.integers(95, 130))
+
+    page = cv2.GaussianBlur(page, (5, 5), 1.2)
+    noisy = page.astype(np.float32) + rng.normal(0.0, 18.0, page.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8), "\n".join(truth)
+
+
+def similarity(blocks: list[dict], truth: str) -> float:
+    text = " ".join(b["text"] for b in blocks)
+    return difflib.SequenceMatcher(None, " ".join(text.split()), " ".join(truth.split())).ratio()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--refine-decoder", default="beamsearch", choices=["beamsearch", "wordbeamsearch"])
+    args = parser.parse_args()
+
+    base = OCRArguments()
+    ocr = DocumentOCR(base)  # one reader, the modes only swap the arguments
+    modes = {
+        "greedy": base,
+        "two pass": replace(base, refine=RefineConfig(enabled=True, decoder=args.refine_decoder)),
+        "beam search": replace(base, decoder=args.refine_decoder),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pages: list[tuple[Path, str]] = []
+        for i in range(args.pages):
+            image, truth = handwritten_page(i)
+            path = Path(tmp) / f"page_{i + 1}.png"
+            cv2.imwrite(str(path), image)
+            pages.append((path, truth))
+
+        print(f"{'mode':<12} {'s/page':>7} {'accuracy':>9} {'blocks':>7} {'refined':>8} {'improved':>9}")
+        for name, mode in modes.items():
+            ocr.args = mode
+            took = 0.0
+            scores: list[float] = []
+            blocks = refined = improved = 0
+            for i, (path, truth) in enumerate(pages, start=1):
+                start = time.perf_counter()
+                page = ocr.ocr_page(i, path)
+                took += time.perf_counter() - start
+                scores.append(similarity(page["blocks"], truth))
+                blocks += len(page["blocks"])
+                refined += page["refined_blocks"]
+                improved += page["improved_blocks"]
+            print(
+                f"{name:<12} {took / len(pages):>7.2f} {np.mean(scores):>9.3f} {blocks:>7} {refined:>8} {improved:>9}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+""" Load test one API instance to find how many concurrent jobs it takes before latency or memory give out.
+
+Boots `uvicorn src.app.main:app` in a subprocess with the stub OCR engine (DOC_OCR_ENGINE=stub, a fixed
+delay per page in place of the models) and the in-memory Mongo stand-in (mongomock://), fresh for every
+concurrency level. Upload validation, rasterization, scheduling, math tagging, docx rendering and the API
+itself are the real code, so poppler is needed like in the container. With --url an instance that is
+already running is tested instead (pass its --pid for memory numbers).
+
+At every --concurrency level that many virtual users repeat a client session for --duration seconds:
+create a job, upload a PDF (page count drawn from --pages) while polling the job status every --poll
+seconds (now and then fetching the partial pages), then download the result once the job is done.
+Reported per level: latency percentiles per request type and for whole jobs, throughput, error rate and
+the server's resident memory. The highest level within --slo-p95 / --max-error-rate / --memory-mib is
+suggested as the container concurrency.
+
+Needs httpx, and mongomock for the default Mongo stand-in.
+
+Run with: python -m src.app.benchmarks.load_test --concurrency 1 2 4 8 --duration 60 [--json out.json]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Optional
+
+import cv2
+import numpy as np
+
+from PIL import Image
+
+try:
+    import httpx
+except ImportError:   # not needed by the service itself
+    httpx = None
+
+
+TERMINAL = ("SUCCEEDED", "FAILED", "EXPIRED")
+PERCENTILES = (50, 95, 99)
+
+
+def scan_page(seed: int, width: int = 1275, height: int = 1650) -> np.ndarray:
+    """ A grey page of text lines with some noise, about what a phone scan at 150 dpi looks like """
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width), 235, np.uint8)
+    for y in range(120, height - 100, 60):
+        words = int(rng.integers(4, 10))
+        cv2.putText(page, " ".join(["lorem"] * words), (90, y), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 30, 2, cv2.LINE_AA)
+    noisy = page.astype(np.float32) + rng.normal(0.0, 12.0, page.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def make_pdf(pages: int, seed: int = 0) -> bytes:
+    images = [Image.fromarray(scan_page(seed + i)) for i in range(pages)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, "PDF", save_all=True, append_images=images[1:], resolution=150.0)
+    return buffer.getvalue()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mib(pid: int) -> Optional[float]:
+    """ Resident set size of a process from /proc (Linux, like Cloud Run), None elsewhere """
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        return None
+    return None
+
+
+@dataclass
+class LevelStats:
+    users: int
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    requests: Counter = field(default_factory=Counter)
+    errors: Counter = field(default_factory=Counter)   # "<request>:<status or exception>"
+    jobs_done: int = 0
+    jobs_failed: int = 0
+    pages_done: int = 0
+    rss: list[float] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def record(self, kind: str, seconds: float, error: Optional[str] = None) -> None:
+        self.requests[kind] += 1
+        self.latencies[kind].append(seconds)
+        if error is not None:
+            self.errors[f"{kind}:{error}"] += 1
+
+    def summary(self) -> dict[str, Any]:
+        total = sum(self.requests.values())
+        jobs = self.jobs_done + self.jobs_failed
+        return {
+            "users": self.users,
+            "seconds": round(self.elapsed, 1),
+            "jobs": jobs,
+            "jobsFailed": self.jobs_failed,
+            "jobsPerSecond": self.jobs_done / self.elapsed if self.elapsed else 0.0,
+            "pagesPerSecond": self.pages_done / self.elapsed if self.elapsed else 0.0,
+            "requestsPerSecond": total / self.elapsed if self.elapsed else 0.0,
+            "errorRate": sum(self.errors.values()) / total if total else 0.0,
+            "errors": dict(self.errors),
+            "latency": {
+                kind: {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES} | {"count": len(values)}
+                for kind, values in sorted(self.latencies.items())
+            },
+            "rssStartMiB": self.rss[0] if self.rss else None,
+            "rssPeakMiB": max(self.rss) if self.rss else None,
+        }
+
+
+class Session:
+    """ One virtual user: create, upload while polling, download, repeat until the deadline """
+
+    def __init__(self, client: "httpx.AsyncClient", stats: LevelStats, pdfs: dict[int, bytes], args: argparse.Namespace, seed: int) -> None:
+        self.client = client
+        self.stats = stats
+        self.pdfs = pdfs
+        self.args = args
+        self.rng = random.Random(seed)
+
+    async def request(self, kind: str, method: str, url: str, **kwargs: Any) -> Optional["httpx.Response"]:
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.record(kind, time.perf_counter() - started, type(e).__name__)
+            return None
+        error = None if response.status_code < 400 else str(response.status_code)
+        self.stats.record(kind, time.perf_counter() - started, error)
+        return response
+
+    async def run(self, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            await self.job()
+
+    async def job(self) -> None:
+        started = time.perf_counter()
+        created = await self.request("create", "POST", "/v1/jobs")
+        if created is None or created.status_code != 200:
+            await asyncio.sleep(self.args.poll)
+            return
+        job_id = created.json()["job_id"]
+
+        pages = self.rng.choice(self.args.pages)
+        upload = asyncio.create_task(self.request(
+            "upload", "POST", f"/v1/jobs/{job_id}/file",
+            files={"file": (f"{pages}_pages.pdf", self.pdfs[pages], "application/pdf")},
+        ))
+
+        # The browser polls while the upload request is open (inline mode holds it until the job is done)
+        status = None
+        while status not in TERMINAL:
+            await asyncio.sleep(self.args.poll)
+            polled = await self.request("status", "GET", f"/v1/jobs/{job_id}")
+            if polled is not None and polled.status_code == 200:
+                status = polled.json().get("status")
+            if upload.done():
+                uploaded = upload.result()
+                if uploaded is None or uploaded.status_code >= 400:
+                    status = "FAILED"
+            if status not in TERMINAL and self.rng.random() < self.args.partial_ratio:
+                await self.request("pages", "GET", f"/v1/jobs/{job_id}/pages")
+        await upload
+
+        if status == "SUCCEEDED":
+            result = await self.request("result", "GET", f"/v1/jobs/{job_id}/result")
+            if result is not None and result.status_code == 200:
+                self.stats.jobs_done += 1
+                self.stats.pages_done += pages
+                self.stats.record("job", time.perf_counter() - started)
+                return
+        self.stats.jobs_failed += 1
+
+
+@asynccontextmanager
+async def server(args: argparse.Namespace, log_dir: Path, level: int) -> AsyncIterator[tuple[str, Optional[int]]]:
+    """ Base URL and pid of the instance under test, a fresh uvicorn process unless --url was given """
+    if args.url:
+        yield args.url, args.pid
+        return
+
+    port = free_port()
+    env = {
+        **os.environ,
+        "DOC_OCR_ENGINE": "stub",
+        "DOC_OCR_STUB_SECONDS_PER_PAGE": str(args.seconds_per_page),
+        "DOC_OCR_MONGO_ATLAS_URI": args.mongo_uri,
+        "DOC_OCR_ADMISSION": "1" if args.admission else "0",
+        "CORS_WHITELIST": os.environ.get("CORS_WHITELIST", "*"),
+    }
+    if args.workers:
+        env["DOC_OCR_WORKERS"] = str(args.workers)
+
+    log_path = log_dir / f"server_{level}.log"
+    with log_path.open("wb") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+            env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=url) as client:
+            for _ in range(300):
+                if process.poll() is not None:
+                    raise RuntimeError(f"server exited with {process.returncode}, see {log_path}")
+                try:
+                    if (await client.get("/")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError(f"server did not come up, see {log_path}")
+        yield url, process.pid
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def run_level(args: argparse.Namespace, users: int, pdfs: dict[int, bytes], log_dir: Path) -> LevelStats:
+    stats = LevelStats(users)
+    async with server(args, log_dir, users) as (url, pid):
+        limits = httpx.Limits(max_connections=users * 3, max_keepalive_connections=users * 3)
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+            stop = asyncio.Event()
+
+            async def sample_rss() -> None:
+                while pid is not None and not stop.is_set():
+                    rss = rss_mib(pid)
+                    if rss is not None:
+                        stats.rss.append(rss)
+                    await asyncio.sleep(0.5)
+
+            sampler = asyncio.create_task(sample_rss())
+            started = time.monotonic()
+            deadline = started + args.duration
+            sessions = [Session(client, stats, pdfs, args, seed=users * 1000 + i).run(deadline) for i in range(users)]
+            # Sessions only check the deadline between jobs, the jobs in flight are let finish
+            await asyncio.gather(*sessions)
+            stats.elapsed = time.monotonic() - started
+            stop.set()
+            await sampler
+    return stats
+
+
+def print_level(summary: dict[str, Any]) -> None:
+    rss = f"{summary['rssStartMiB']:.0f} -> {summary['rssPeakMiB']:.0f} MiB" if summary["rssPeakMiB"] else "n/a"
+    print(
+        f"\n== {summary['users']} concurrent users, {summary['seconds']}s: {summary['jobs']} jobs "
+        f"({summary['jobsFailed']} failed), {summary['jobsPerSecond']:.2f} jobs/s, {summary['pagesPerSecond']:.2f} pages/s, "
+        f"{summary['requestsPerSecond']:.1f} req/s, errors {summary['errorRate']:.1%}, RSS {rss}"
+    )
+    print(f"   {'request':<8} {'count':>6} " + " ".join(f"{'p' + str(p) + ' s':>8}" for p in PERCENTILES))
+    for kind, lat in summary["latency"].items():
+        print(f"   {kind:<8} {lat['count']:>6} " + " ".join(f"{lat['p' + str(p)]:>8.3f}" for p in PERCENTILES))
+    for error, count in sorted(summary["errors"].items(), key=lambda e: -e[1]):
+        print(f"   error {error}: {count}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="virtual users per level")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds each level starts new jobs for")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 1, 2, 3, 5, 10], help="page counts uploads are drawn from")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between status polls")
+    parser.add_argument("--partial-ratio", type=float, default=0.1, help="chance a poll also fetches the partial pages")
+    parser.add_argument("--seconds-per-page", type=float, default=0.5, help="stub OCR time per page")
+    parser.add_argument("--workers", type=int, default=0, help="DOC_OCR_WORKERS of the server, 0 keeps its default")
+    parser.add_argument("--admission", action="store_true", help="keep the page budget admission control on")
+    parser.add_argument("--mongo-uri", default="mongomock://", help="Mongo of the booted server, the in-memory stand-in by default")
+    parser.add_argument("--url", help="test a running instance instead of booting one")
+    parser.add_argument("--pid", type=int, help="pid of the --url instance, for memory numbers")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds before a request counts as failed")
+    parser.add_argument("--slo-p95", type=float, default=60.0, help="acceptable p95 seconds for a whole job")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--memory-mib", type=float, default=2048.0, help="container memory limit")
+    parser.add_argument("--json", type=Path, help="write every level's numbers here")
+    args = parser.parse_args()
+
+    if httpx is None:
+        parser.error("the load test needs httpx: pip install httpx")
+
+    pdfs = {pages: make_pdf(pages, seed=pages) for pages in set(args.pages)}
+    summaries: list[dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="doc_ocr_load_") as log_dir:
+        for users in args.concurrency:
+            summary = asyncio.run(run_level(args, users, pdfs, Path(log_dir))).summary()
+            summaries.append(summary)
+            print_level(summary)
+
+    if args.json:
+        args.json.write_text(json.dumps({"args": vars(args), "levels": summaries}, indent=2, default=str))
+
+    ok = [
+        s for s in summaries
+        if "job" in s["latency"] and s["latency"]["job"]["p95"] <= args.slo_p95
+        and s["errorRate"] <= args.max_error_rate
+        and (s["rssPeakMiB"] is None or s["rssPeakMiB"] <= args.memory_mib)
+    ]
+    if ok:
+        best = max(ok, key=lambda s: s["users"])
+        print(
+            f"\nHighest concurrency within a {args.slo_p95:.0f}s job p95, {args.max_error_rate:.0%} errors and "
+            f"{args.memory_mib:.0f} MiB: {best['users']} ({best['jobsPerSecond']:.2f} jobs/s)"
+        )
+    else:
+        print("\nNo level met the limits, try lower concurrency or more OCR workers")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,34 @@
 """ Entry point for the fastapi application"""
 
 import os
+import hmac
+import asyncio
 import logging
 
+from dataclasses import asdict
 from pathlib import Path
+from typing import Optional
 from uuid import uuid4
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
 from fastapi.concurrency import run_in_threadpool
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from src.app.utilities.admission import AdmissionRejected
 from src.app.utilities.app_logger import AppLogger
-from src.app.utilities.pdf_intake import PDFIntake
-from src.app.utilities.document_ocr import DocumentOCR, OCRArguments
-from src.app.utilities.omml_pass import MathPass
-from src.app.utilities.docx_tool import DocxTool
+from src.app.utilities.document_ocr import DocumentOCR
+from src.app.utilities.job_profiler import PROFILE_FILES
+from src.app.utilities.ocr_codec import write_pages
+from src.app.utilities.page_store import PageStore
+from src.app.utilities.reader_registry import language_key
 
-from src.app.utilities.mongodb_utils.job_store_util import MongoJobStore
-from src.app.utilities.mongodb_utils.mongo_client import get_jobs_collection
 from src.app.utilities.mongodb_utils.mongo_client import MongoStore
 
 from src.app.main_workflow.job_status_enums import JobStatus, JobStep
+from src.app.main_workflow.job_events import event_from_job, format_sse, is_terminal
+from src.app.main_workflow.setup import build_admission, build_pipeline, ocr_languages
+from src.app.main_workflow.workflow_arguments import JobSettings
 
 
 # TODO: Package and encapsulate all of these setup/init calls
@@ -49,34 +56,68 @@ app.add_middleware(
     expose_headers=["Content-Disposition"],
 )
 
-# Mongo DB Init
-jobs_col = get_jobs_collection()
-job_store = MongoJobStore(jobs_col)
-
-# Tools init
-pdf_intake = PDFIntake()
-math_pass = MathPass()
-docx_tool = DocxTool()
-ocr_engine = DocumentOCR(
-    OCRArguments(
-        languages=("en",),
-        gpu=False,
-        min_confidence=0.30,
-        paragraph=False,
-    )
-)
+# "inline": the instance that takes an upload also OCRs it, takes over stalled jobs and helps drain the queue.
+# "enqueue": uploads are stored and put on the shared work queue for `python -m src.app.main_workflow.main worker`
+# processes (or inline instances), the API never loads the OCR models.
+API_MODE: str = os.getenv("DOC_OCR_API_MODE", "inline")
+if API_MODE not in ("inline", "enqueue"):
+    raise RuntimeError(f"[CONFIG FAIL] Unknown DOC_OCR_API_MODE: {API_MODE}")
+
+# Mongo DB, tools and the job pipeline (see main_workflow/setup.py)
+pipeline = build_pipeline(run_ocr=API_MODE == "inline")
+job_store = pipeline.job_store
+artifacts = pipeline.artifacts
+queue = pipeline.queue
+events = pipeline.events
+pdf_intake = pipeline.pdf_intake
+docx_tool = pipeline.docx_tool
+scheduler = pipeline.scheduler
+ocr_engine = pipeline.ocr_engine
+
+# Languages a job may ask for, each distinct set loads its own reader on the instance that OCRs it
+OCR_LANGUAGES = ocr_languages()
+
+# Page budgets per client and for the whole service, checked before anything is rasterized
+admission = build_admission()
+
+SSE_KEEPALIVE_SECONDS: float = 15.0
 
-BASE_TMP: Path = Path("/tmp/jobs")
+# An upload or resume carrying this header with the admin token is profiled, whatever its settings say
+PROFILE_HEADER: str = "X-Doc-OCR-Profile"
+ADMIN_TOKEN: str = os.getenv("DOC_OCR_ADMIN_TOKEN", "")
+
+# Jobs are leased to the instance running them and heartbeated, an instance that disappears mid job
+# stops heartbeating and another one takes the job over from its last checkpoint.
+RECOVERY_INTERVAL_SECONDS: float = 30.0
+QUEUE_POLL_SECONDS: float = 5.0
+_background_tasks: list[asyncio.Task] = []
 
 
 @app.on_event("startup")
 async def startup() -> None:
+    events.bind_loop(asyncio.get_running_loop())
     await run_in_threadpool(job_store.ensure_indexes)
+    await run_in_threadpool(artifacts.ensure_indexes)
+    await run_in_threadpool(queue.ensure_indexes)
+    await run_in_threadpool(admission.ensure_indexes)
     log.info("MongoDB Indices Validated")
+
+    if scheduler is not None:
+        scheduler.start()
+        _background_tasks.append(asyncio.create_task(
+            pipeline.consume(job_store.claim_stalled_job, RECOVERY_INTERVAL_SECONDS)
+        ))
+        _background_tasks.append(asyncio.create_task(
+            pipeline.consume_queue(QUEUE_POLL_SECONDS, purge=False)
+        ))
     log.info("Startup loop complete")
 
 @app.on_event("shutdown")
 async def shutdown() -> None:
+    for task in _background_tasks:
+        task.cancel()
+    if scheduler is not None:
+        scheduler.stop()
     MongoStore.close()
     log.info("Mongo client closed.")
     log.info("Shutdown complete")
@@ -88,13 +129,28 @@ async def read_root():
 
 
 @app.post("/v1/jobs")
-async def start_job():
+async def start_job(request: Request, settings: Optional[JobSettings] = None):
     """ Create a Job doc and start the workflow, return the status, upload, and result urls"""
 
     # 1: Create a Job document in the mongo nosql databased
     # Include: settings, time created, expired, etc
     job_id = str(uuid4())
-    settings = {"languages": ["en"], "min_confidence": 0.30}
+    settings = settings or JobSettings()
+    try:
+        settings.languages = list(language_key(settings.languages))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+    unsupported = sorted(set(settings.languages) - OCR_LANGUAGES)
+    if unsupported:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unsupported OCR languages: {', '.join(unsupported)}, expected any of {', '.join(sorted(OCR_LANGUAGES))}",
+        )
+    # Profiling turns tracemalloc on for the whole instance, only an admin may ask for it
+    if settings.profile and not _profile_requested(request):
+        log.warning(f"Job {job_id}: profile setting ignored, it needs the {PROFILE_HEADER} admin token")
+        settings.profile = False
+    settings = asdict(settings)
     await run_in_threadpool(job_store.create_job, job_id, settings)
 
     result = {
@@ -102,12 +158,13 @@ async def start_job():
         "status_url":f"/v1/jobs/{job_id}",
         "upload_url":f"/v1/jobs/{job_id}/file",
         "result_url":f"/v1/jobs/{job_id}/result",
+        "pages_url":f"/v1/jobs/{job_id}/pages",
     }
 
     return result
 
 @app.post("/v1/jobs/{job_id}/file")
-async def job_handle_file(job_id: str, file: UploadFile = File(...)):
+async def job_handle_file(job_id: str, request: Request, file: UploadFile = File(...)):
     """ 
     Main loop. Analyzes .pdf file, performs OCR, outputs DOCX
     
@@ -117,127 +174,157 @@ async def job_handle_file(job_id: str, file: UploadFile = File(...)):
     if not job:
         raise HTTPException(status_code=404, detail="Job not found, must create it first")
 
-    job_dir = BASE_TMP/ job_id
-    out_docx = job_dir / "result.docx"
-
-    try:
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            status=JobStatus.PROCESSING,
-            step=JobStep.VALIDATE,
-            progress=5
-        )
-        pdf_path = await pdf_intake.validate_save_upload(
-            upload=file,
-            job_dir=job_dir
-        )
-        pdf_size = pdf_path.stat().st_size
-
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            status=JobStatus.UPLOADED,
-            step=JobStep.VALIDATE,
-            progress=15,
-            input_update={
-                "originalFilename": file.filename,
-                "contentType": file.content_type,
-                "sizeBytes": pdf_size,
-                "pdfPath": str(pdf_path),
-            },
-        )
-
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            status=JobStatus.PROCESSING,
-            step=JobStep.CONVERT_PAGES,
-            progress=20
-        )
-
-        images_dir = job_dir / "pages"
-        image_paths = pdf_intake.pdf_to_jpeg(pdf_path, images_dir)
-
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            step=JobStep.CONVERT_PAGES,
-            progress=35,
-            input_update={"imagesDir": str(images_dir), "pageCount": len(image_paths)},
-        )
-
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            step=JobStep.PROCESS_OCR,
-            progress=40
-        )
-
-        ocr_result = await run_in_threadpool(ocr_engine.ocr_pages, image_paths)
-
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            step=JobStep.PROCESS_OCR,
-            progress=75,
-            output_update={"totalBlocks": ocr_result.get("total_blocks", 0)},
-        )
-
-        ocr_tagged = await run_in_threadpool(math_pass.tag_blocks, ocr_result)
-
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            step=JobStep.RENDER_DOCX,
-            progress=85
-        )
-
-        await run_in_threadpool(
-            docx_tool.render_document,
-            ocr_tagged,
-            out_docx
-        )
-
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            status=JobStatus.SUCCEEDED,
-            step=JobStep.DONE,
-            progress=100,
-            output_update={"resultPath": str(out_docx)},
-        )
+    job_dir = pipeline.job_dir(job_id)
+    profile = _profile_requested(request)
+    if not await pipeline.claim(job_id):
+        raise HTTPException(status_code=409, detail="Job is already being processed.")
+
+    async with pipeline.lease(job_id):
+        try:
+            if profile:
+                job = await run_in_threadpool(job_store.update_job, job_id, settings_update={"profile": True})
+            await run_in_threadpool(
+                job_store.update_job,
+                job_id,
+                status=JobStatus.PROCESSING,
+                step=JobStep.VALIDATE,
+                progress=5
+            )
+            pdf_path = await pdf_intake.validate_save_upload(
+                upload=file,
+                job_dir=job_dir
+            )
+            pdf_size = pdf_path.stat().st_size
+
+            # Admission on the page count from the PDF header, before any rasterization
+            page_count = await run_in_threadpool(pdf_intake.page_count, pdf_path)
+            start_delay = await run_in_threadpool(admission.admit, _client_id(request), page_count)
+
+            # A new upload starts over, pages of a previous upload don't belong to this one
+            await run_in_threadpool(pipeline.clear_pages, job_id, job_dir)
+            await run_in_threadpool(artifacts.save_file, job_id, "input.pdf", pdf_path)
+            await run_in_threadpool(job_store.checkpoint_stage, job_id, JobStep.VALIDATE.value)
+
+            await run_in_threadpool(
+                job_store.update_job,
+                job_id,
+                status=JobStatus.UPLOADED,
+                step=JobStep.VALIDATE,
+                progress=15,
+                input_update={
+                    "originalFilename": file.filename,
+                    "contentType": file.content_type,
+                    "sizeBytes": pdf_size,
+                    "pdfPath": str(pdf_path),
+                    "pageCount": page_count,
+                },
+            )
+
+        except AdmissionRejected as e:
+            # Not a failure of the job, the same job can be uploaded to again later
+            pdf_path.unlink(missing_ok=True)
+            await run_in_threadpool(
+                job_store.update_job, job_id, status=JobStatus.CREATED, progress=0, error={"message": e.detail}
+            )
+            raise HTTPException(status_code=e.status_code, detail=e.detail, headers=e.headers)
+
+        except HTTPException as e:
+            await pipeline.fail(job_id, e.detail)
+            raise
+
+        except Exception as e:
+            await pipeline.fail(job_id, str(e))
+            raise HTTPException(status_code=500, detail="Processing failed.") from e
+
+        if scheduler is not None and start_delay == 0:
+            return await pipeline.process(job_id, job_dir, pdf_path, page_count, job.get("settings"))
+        # From here on only the queue delivers the job, so its start delay holds
+        await run_in_threadpool(job_store.set_queued, job_id, True)
+
+    # Queued once the lease is released, so whoever claims the item can take the job straight away.
+    # A job admitted ahead of its page budget only becomes visible in the queue once the budget covers it.
+    await run_in_threadpool(queue.enqueue, job_id, start_delay)
+    return _queued_response(job_id, start_delay)
+
+@app.post("/v1/jobs/{job_id}/resume")
+async def resume_job(job_id: str, request: Request):
+    """
+    Re-run a failed job from its last completed page, pages already in the page store are not OCR'd again.
 
-        return {
+    :param job_id: The unique job id.
+    """
+    job = await run_in_threadpool(job_store.get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.get("status") != JobStatus.FAILED.value:
+        raise HTTPException(status_code=409, detail=f"Only failed jobs can be resumed, job is {job.get('status')}")
+
+    profile = _profile_requested(request)
+    if not await pipeline.claim(job_id):
+        raise HTTPException(status_code=409, detail="Job is already being processed.")
+
+    async with pipeline.lease(job_id):
+        if profile:
+            job = await run_in_threadpool(job_store.update_job, job_id, settings_update={"profile": True})
+        job_dir = pipeline.job_dir(job_id)
+        pdf_path = await run_in_threadpool(pipeline.restore_files, job_id, job_dir)
+        if pdf_path is None:
+            raise HTTPException(status_code=409, detail="The uploaded PDF is no longer available, upload it again.")
+
+        if scheduler is not None:
+            return await pipeline.process(
+                job_id, job_dir, pdf_path, job.get("input", {}).get("pageCount"), job.get("settings")
+            )
+        await run_in_threadpool(job_store.update_job, job_id, status=JobStatus.UPLOADED, error={})
+        await run_in_threadpool(job_store.set_queued, job_id, True)
+
+    # Back in the queue with a fresh set of attempts, for any instance to claim
+    await run_in_threadpool(queue.enqueue, job_id)
+    return _queued_response(job_id)
+
+def _queued_response(job_id: str, start_delay: float = 0.0) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content={
             "job_id": job_id,
-            "status": JobStatus.SUCCEEDED,
-            "step": JobStep.DONE,
-            "page_count": ocr_result["page_count"],
-            "total_blocks": ocr_result["total_blocks"],
+            "status": JobStatus.UPLOADED,
+            "starts_in_seconds": round(start_delay, 1),
+            "status_url": f"/v1/jobs/{job_id}",
+            "events_url": f"/v1/jobs/{job_id}/events",
             "download_url": f"/v1/jobs/{job_id}/result",
-        }
+        },
+    )
 
-    except HTTPException as e:
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            status=JobStatus.FAILED,
-            step=JobStep.DONE,
-            progress=100,
-            error={"message": e.detail},
-        )
-        raise
-
-    except Exception as e:
-        await run_in_threadpool(
-            job_store.update_job,
-            job_id,
-            status=JobStatus.FAILED,
-            step=JobStep.DONE,
-            progress=100,
-            error={"message": str(e)},
-        )
-        raise HTTPException(status_code=500, detail="Processing failed.") from e
+def _client_id(request: Request) -> str:
+    """
+    Who the page budget is charged to: the client address. Behind Cloud Run's front end the last
+    X-Forwarded-For entry is the one it added, earlier entries are whatever the client sent.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+def _profile_requested(request: Request) -> bool:
+    """ True when the request carries the admin profiling header, 403 when its token is wrong """
+    token = request.headers.get(PROFILE_HEADER)
+    if token is None:
+        return False
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail=f"Invalid {PROFILE_HEADER} token.")
+    return True
+
+@app.get("/v1/queue")
+async def get_queue_depth():
+    """ Depth of every work queue: ready, delayed (retry backoff), in flight, stalled and dead lettered items """
+    return {"queues": await run_in_threadpool(queue.depths)}
+
+@app.get("/v1/ocr/readers")
+async def get_ocr_readers():
+    """ OCR language sets loaded on this instance, with load / eviction counts and timings """
+    if ocr_engine is None:
+        raise HTTPException(status_code=404, detail="This instance does not run OCR (DOC_OCR_API_MODE=enqueue).")
+    return ocr_engine.readers.stats()
 
 @app.get("/v1/jobs/{job_id}")
 async def get_job_status(job_id: str):
@@ -250,14 +337,59 @@ async def get_job_status(job_id: str):
     if not document:
         raise HTTPException(status_code=404, detail="Job not found")
 
+    # Queue position / estimated start, only while this instance has the job's pages scheduled
+    schedule = scheduler.snapshot(job_id) if scheduler is not None else None
+    if schedule is not None:
+        document["schedule"] = schedule
+
     return document
 
+@app.get("/v1/jobs/{job_id}/events")
+async def get_job_events(job_id: str, request: Request):
+    """
+    Server-sent events stream of a job's progress, closes once the job succeeds, fails or expires.
+
+    Events come from this process when it is running the job, otherwise from a Mongo change stream
+    on the job document shared by every client of that job (slow polling where change streams aren't
+    available). A job that expires (TTL delete) sends a final EXPIRED event.
+
+    :param job_id: The unique job id.
+    """
+    document = await run_in_threadpool(job_store.get_job, job_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def stream():
+        with events.subscribe(job_id) as events_queue:
+            current = events.latest(job_id) or event_from_job(document)
+            yield format_sse(current)
+            if is_terminal(current):
+                return
+
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(events_queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+
+                yield format_sse(event)
+                if is_terminal(event):
+                    break
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/v1/jobs/{job_id}/result")
 def get_job_result(job_id: str):
-    job_dir = BASE_TMP / job_id
+    job_dir = pipeline.job_dir(job_id)
     out_docx = job_dir / "result.docx"
 
-    if not out_docx.exists():
+    # The job may have finished on another instance, the durable copy is in GridFS
+    if not out_docx.exists() and artifacts.restore_file(job_id, "result.docx", out_docx) is None:
         raise HTTPException(status_code=404, detail="Result not found (job not finished or invalid job_id).")
 
     # This one si straight from the docs
@@ -267,6 +399,86 @@ def get_job_result(job_id: str):
         filename=f"{job_id}.docx",
     )
 
+@app.get("/v1/jobs/{job_id}/profile")
+def get_job_profile(job_id: str, name: str = Query(PROFILE_FILES[0], alias="file")):
+    """
+    Profile of a job run with the `profile` setting (or the admin header).
+
+    `file=profile.txt` is the CPU report (time per section, hottest functions), `profile.collapsed` the
+    sampled stacks in folded format for speedscope / flamegraph.pl, `memory.txt` the top allocation sites.
+
+    :param job_id: The unique job id.
+    :param name: one of profile.txt, profile.collapsed, memory.txt
+    """
+    if name not in PROFILE_FILES:
+        raise HTTPException(status_code=400, detail=f"file must be one of {', '.join(PROFILE_FILES)}")
+
+    path = pipeline.job_dir(job_id) / "profile" / name
+    if not path.exists() and artifacts.restore_file(job_id, name, path) is None:
+        raise HTTPException(status_code=404, detail="Profile not found (job not profiled, not finished or invalid job_id).")
+
+    return FileResponse(path=str(path), media_type="text/plain", filename=f"{job_id}_{name}")
+
+@app.get("/v1/jobs/{job_id}/pages")
+async def get_job_pages(job_id: str, fmt: str = Query("json", alias="format")):
+    """
+    Pages finished so far, while the job is still running or after it failed.
+
+    `format=json` returns the math tagged page records, `format=docx` a document of those pages and
+    `format=npz` the records in the compact columnar encoding (read with `ocr_codec.ColumnarPages`).
+    The docx and npz are only rebuilt when more pages have finished since the last request.
+
+    :param job_id: The unique job id.
+    :param fmt: "json", "docx" or "npz"
+    """
+    if fmt not in ("json", "docx", "npz"):
+        raise HTTPException(status_code=400, detail="format must be json, docx or npz")
+
+    document = await run_in_threadpool(job_store.get_job, job_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    job_dir = pipeline.job_dir(job_id)
+    pages = await run_in_threadpool(PageStore.for_job(job_dir).load)
+    if not pages:
+        # Running (or ran) on another instance, its pages are checkpointed in Mongo
+        pages = await run_in_threadpool(artifacts.load_pages, job_id)
+
+    if fmt == "json":
+        return {
+            "job_id": job_id,
+            "status": document.get("status"),
+            "pagesDone": len(pages),
+            "pageCount": (document.get("input") or {}).get("pageCount"),
+            "pages": pages,
+        }
+
+    if not pages:
+        raise HTTPException(status_code=404, detail="No pages finished yet.")
+
+    partial = await run_in_threadpool(_partial_file, job_dir, pages, fmt)
+    media_type = (
+        "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        if fmt == "docx" else "application/octet-stream"
+    )
+    return FileResponse(path=str(partial), media_type=media_type, filename=f"{job_id}_partial_{len(pages)}.{fmt}")
+
+def _partial_file(job_dir: Path, pages: list[dict], fmt: str) -> Path:
+    """ Render / encode the finished pages once per page count, the page store only ever grows during a run """
+    partial_dir = job_dir / "partial"
+    out = partial_dir / f"pages_{len(pages)}.{fmt}"
+    if out.exists():
+        return out
+
+    if fmt == "docx":
+        docx_tool.render_document(DocumentOCR.collect_pages(pages), out)
+    else:
+        write_pages(out, pages)
+    for stale in partial_dir.glob(f"pages_*.{fmt}"):
+        if stale != out:
+            stale.unlink(missing_ok=True)
+    return out
+
 @app.get("/v1/smoke_test_backend")
 def smoke_test_container():
     return { "Service": "Healthy"}
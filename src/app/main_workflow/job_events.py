@@ -0,0 +1,174 @@
+""" In-process pub/sub for job progress, feeds the server-sent events endpoint """
+
+
+import asyncio
+import json
+import threading
+
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Iterator, Optional
+
+from src.app.main_workflow.job_status_enums import JobStatus
+from src.app.utilities.app_logger import AppLogger
+
+
+TERMINAL_STATUSES = frozenset({JobStatus.SUCCEEDED.value, JobStatus.FAILED.value, JobStatus.EXPIRED.value})
+
+# (job_id, on_change, stop) -> blocks until stop is set, on_change(None) means the job doc is gone
+RemoteWatch = Callable[[str, Callable[[Optional[dict[str, Any]]], None], threading.Event], None]
+
+
+def event_from_job(doc: dict[str, Any]) -> dict[str, Any]:
+    """ The slice of a job document that clients care about while they wait """
+    return {
+        "type": "job",
+        "jobId": doc.get("_id"),
+        "status": doc.get("status"),
+        "step": doc.get("step"),
+        "progress": doc.get("progress"),
+        "pageCount": (doc.get("input") or {}).get("pageCount"),
+        "totalBlocks": (doc.get("output") or {}).get("totalBlocks"),
+        "error": doc.get("error") or None,
+        "updatedAt": doc.get("updatedAt"),
+    }
+
+
+def expired_event(job_id: str) -> dict[str, Any]:
+    """ Jobs expire by TTL delete, there is no EXPIRED write to watch for """
+    return {"type": "job", "jobId": job_id, "status": JobStatus.EXPIRED.value}
+
+
+def format_sse(event: dict[str, Any]) -> str:
+    """ One server-sent events frame """
+    def _default(value: Any) -> str:
+        return value.isoformat() if isinstance(value, datetime) else str(value)
+
+    return f"event: {event.get('type', 'job')}\ndata: {json.dumps(event, default=_default)}\n\n"
+
+
+def is_terminal(event: dict[str, Any]) -> bool:
+    return event.get("type") == "job" and event.get("status") in TERMINAL_STATUSES
+
+
+class JobEventBus:
+    """
+    Fan job events out to the SSE connections of this process.
+
+    Publishers are the pipeline threads (job store updates, scheduler page callbacks), subscribers are
+    asyncio queues on the event loop, so publish() hops onto the loop with call_soon_threadsafe.
+    The latest event per job is kept so a client connecting mid-job gets the current state immediately.
+
+    Jobs running on another instance are followed through `remote_watch` (a Mongo change stream): one
+    watcher thread per job no matter how many clients are connected, stopped when the last client
+    leaves or when the job starts running here. Remote events for a job that is local are dropped,
+    so nothing is delivered twice.
+    """
+
+    def __init__(self, remote_watch: Optional[RemoteWatch] = None) -> None:
+        self.log = AppLogger.init_logger()
+        self._remote_watch = remote_watch
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._latest: dict[str, dict[str, Any]] = {}
+        self._local: set[str] = set()
+        self._watchers: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def mark_local(self, job_id: str) -> None:
+        """ This process is running the job, its events will show up here without Mongo """
+        with self._lock:
+            self._local.add(job_id)
+            stop = self._watchers.pop(job_id, None)
+        if stop is not None:
+            stop.set()
+
+    def is_local(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._local
+
+    def latest(self, job_id: str) -> Optional[dict[str, Any]]:
+        with self._lock:
+            return self._latest.get(job_id)
+
+    def publish(self, job_id: str, event: dict[str, Any], *, remote: bool = False) -> None:
+        """ Thread safe, may be called from any thread """
+        with self._lock:
+            if remote and job_id in self._local:
+                return
+            if event.get("type", "job") == "job":
+                self._latest[job_id] = event
+            if is_terminal(event):
+                self._local.discard(job_id)
+                self._latest.pop(job_id, None)
+            queues = list(self._subscribers.get(job_id, ()))
+
+        if self._loop is None or not queues:
+            return
+        for queue in queues:
+            self._loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def publish_job(self, doc: dict[str, Any]) -> None:
+        """ MongoJobStore on_update hook """
+        self.publish(doc["_id"], event_from_job(doc))
+
+    @contextmanager
+    def subscribe(self, job_id: str) -> Iterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(queue)
+            start_watch = (
+                self._remote_watch is not None
+                and job_id not in self._local
+                and job_id not in self._watchers
+            )
+            if start_watch:
+                self._watchers[job_id] = threading.Event()
+                stop = self._watchers[job_id]
+
+        if start_watch:
+            threading.Thread(
+                target=self._run_watch,
+                args=(job_id, stop),
+                name=f"job-watch-{job_id}",
+                daemon=True,
+            ).start()
+
+        try:
+            yield queue
+        finally:
+            stop_watch = None
+            with self._lock:
+                subs = self._subscribers.get(job_id)
+                if subs is not None:
+                    subs.discard(queue)
+                    if not subs:
+                        self._subscribers.pop(job_id, None)
+                        stop_watch = self._watchers.pop(job_id, None)
+            if stop_watch is not None:
+                stop_watch.set()
+
+    def subscriber_count(self, job_id: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(job_id, ()))
+
+    def watcher_count(self) -> int:
+        with self._lock:
+            return len(self._watchers)
+
+    def _run_watch(self, job_id: str, stop: threading.Event) -> None:
+        def on_change(doc: Optional[dict[str, Any]]) -> None:
+            event = event_from_job(doc) if doc is not None else expired_event(job_id)
+            self.publish(job_id, event, remote=True)
+
+        try:
+            self._remote_watch(job_id, on_change, stop)
+        except Exception as e:
+            self.log.error(f"Job watch failed for {job_id}: {e}")
+        finally:
+            with self._lock:
+                if self._watchers.get(job_id) is stop:
+                    self._watchers.pop(job_id, None)
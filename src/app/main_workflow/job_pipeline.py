@@ -0,0 +1,463 @@
+""" The job workflow shared by the API and the standalone worker: pdf -> page images -> OCR -> math tags -> docx """
+
+
+import asyncio
+import shutil
+import threading
+
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from src.app.main_workflow.job_events import JobEventBus
+from src.app.main_workflow.job_status_enums import JobStatus, JobStep
+from src.app.main_workflow.scheduler import PageScheduler
+from src.app.utilities.app_logger import AppLogger
+from src.app.utilities.document_ocr import DocumentOCR
+from src.app.utilities.docx_tool import DocxTool
+from src.app.utilities.image_preprocess import PreprocessConfig
+from src.app.utilities.job_profiler import JobProfiler
+from src.app.utilities.mongodb_utils.artifact_store import MongoArtifactStore
+from src.app.utilities.mongodb_utils.job_store_util import ACTIVE_STATUSES, MongoJobStore, utcnow
+from src.app.utilities.mongodb_utils.work_queue import MongoWorkQueue
+from src.app.utilities.omml_pass import MathPass
+from src.app.utilities.page_store import PageStore
+from src.app.utilities.pdf_intake import PDFIntake
+from src.app.utilities.reader_registry import language_key
+
+
+# (owner, lease_seconds) -> the claimed job doc, or None when there is no work
+ClaimJob = Callable[[str, float], Optional[dict[str, Any]]]
+
+
+class JobPipeline:
+    """
+    Runs one job end to end under a lease, checkpointing as it goes.
+
+    Every finished page is math tagged and written to the local page store (partial results) and to
+    Mongo (resume on another instance), so whoever picks the job up next only OCRs the missing pages.
+    `scheduler` is None on API replicas that only take uploads and leave the OCR to workers, they put
+    the job on the shared `queue` instead.
+    """
+
+    def __init__(
+        self,
+        *,
+        job_store: MongoJobStore,
+        artifacts: MongoArtifactStore,
+        queue: MongoWorkQueue,
+        events: JobEventBus,
+        pdf_intake: PDFIntake,
+        math_pass: MathPass,
+        docx_tool: DocxTool,
+        scheduler: Optional[PageScheduler],
+        base_dir: Path,
+        owner: str,
+        lease_seconds: float = 90.0,
+        ocr_engine: Optional[DocumentOCR] = None,
+    ) -> None:
+        self.log = AppLogger.init_logger()
+        self.job_store = job_store
+        self.artifacts = artifacts
+        self.queue = queue
+        self.events = events
+        self.pdf_intake = pdf_intake
+        self.math_pass = math_pass
+        self.docx_tool = docx_tool
+        self.scheduler = scheduler
+        self.base_dir = base_dir
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.ocr_engine = ocr_engine  # behind the scheduler, kept for its reader stats
+
+    def job_dir(self, job_id: str) -> Path:
+        return self.base_dir / job_id
+
+    async def claim(self, job_id: str) -> bool:
+        """ Take the lease on a job for this instance, False when another instance holds it """
+        claimed = await run_in_threadpool(self.job_store.claim_job, job_id, self.owner, self.lease_seconds)
+        if claimed is None:
+            return False
+        self.events.mark_local(job_id)
+        return True
+
+    @asynccontextmanager
+    async def lease(self, job_id: str, queued: bool = False) -> AsyncIterator[None]:
+        """ Heartbeat the lease (and the queue item's visibility when `queued`) while the body runs, release it afterwards """
+        async def heartbeat() -> None:
+            while True:
+                await asyncio.sleep(self.lease_seconds / 3)
+                alive = await run_in_threadpool(self.job_store.heartbeat, job_id, self.owner, self.lease_seconds)
+                if queued:
+                    alive = await run_in_threadpool(self.queue.extend, job_id, self.owner, self.lease_seconds) and alive
+                if not alive:
+                    self.log.warning(f"Job {job_id}: lease lost to another instance")
+                    return
+
+        task = asyncio.create_task(heartbeat())
+        try:
+            yield
+        finally:
+            task.cancel()
+            await run_in_threadpool(self.job_store.release_lease, job_id, self.owner)
+
+    async def consume(self, claim: ClaimJob, interval: float, *, purge: bool = True) -> None:
+        """
+        Loop forever: claim a job with `claim`, finish it, repeat. Sleeps `interval` when there is nothing
+        to claim (and purges expired job files while idle). Cancel the task to stop.
+        """
+        while True:
+            try:
+                job = await run_in_threadpool(claim, self.owner, self.lease_seconds)
+                if job is None:
+                    await self._idle(interval, purge)
+                    continue
+
+                await self.run_claimed(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log.error(f"Job consumer failed: {e}")
+                await asyncio.sleep(interval)
+
+    async def consume_queue(self, interval: float, *, purge: bool = True) -> None:
+        """
+        Loop forever: claim the next item of the shared work queue and run its job. A failed attempt goes
+        back in the queue with a backoff until the queue runs out of attempts. Failures that retrying
+        can't fix (a bad upload) are dead lettered straight away. Cancel the task to stop.
+        """
+        while True:
+            try:
+                item = await run_in_threadpool(self.queue.claim, self.owner, self.lease_seconds)
+                if item is None:
+                    await self._idle(interval, purge)
+                    continue
+
+                await self._run_queued(item, interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log.error(f"Queue consumer failed: {e}")
+                await asyncio.sleep(interval)
+
+    async def _idle(self, interval: float, purge: bool) -> None:
+        """ Nothing to claim: purge expired job files, then wait """
+        if purge:
+            expired_before = utcnow() - timedelta(hours=self.job_store.default_ttl_hours)
+            await run_in_threadpool(self.artifacts.purge_files, expired_before)
+        await asyncio.sleep(interval)
+
+    async def _run_queued(self, item: dict[str, Any], interval: float) -> None:
+        job_id = item["jobId"]
+        job = await run_in_threadpool(self.job_store.get_job, job_id)
+        if job is None or job.get("status") not in ACTIVE_STATUSES:
+            # Expired, or finished some other way (an inline instance took it over) since it was queued
+            await run_in_threadpool(self.queue.ack, job_id, self.owner)
+            await run_in_threadpool(self.job_store.set_queued, job_id, False)
+            return
+
+        job = await run_in_threadpool(self.job_store.claim_job, job_id, self.owner, self.lease_seconds)
+        if job is None:
+            # Another instance holds the job's lease (a resume request), try again later
+            await run_in_threadpool(self.queue.release, job_id, self.owner, interval)
+            return
+
+        try:
+            error = await self.run_claimed(job, queued=True, retryable=item["attempts"] < self.queue.max_attempts)
+        except asyncio.CancelledError:
+            # Shutting down, the next instance gets the item without it counting as a failed attempt
+            await run_in_threadpool(self.queue.release, job_id, self.owner)
+            raise
+
+        if error is None:
+            await run_in_threadpool(self.queue.ack, job_id, self.owner)
+        elif error.status_code < 500:
+            await run_in_threadpool(self.queue.dead_letter, job_id, self.owner, str(error.detail))
+        elif await run_in_threadpool(self.queue.retry, job_id, self.owner, str(error.detail)):
+            self.log.warning(f"Job {job_id}: attempt {item['attempts']} failed, queued again")
+            return
+        # Out of the queue, the stalled job recovery may take it over again (after a resume)
+        await run_in_threadpool(self.job_store.set_queued, job_id, False)
+
+    async def run_claimed(
+        self, job: dict[str, Any], queued: bool = False, retryable: bool = False
+    ) -> Optional[HTTPException]:
+        """
+        Finish a job this instance just claimed, from wherever its last owner got to.
+        Returns the failure (already recorded on the job), None when the job succeeded.
+        """
+        job_id = job["_id"]
+        checkpoint = job.get("checkpoint") or {}
+        self.log.info(
+            f"Job {job_id}: picked up, "
+            f"stages={checkpoint.get('stages')}, pagesDone={len(checkpoint.get('pagesDone') or [])}"
+        )
+        self.events.mark_local(job_id)
+
+        async with self.lease(job_id, queued):
+            job_dir = self.job_dir(job_id)
+            pdf_path = await run_in_threadpool(self.restore_files, job_id, job_dir)
+            if pdf_path is None:
+                message = "The instance stopped before the upload was stored, upload it again."
+                await self.fail(job_id, message)
+                return HTTPException(status_code=410, detail=message)
+
+            try:
+                await self.process(
+                    job_id,
+                    job_dir,
+                    pdf_path,
+                    (job.get("input") or {}).get("pageCount"),
+                    job.get("settings"),
+                    retryable=retryable,
+                )
+            except HTTPException as e:
+                return e
+            return None
+
+    def restore_files(self, job_id: str, job_dir: Path) -> Optional[Path]:
+        """ Bring the input PDF and the finished pages back to local disk, None when the PDF is gone """
+        pdf_path = job_dir / "input.pdf"
+        if not pdf_path.exists() and self.artifacts.restore_file(job_id, "input.pdf", pdf_path) is None:
+            return None
+
+        page_store = PageStore.for_job(job_dir)
+        local = page_store.page_indexes()
+        for page in self.artifacts.load_pages(job_id):
+            if page["page_index"] not in local:
+                page_store.append(page)
+        return pdf_path
+
+    def clear_pages(self, job_id: str, job_dir: Path) -> None:
+        """ Forget every page and checkpoint of a job, a new upload starts over """
+        PageStore.for_job(job_dir).clear()
+        self.artifacts.delete_job(job_id)
+        self.job_store.reset_checkpoint(job_id)
+        shutil.rmtree(job_dir / "pages", ignore_errors=True)
+        shutil.rmtree(job_dir / "partial", ignore_errors=True)
+        shutil.rmtree(job_dir / "profile", ignore_errors=True)
+
+    async def process(
+        self,
+        job_id: str,
+        job_dir: Path,
+        pdf_path: Path,
+        page_count: Optional[int] = None,
+        settings: Optional[dict[str, Any]] = None,
+        retryable: bool = False,
+    ) -> dict[str, Any]:
+        """
+        Rasterize, OCR and render a saved upload. Pages finished by an earlier run are reused.
+        With `retryable` an unexpected error leaves the job UPLOADED (with the error) instead of FAILED,
+        the queue runs it again.
+        With the `profile` setting the run is profiled and the profile stored with the job, whether it
+        succeeds or not.
+        """
+        if self.scheduler is None:
+            raise RuntimeError("This instance does not run OCR, jobs are processed by the workers")
+
+        if not (settings or {}).get("profile"):
+            return await self._process(job_id, job_dir, pdf_path, page_count, settings, retryable)
+
+        profiler = JobProfiler()
+        profiler.start()
+        try:
+            return await self._process(job_id, job_dir, pdf_path, page_count, settings, retryable, profiler)
+        finally:
+            profiler.stop()
+            await run_in_threadpool(self._save_profile, job_id, job_dir, profiler)
+
+    async def _process(
+        self,
+        job_id: str,
+        job_dir: Path,
+        pdf_path: Path,
+        page_count: Optional[int],
+        settings: Optional[dict[str, Any]],
+        retryable: bool,
+        profiler: Optional[JobProfiler] = None,
+    ) -> dict[str, Any]:
+        job_store = self.job_store
+        out_docx = job_dir / "result.docx"
+        page_store = PageStore.for_job(job_dir)
+
+        try:
+            await run_in_threadpool(
+                job_store.update_job,
+                job_id,
+                status=JobStatus.PROCESSING,
+                step=JobStep.CONVERT_PAGES,
+                progress=20,
+                error={},
+            )
+
+            images_dir = job_dir / "pages"
+            image_paths = await run_in_threadpool(
+                JobProfiler.maybe_wrap(profiler, "rasterize", self._page_images), pdf_path, images_dir, page_count
+            )
+
+            await run_in_threadpool(
+                job_store.update_job,
+                job_id,
+                step=JobStep.CONVERT_PAGES,
+                progress=35,
+                input_update={"imagesDir": str(images_dir), "pageCount": len(image_paths)},
+            )
+            await run_in_threadpool(job_store.checkpoint_stage, job_id, JobStep.CONVERT_PAGES.value)
+
+            await run_in_threadpool(
+                job_store.update_job,
+                job_id,
+                step=JobStep.PROCESS_OCR,
+                progress=40
+            )
+
+            done = await run_in_threadpool(page_store.page_indexes)
+            todo = [(idx, path) for idx, path in enumerate(image_paths, start=1) if idx not in done]
+            if done:
+                self.log.info(f"Job {job_id}: resuming with {len(done)} of {len(image_paths)} pages already done")
+
+            # Pages are math tagged and stored as they finish, so they can be served before the job is done
+            await self.scheduler.run(
+                job_id,
+                [path for _, path in todo],
+                page_indexes=[idx for idx, _ in todo],
+                options=self.ocr_options(settings),
+                on_page=self._page_events(job_id, page_store, len(image_paths), len(image_paths) - len(todo)),
+                page_context=(lambda: profiler.track("ocr_page")) if profiler is not None else None,
+            )
+            ocr_tagged = await run_in_threadpool(
+                JobProfiler.maybe_wrap(profiler, "collect_pages", lambda: DocumentOCR.collect_pages(page_store.load()))
+            )
+            await run_in_threadpool(job_store.checkpoint_stage, job_id, JobStep.PROCESS_OCR.value)
+
+            await run_in_threadpool(
+                job_store.update_job,
+                job_id,
+                step=JobStep.PROCESS_OCR,
+                progress=75,
+                output_update={
+                    "totalBlocks": ocr_tagged.get("total_blocks", 0),
+                    "refinedBlocks": ocr_tagged.get("refined_blocks", 0),
+                    "improvedBlocks": ocr_tagged.get("improved_blocks", 0),
+                },
+            )
+
+            await run_in_threadpool(
+                job_store.update_job,
+                job_id,
+                step=JobStep.RENDER_DOCX,
+                progress=85
+            )
+
+            await run_in_threadpool(
+                JobProfiler.maybe_wrap(profiler, "render_docx", self.docx_tool.render_document),
+                ocr_tagged,
+                out_docx
+            )
+            await run_in_threadpool(self.artifacts.save_file, job_id, "result.docx", out_docx)
+            await run_in_threadpool(job_store.checkpoint_stage, job_id, JobStep.RENDER_DOCX.value)
+
+            await run_in_threadpool(
+                job_store.update_job,
+                job_id,
+                status=JobStatus.SUCCEEDED,
+                step=JobStep.DONE,
+                progress=100,
+                output_update={"resultPath": str(out_docx)},
+            )
+
+            return {
+                "job_id": job_id,
+                "status": JobStatus.SUCCEEDED,
+                "step": JobStep.DONE,
+                "page_count": ocr_tagged["page_count"],
+                "total_blocks": ocr_tagged["total_blocks"],
+                "refined_blocks": ocr_tagged["refined_blocks"],
+                "improved_blocks": ocr_tagged["improved_blocks"],
+                "download_url": f"/v1/jobs/{job_id}/result",
+            }
+
+        except HTTPException as e:
+            await self.fail(job_id, e.detail)
+            raise
+
+        except Exception as e:
+            if retryable:
+                await run_in_threadpool(
+                    job_store.update_job,
+                    job_id,
+                    status=JobStatus.UPLOADED,
+                    error={"message": str(e), "retrying": True},
+                )
+            else:
+                await self.fail(job_id, str(e))
+            raise HTTPException(status_code=500, detail=str(e) if retryable else "Processing failed.") from e
+
+    @staticmethod
+    def ocr_options(settings: Optional[dict[str, Any]]) -> dict[str, Any]:
+        """ Per job keyword arguments for DocumentOCR.ocr_page, from the job's settings """
+        options: dict[str, Any] = {}
+        preprocess = PreprocessConfig.from_settings((settings or {}).get("preprocess"))
+        if preprocess.enabled:
+            options["preprocess"] = preprocess
+        languages = (settings or {}).get("languages")
+        if languages:
+            options["languages"] = language_key(languages)
+        return options
+
+    def _save_profile(self, job_id: str, job_dir: Path, profiler: JobProfiler) -> None:
+        """ Write the profile next to the job's output and keep a durable copy, a failure here never fails the job """
+        try:
+            paths = profiler.write(job_dir / "profile")
+            for path in paths:
+                self.artifacts.save_file(job_id, path.name, path)
+            self.job_store.update_job(
+                job_id,
+                output_update={"profile": {"files": [p.name for p in paths], "url": f"/v1/jobs/{job_id}/profile"}},
+            )
+        except Exception as e:
+            self.log.warning(f"Job {job_id}: could not store the profile: {e}")
+
+    async def fail(self, job_id: str, message: str) -> None:
+        await run_in_threadpool(
+            self.job_store.update_job,
+            job_id,
+            status=JobStatus.FAILED,
+            step=JobStep.DONE,
+            progress=100,
+            error={"message": message},
+        )
+
+    def _page_images(self, pdf_path: Path, images_dir: Path, page_count: Optional[int]) -> list[Path]:
+        """ Page images of the upload, rasterized again unless an earlier run left the full set """
+        if page_count:
+            existing = [images_dir / f"page_{i}.jpg" for i in range(1, page_count + 1)]
+            if all(p.exists() for p in existing):
+                return existing
+        return self.pdf_intake.pdf_to_jpeg(pdf_path, images_dir)
+
+    def _page_events(self, job_id: str, page_store: PageStore, page_count: int, already_done: int = 0):
+        """ Scheduler on_page callback, math tags and checkpoints the page then publishes a page progress event """
+        done = already_done
+        lock = threading.Lock()
+
+        def on_page(page: dict) -> None:
+            nonlocal done
+            tagged = self.math_pass.tag_page(page)
+            page_store.append(tagged)
+            self.artifacts.save_page(job_id, tagged)
+            self.job_store.checkpoint_page(job_id, page["page_index"])
+            with lock:
+                done += 1
+                pages_done = done
+            self.events.publish(
+                job_id,
+                {"type": "page", "jobId": job_id, "pageIndex": page["page_index"], "pagesDone": pages_done, "pagesTotal": page_count},
+            )
+
+        return on_page
@@ -1,40 +1,251 @@
-""" Main worflow for a ocr call"""
-
-
-
-
-from src.app.utilities.docx_tool import DocxArguments, DocxTool
-from src.app.utilities.pdf_intake import PDFIntake
+"""
+Main worflow outside of the API
+
+    python -m src.app.main_workflow.main convert IN_DIR OUT_DIR --processes 4
+        Offline bulk conversion of a directory tree of PDFs to DOCX, no FastAPI or MongoDB needed.
+        PDFs whose .docx already exists are skipped, so an interrupted run picks up where it stopped.
+
+    python -m src.app.main_workflow.main worker
+        Queue consuming worker: claims jobs from the shared MongoDB work queue and runs them, so OCR
+        capacity scales separately from the API replicas (run those with DOC_OCR_API_MODE=enqueue).
+"""
+
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import logging
+import tempfile
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional, TextIO
+
+from fastapi.concurrency import run_in_threadpool
+
+from src.app.main_workflow.setup import build_ocr_engine, build_pipeline
+from src.app.main_workflow.workflow_arguments import ConvertArguments, WorkflowArguments
+from src.app.utilities.app_logger import AppLogger
 from src.app.utilities.document_ocr import DocumentOCR
-from src.app.utilities.mongodb_atlas import MongoDBAccess
-
-
-# pseudo coding the main routine hopefully
-
-
-def start_ocr_job():
-
-    # First create record in the mongo db 
-
-    # pdf to jpeg
-
-
-    # OCR with easy ocr, outputs coordinates, text, and confidence
-
-    # Output into MathML
-
-    # Output to docx
-
-
-
-    pass
-
-
+from src.app.utilities.docx_tool import DocxTool
+from src.app.utilities.image_preprocess import PreprocessConfig
+from src.app.utilities.mongodb_utils.mongo_client import MongoStore
+from src.app.utilities.omml_pass import MathPass
+from src.app.utilities.pdf_intake import PDFIntake
 
 
-def main():
-    pass
+log = AppLogger.init_logger()
+
+# One set of tools per process, the OCR models load once in the pool initializer
+_tools: Optional[tuple[PDFIntake, DocumentOCR, MathPass, DocxTool]] = None
+
+
+def _init_tools(torch_threads: int = 0) -> None:
+    global _tools
+    # N processes each using every core just fight over them, so the pool caps the OCR threads per process
+    _tools = (PDFIntake(), build_ocr_engine(torch_threads or None), MathPass(), DocxTool())
+
+
+def convert_one(
+    job: WorkflowArguments,
+    dpi: int = 250,
+    preprocess: Optional[PreprocessConfig] = None,
+) -> tuple[WorkflowArguments, int, float, Optional[str]]:
+    """ pdf -> page images -> OCR -> math tags -> docx for one file. Returns (job, pages, seconds, error) """
+    if _tools is None:
+        _init_tools()
+    pdf_intake, ocr_engine, math_pass, docx_tool = _tools
+
+    started = time.perf_counter()
+    out_docx = Path(job.output_filename)
+    partial = out_docx.with_name(out_docx.name + ".part")
+    try:
+        with tempfile.TemporaryDirectory(prefix="doc_ocr_") as tmp:
+            image_paths = pdf_intake.pdf_to_jpeg(Path(job.input_filename), Path(tmp), dpi=dpi)
+            ocr_tagged = math_pass.tag_blocks(ocr_engine.ocr_pages(image_paths, preprocess))
+            docx_tool.render_document(ocr_tagged, partial)
+
+        # Only a finished file gets the real name, the skip-existing resume relies on it
+        partial.replace(out_docx)
+        return job, ocr_tagged["page_count"], time.perf_counter() - started, None
+    except Exception as e:
+        partial.unlink(missing_ok=True)
+        return job, 0, time.perf_counter() - started, f"{type(e).__name__}: {e}"
+
+
+def find_pdfs(input_path: Path) -> list[Path]:
+    if input_path.is_file():
+        return [input_path]
+    return sorted(p for p in input_path.rglob("*") if p.is_file() and p.suffix.lower() == ".pdf")
+
+
+class _Progress:
+    """ Single line progress bar on stderr, plain lines when it isn't a terminal """
+
+    def __init__(self, total: int, stream: TextIO = sys.stderr, width: int = 30) -> None:
+        self.total = total
+        self.stream = stream
+        self.width = width
+        self.done = 0
+        self.failed = 0
+        self.pages = 0
+        self.started = time.perf_counter()
+        self.tty = stream.isatty()
+
+    def update(self, name: str, pages: int, error: Optional[str]) -> None:
+        self.done += 1
+        self.pages += pages
+        self.failed += error is not None
+
+        elapsed = time.perf_counter() - self.started
+        rate = self.pages / elapsed if elapsed > 0 else 0.0
+        eta = elapsed / self.done * (self.total - self.done)
+        status = f"{self.done}/{self.total} files  {self.pages} pages  {rate:.2f} pages/s  eta {eta:.0f}s"
+
+        if self.tty:
+            filled = int(self.width * self.done / max(self.total, 1))
+            self.stream.write(f"\r[{'#' * filled}{'-' * (self.width - filled)}] {status}")
+            if self.done == self.total:
+                self.stream.write("\n")
+        else:
+            self.stream.write(f"{status}  {name}{'  FAILED' if error else ''}\n")
+
+        if error and self.tty:
+            self.stream.write(f"\nFAILED {name}: {error}\n")
+        self.stream.flush()
+
+
+def convert(args: ConvertArguments) -> int:
+    """ Convert every PDF under args.input_path, mirroring the tree under args.output_dir. Returns the exit code """
+    pdfs = find_pdfs(args.input_path)
+    root = args.input_path if args.input_path.is_dir() else args.input_path.parent
+
+    jobs: list[WorkflowArguments] = []
+    skipped = 0
+    for pdf in pdfs:
+        out_docx = args.output_dir / pdf.relative_to(root).with_suffix(".docx")
+        if out_docx.exists() and not args.overwrite:
+            skipped += 1
+            continue
+        out_docx.parent.mkdir(parents=True, exist_ok=True)
+        jobs.append(WorkflowArguments(input_filename=str(pdf), output_filename=str(out_docx)))
+
+    print(f"{len(pdfs)} PDFs found, {skipped} already converted, {len(jobs)} to do", file=sys.stderr)
+    if not jobs:
+        return 0
+
+    progress = _Progress(len(jobs))
+    failures: list[tuple[str, str]] = []
+    seconds = 0.0
+
+    def record(result: tuple[WorkflowArguments, int, float, Optional[str]]) -> None:
+        nonlocal seconds
+        job, pages, took, error = result
+        seconds += took
+        if error:
+            failures.append((job.input_filename, error))
+        progress.update(job.input_filename, pages, error)
+
+    if args.processes == 1:
+        _init_tools()
+        for job in jobs:
+            record(convert_one(job, args.dpi, args.preprocess))
+    else:
+        # spawn, torch's thread pools don't survive a fork
+        torch_threads = max(1, (os.cpu_count() or 1) // args.processes)
+        with ProcessPoolExecutor(
+            max_workers=args.processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_tools,
+            initargs=(torch_threads,),
+        ) as pool:
+            futures = [pool.submit(convert_one, job, args.dpi, args.preprocess) for job in jobs]
+            for future in as_completed(futures):
+                record(future.result())
+
+    wall = time.perf_counter() - progress.started
+    converted = len(jobs) - len(failures)
+    print(
+        f"\nConverted {converted} files ({progress.pages} pages), skipped {skipped}, failed {len(failures)}\n"
+        f"Wall time {wall:.1f}s with {args.processes} process(es): "
+        f"{progress.pages / wall if wall > 0 else 0.0:.2f} pages/s, "
+        f"{wall / max(progress.pages, 1):.2f} s/page, "
+        f"{seconds / max(len(jobs), 1):.1f} s/file busy time",
+        file=sys.stderr,
+    )
+    for name, error in failures:
+        print(f"  FAILED {name}: {error}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+async def _work(concurrent_jobs: int, poll_interval: float) -> None:
+    pipeline = build_pipeline(run_ocr=True)
+    await run_in_threadpool(pipeline.job_store.ensure_indexes)
+    await run_in_threadpool(pipeline.artifacts.ensure_indexes)
+    await run_in_threadpool(pipeline.queue.ensure_indexes)
+    pipeline.scheduler.start()
+    log.info(f"Worker {pipeline.owner} consuming jobs, {concurrent_jobs} at a time")
+
+    consumers = asyncio.gather(
+        *(pipeline.consume_queue(poll_interval) for _ in range(concurrent_jobs))
+    )
+
+    # Cloud Run / docker stop with SIGTERM, unfinished jobs go back in the queue for another worker
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, consumers.cancel)
+        except NotImplementedError:
+            pass
+
+    try:
+        await consumers
+    except asyncio.CancelledError:
+        log.info("Worker stopping")
+    finally:
+        pipeline.scheduler.stop()
+        MongoStore.close()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.app.main_workflow.main", description=__doc__.split("\n\n")[0].strip())
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_convert = sub.add_parser("convert", help="convert a PDF or a directory tree of PDFs to DOCX")
+    p_convert.add_argument("input_path", type=Path)
+    p_convert.add_argument("output_dir", type=Path)
+    p_convert.add_argument("--processes", "-p", type=int, default=1, help="OCR processes, each loads its own models")
+    p_convert.add_argument("--dpi", type=int, default=250)
+    p_convert.add_argument("--overwrite", action="store_true", help="convert again even when the .docx exists")
+    p_convert.add_argument("--preprocess", action="store_true", help="deskew, denoise and binarize pages before OCR")
+
+    p_worker = sub.add_parser("worker", help="claim and run jobs from the MongoDB work queue")
+    p_worker.add_argument("--jobs", type=int, default=int(os.getenv("DOC_OCR_WORKER_JOBS", "1")), help="jobs run at the same time")
+    p_worker.add_argument("--poll-interval", type=float, default=5.0, help="seconds between claims when idle")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "convert":
+        if not args.input_path.exists():
+            parser.error(f"{args.input_path} does not exist")
+        return convert(ConvertArguments(
+            input_path=args.input_path,
+            output_dir=args.output_dir,
+            processes=args.processes,
+            dpi=args.dpi,
+            overwrite=args.overwrite,
+            preprocess=PreprocessConfig(enabled=args.preprocess),
+        ))
+
+    asyncio.run(_work(args.jobs, args.poll_interval))
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
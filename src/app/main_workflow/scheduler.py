@@ -0,0 +1,276 @@
+""" Page level scheduler that shares the OCR engine fairly between concurrent jobs """
+
+
+import asyncio
+import threading
+import time
+
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Optional, Sequence
+
+from src.app.utilities.app_logger import AppLogger
+from src.app.utilities.document_ocr import DocumentOCR
+
+
+@dataclass(frozen=True)
+class SchedulerConfig:
+    workers: int = 1                        # OCR worker threads sharing the engine
+    max_pages_in_flight_per_job: int = 1    # per job page concurrency cap
+    policy: str = "sjf"                     # "sjf": fewest remaining pages first, "round_robin": take turns
+    aging_seconds: float = 60.0             # sjf only, a job waiting this long ranks as if it had half the pages left
+    throughput_window: int = 50             # recent pages used for the pages/sec estimate
+    default_seconds_per_page: float = 6.0   # estimate before any page has been timed
+
+    def __post_init__(self):
+        if self.policy not in ("sjf", "round_robin"):
+            raise ValueError(f"Unknown scheduling policy: {self.policy}")
+        if self.workers < 1 or self.max_pages_in_flight_per_job < 1:
+            raise ValueError("Scheduler needs at least 1 worker and 1 page in flight per job")
+
+
+@dataclass
+class _JobState:
+    job_id: str
+    pending: deque[tuple[int, Path]]
+    total: int
+    future: Future
+    options: dict[str, Any]
+    on_page: Optional[Callable[[dict[str, Any]], None]]
+    page_context: Optional[Callable[[], ContextManager[Any]]]
+    submitted_at: float
+    last_served: float
+    in_flight: int = 0
+    done: int = 0
+    started: bool = False
+    results: list[dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def remaining(self) -> int:
+        return len(self.pending) + self.in_flight
+
+
+class PageScheduler:
+    """
+    Splits each job into one work unit per page and hands units to a small pool of OCR threads.
+
+    Picking the next unit is shortest-job-first on remaining pages (with aging so a long job can't
+    starve) or plain round robin, and never more than `max_pages_in_flight_per_job` pages of one job
+    run at the same time. A 1 page upload behind a 200 page one waits for a single page, not 200.
+    """
+
+    def __init__(
+        self,
+        process_page: Callable[..., dict[str, Any]],
+        cfg: SchedulerConfig = SchedulerConfig(),
+    ) -> None:
+        self.log = AppLogger.init_logger()
+        self.cfg = cfg
+        self._process_page = process_page
+
+        self._jobs: dict[str, _JobState] = {}
+        self._cond = threading.Condition()
+        self._durations: deque[float] = deque(maxlen=cfg.throughput_window)
+        self._threads: list[threading.Thread] = []
+        self._stopping = False
+
+    def start(self) -> None:
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.cfg.workers):
+                t = threading.Thread(target=self._worker, name=f"ocr-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        self.log.info(f"Page scheduler started with {self.cfg.workers} worker(s), policy={self.cfg.policy}")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """ Stop the workers. Jobs that haven't finished fail with a RuntimeError instead of hanging """
+        with self._cond:
+            self._stopping = True
+            unfinished = list(self._jobs.values())
+            self._jobs.clear()
+            for state in unfinished:
+                state.pending.clear()
+            self._cond.notify_all()
+
+        for state in unfinished:
+            if not state.future.done():
+                state.future.set_exception(RuntimeError(f"Scheduler stopped before job {state.job_id} finished"))
+
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads = []
+
+    def submit(
+        self,
+        job_id: str,
+        image_paths: Sequence[Path],
+        *,
+        page_indexes: Optional[Sequence[int]] = None,
+        options: Optional[dict[str, Any]] = None,
+        on_page: Optional[Callable[[dict[str, Any]], None]] = None,
+        page_context: Optional[Callable[[], ContextManager[Any]]] = None,
+    ) -> Future:
+        """
+        Queue every page of a job. The future resolves to the same dict DocumentOCR.ocr_pages() returns.
+
+        :param page_indexes: 1-based page numbers for `image_paths`, defaults to 1..n
+        :param options: keyword arguments forwarded to `process_page` for every page of this job
+        :param on_page: called from the worker thread with each finished page record
+        :param page_context: entered in the worker thread around each page of this job (OCR and on_page),
+            e.g. to profile it
+        """
+        indexes = list(page_indexes) if page_indexes is not None else list(range(1, len(image_paths) + 1))
+        if len(indexes) != len(image_paths):
+            raise ValueError("page_indexes and image_paths must be the same length")
+
+        future: Future = Future()
+        now = time.monotonic()
+        state = _JobState(
+            job_id=job_id,
+            pending=deque(zip(indexes, image_paths)),
+            total=len(indexes),
+            future=future,
+            options=dict(options or {}),
+            on_page=on_page,
+            page_context=page_context,
+            submitted_at=now,
+            last_served=now,
+        )
+
+        if not state.pending:
+            future.set_result(DocumentOCR.collect_pages([]))
+            return future
+
+        with self._cond:
+            if job_id in self._jobs:
+                raise RuntimeError(f"Job {job_id} is already scheduled")
+            self._jobs[job_id] = state
+            self._cond.notify()
+
+        return future
+
+    async def run(self, job_id: str, image_paths: Sequence[Path], **kwargs: Any) -> dict[str, Any]:
+        """ submit() for async callers """
+        return await asyncio.wrap_future(self.submit(job_id, image_paths, **kwargs))
+
+    def pages_per_second(self) -> float:
+        with self._cond:
+            return self._pages_per_second_locked()
+
+    def snapshot(self, job_id: str) -> Optional[dict[str, Any]]:
+        """ Queue position and estimated start for a job, None when the job isn't scheduled here """
+        with self._cond:
+            state = self._jobs.get(job_id)
+            if state is None:
+                return None
+
+            pps = self._pages_per_second_locked()
+            now = time.monotonic()
+            ranked = sorted(self._jobs.values(), key=lambda s: self._priority(s, now))
+
+            ahead = []
+            for other in ranked:
+                if other is state:
+                    break
+                ahead.append(other)
+
+            # Pages already running for lower priority jobs still hold a worker
+            pages_ahead = sum(s.remaining for s in ahead)
+            pages_ahead += sum(s.in_flight for s in ranked if s is not state and s not in ahead)
+            start_in = 0.0 if state.started else pages_ahead / pps
+            finish_in = (pages_ahead + state.remaining) / pps
+
+            return {
+                "state": "running" if state.started else "queued",
+                "queuePosition": 0 if state.started else len([s for s in ahead if not s.started]) + 1,
+                "pagesAhead": pages_ahead,
+                "pagesDone": state.done,
+                "pagesTotal": state.total,
+                "pagesPerSecond": round(pps, 3),
+                "estimatedStartSeconds": round(start_in, 1),
+                "estimatedStartAt": (datetime.now(timezone.utc) + timedelta(seconds=start_in)).isoformat(),
+                "estimatedFinishSeconds": round(finish_in, 1),
+            }
+
+    def _pages_per_second_locked(self) -> float:
+        if self._durations:
+            mean = sum(self._durations) / len(self._durations)
+        else:
+            mean = self.cfg.default_seconds_per_page
+        return self.cfg.workers / max(mean, 1e-6)
+
+    def _priority(self, state: _JobState, now: float) -> tuple[float, float]:
+        if self.cfg.policy == "round_robin":
+            return state.last_served, state.submitted_at
+        waited = now - state.last_served
+        return state.remaining / (1.0 + waited / self.cfg.aging_seconds), state.last_served
+
+    def _next_unit(self) -> Optional[tuple[_JobState, int, Path]]:
+        """ Pick the next page under the lock, None when nothing is eligible """
+        now = time.monotonic()
+        eligible = [
+            s for s in self._jobs.values()
+            if s.pending and s.in_flight < self.cfg.max_pages_in_flight_per_job
+        ]
+        if not eligible:
+            return None
+
+        state = min(eligible, key=lambda s: self._priority(s, now))
+        page_index, path = state.pending.popleft()
+        state.in_flight += 1
+        state.started = True
+        state.last_served = now
+        return state, page_index, path
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                unit = None
+                while not self._stopping:
+                    unit = self._next_unit()
+                    if unit is not None:
+                        break
+                    self._cond.wait()
+                if unit is None:
+                    return
+
+            state, page_index, path = unit
+            started = time.monotonic()
+            try:
+                with state.page_context() if state.page_context is not None else nullcontext():
+                    page = self._process_page(page_index, path, **state.options)
+                    if state.on_page is not None:
+                        state.on_page(page)
+            except Exception as e:
+                self._fail(state, e)
+                continue
+
+            with self._cond:
+                self._durations.append(time.monotonic() - started)
+                state.in_flight -= 1
+                state.done += 1
+                state.results.append(page)
+                finished = state.done == state.total
+                if finished:
+                    self._jobs.pop(state.job_id, None)
+                self._cond.notify_all()
+
+            if finished and not state.future.done():
+                state.future.set_result(DocumentOCR.collect_pages(state.results))
+
+    def _fail(self, state: _JobState, error: Exception) -> None:
+        self.log.error(f"Page OCR failed for job {state.job_id}: {error}")
+        with self._cond:
+            state.pending.clear()
+            state.in_flight -= 1
+            self._jobs.pop(state.job_id, None)
+            self._cond.notify_all()
+        if not state.future.done():
+            state.future.set_exception(error)
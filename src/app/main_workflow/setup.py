@@ -1 +1,166 @@
-""" Future encapsulate the logic of all inits and startup?"""
\ No newline at end of file
+""" Build the tools and the job pipeline, shared by the API process and the standalone worker """
+
+
+import os
+
+from pathlib import Path
+from typing import Optional
+from uuid import uuid4
+
+from src.app.main_workflow.job_events import JobEventBus
+from src.app.main_workflow.job_pipeline import JobPipeline
+from src.app.main_workflow.job_status_enums import JobStatus, JobStep
+from src.app.main_workflow.scheduler import PageScheduler, SchedulerConfig
+from src.app.utilities.admission import AdmissionConfig, AdmissionController, BucketLimit
+from src.app.utilities.document_ocr import DocumentOCR, OCRArguments, RefineConfig
+from src.app.utilities.docx_tool import DocxTool
+from src.app.utilities.mongodb_utils.artifact_store import MongoArtifactStore
+from src.app.utilities.mongodb_utils.job_store_util import MongoJobStore
+from src.app.utilities.mongodb_utils.mongo_client import (
+    MongoStore,
+    get_jobs_collection,
+    get_rate_limits_collection,
+    get_work_queue_collection,
+)
+from src.app.utilities.mongodb_utils.work_queue import MongoWorkQueue
+from src.app.utilities.omml_pass import MathPass
+from src.app.utilities.pdf_intake import PDFIntake
+from src.app.utilities.reader_registry import language_key
+from src.app.utilities.stub_ocr import StubOCR
+
+
+BASE_TMP: Path = Path("/tmp/jobs")
+
+# Latin script languages, they share one recognition model (each set is still its own reader)
+DEFAULT_OCR_LANGUAGES: str = "en,fr,es,de,it,pt"
+
+
+def instance_id() -> str:
+    """ Lease owner name, unique per process """
+    return f"{os.getenv('K_REVISION', 'local')}-{uuid4().hex[:8]}"
+
+
+def ocr_languages() -> frozenset[str]:
+    """ Languages a job may ask for, DOC_OCR_LANGUAGES (comma separated) """
+    return frozenset(language_key(os.getenv("DOC_OCR_LANGUAGES", DEFAULT_OCR_LANGUAGES).split(",")))
+
+
+def build_ocr_engine(num_threads: Optional[int] = None) -> DocumentOCR:
+    """
+    The OCR engine, backend and threads from DOC_OCR_BACKEND / DOC_OCR_THREADS unless `num_threads` is given.
+    DOC_OCR_DEFAULT_LANGUAGES are loaded with the engine, at most DOC_OCR_MAX_READERS other language sets
+    asked for by jobs stay loaded next to them.
+    DOC_OCR_ENGINE=stub swaps in StubOCR (no models, DOC_OCR_STUB_SECONDS_PER_PAGE per page) for load tests.
+    """
+    if num_threads is None:
+        num_threads = int(os.getenv("DOC_OCR_THREADS", "0"))
+    languages = language_key(os.getenv("DOC_OCR_DEFAULT_LANGUAGES", "en").split(","))
+    max_readers = int(os.getenv("DOC_OCR_MAX_READERS", "2"))
+    engine = os.getenv("DOC_OCR_ENGINE", "easyocr")
+    if engine == "stub":
+        return StubOCR(
+            OCRArguments(languages=languages, max_readers=max_readers),
+            seconds_per_page=float(os.getenv("DOC_OCR_STUB_SECONDS_PER_PAGE", "0.5")),
+        )
+    if engine != "easyocr":
+        raise RuntimeError(f"[CONFIG FAIL] Unknown DOC_OCR_ENGINE: {engine}")
+
+    return DocumentOCR(
+        OCRArguments(
+            languages=languages,
+            max_readers=max_readers,
+            gpu=False,
+            backend=os.getenv("DOC_OCR_BACKEND", "stock"),
+            num_threads=num_threads,
+            min_confidence=0.30,
+            paragraph=False,
+            reading_order="xycut",
+            # Two pass mode, only the blocks greedy decoding was unsure about are recognized again
+            refine=RefineConfig(
+                enabled=os.getenv("DOC_OCR_TWO_PASS", "0") == "1",
+                decoder=os.getenv("DOC_OCR_REFINE_DECODER", "beamsearch"),
+            ),
+        )
+    )
+
+
+def build_scheduler(ocr_engine: DocumentOCR) -> PageScheduler:
+    # Every job's pages go through the scheduler so one big upload can't hold the OCR engine
+    return PageScheduler(
+        ocr_engine.ocr_page,
+        SchedulerConfig(
+            workers=int(os.getenv("DOC_OCR_WORKERS", "1")),
+            max_pages_in_flight_per_job=int(os.getenv("DOC_OCR_PAGES_PER_JOB", "1")),
+            policy=os.getenv("DOC_OCR_SCHEDULER_POLICY", "sjf"),
+        ),
+    )
+
+
+def build_pipeline(*, run_ocr: bool = True, base_dir: Path = BASE_TMP, owner: Optional[str] = None) -> JobPipeline:
+    """
+    Mongo stores, event bus, tools and (when `run_ocr`) the OCR engine with its page scheduler.
+    API replicas that hand every job to the workers pass run_ocr=False and never load the OCR models.
+    """
+    job_store = MongoJobStore(get_jobs_collection())
+
+    # Progress events for the SSE endpoint, every job store update is published.
+    # Jobs running on another instance are followed with one change stream per job.
+    events = JobEventBus(remote_watch=job_store.watch_job)
+    job_store.on_update = events.publish_job
+
+    # Shared queue of uploaded jobs, any instance running OCR claims from it
+    queue = MongoWorkQueue(
+        get_work_queue_collection(),
+        name=os.getenv("DOC_OCR_QUEUE", "ocr"),
+        max_attempts=int(os.getenv("DOC_OCR_QUEUE_MAX_ATTEMPTS", "3")),
+    )
+
+    def fail_dead_job(item: dict) -> None:
+        job_store.set_queued(item["jobId"], False)
+        try:
+            job_store.update_job(
+                item["jobId"],
+                status=JobStatus.FAILED,
+                step=JobStep.DONE,
+                progress=100,
+                error={"message": item.get("error") or "Gave up on the job", "attempts": item.get("attempts")},
+            )
+        except KeyError:
+            pass  # the job expired meanwhile
+
+    queue.on_dead = fail_dead_job
+    ocr_engine = build_ocr_engine() if run_ocr else None
+
+    return JobPipeline(
+        job_store=job_store,
+        artifacts=MongoArtifactStore(MongoStore.database()),
+        queue=queue,
+        events=events,
+        pdf_intake=PDFIntake(),
+        math_pass=MathPass(),
+        docx_tool=DocxTool(),
+        scheduler=build_scheduler(ocr_engine) if ocr_engine is not None else None,
+        ocr_engine=ocr_engine,
+        base_dir=base_dir,
+        owner=owner or instance_id(),
+        lease_seconds=float(os.getenv("DOC_OCR_LEASE_SECONDS", "90")),
+    )
+
+
+def build_admission() -> AdmissionController:
+    """ Page budgets for uploads, shared by every API replica through Mongo """
+    return AdmissionController(
+        get_rate_limits_collection(),
+        AdmissionConfig(
+            enabled=os.getenv("DOC_OCR_ADMISSION", "1") == "1",
+            client=BucketLimit(
+                pages_per_minute=float(os.getenv("DOC_OCR_CLIENT_PAGES_PER_MINUTE", "30")),
+                burst_pages=float(os.getenv("DOC_OCR_CLIENT_BURST_PAGES", "200")),
+            ),
+            service=BucketLimit(
+                pages_per_minute=float(os.getenv("DOC_OCR_SERVICE_PAGES_PER_MINUTE", "300")),
+                burst_pages=float(os.getenv("DOC_OCR_SERVICE_BURST_PAGES", "1000")),
+            ),
+            max_queue_wait_seconds=float(os.getenv("DOC_OCR_ADMISSION_MAX_WAIT_SECONDS", "120")),
+        ),
+    )
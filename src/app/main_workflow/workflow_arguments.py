@@ -7,6 +7,9 @@ Keep extensible for local running and exapnading for
 """
 
 from dataclasses import dataclass, field
+from pathlib import Path
+
+from src.app.utilities.image_preprocess import PreprocessConfig
 
 
 @dataclass
@@ -15,5 +18,25 @@ class WorkflowArguments:
     output_filename: str
 
 
+@dataclass
+class JobSettings:
+    """ Body of POST /v1/jobs, stored on the job document as `settings` """
+    languages: list[str] = field(default_factory=lambda: ["en"])
+    min_confidence: float = 0.30
+    preprocess: PreprocessConfig = field(default_factory=PreprocessConfig)  # {"enabled": true} to deskew/denoise/binarize
+    profile: bool = False  # CPU / memory profile of this job (admin token only), downloaded from /v1/jobs/{id}/profile
+
 
-    
+@dataclass
+class ConvertArguments:
+    """ Options for the offline bulk conversion, `python -m src.app.main_workflow.main convert` """
+    input_path: Path
+    output_dir: Path
+    processes: int = 1
+    dpi: int = 250
+    overwrite: bool = False  # default skips PDFs whose .docx already exists, so a rerun resumes
+    preprocess: PreprocessConfig = field(default_factory=PreprocessConfig)
+
+    def __post_init__(self):
+        if self.processes < 1:
+            raise ValueError("processes must be at least 1")
@@ -0,0 +1,83 @@
+""" Test the page budget admission control. """
+
+from datetime import timedelta
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from src.app.utilities.admission import AdmissionConfig, AdmissionController, AdmissionRejected, BucketLimit  # noqa: E402
+from src.app.utilities.mongodb_utils.job_store_util import utcnow  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = utcnow()
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def _controller(clock, max_wait: float = 0.0) -> AdmissionController:
+    cfg = AdmissionConfig(
+        client=BucketLimit(pages_per_minute=60, burst_pages=10),
+        service=BucketLimit(pages_per_minute=120, burst_pages=15),
+        max_queue_wait_seconds=max_wait,
+    )
+    return AdmissionController(mongomock.MongoClient()["app_events"]["rate_limits"], cfg, clock=clock)
+
+
+def test_client_bucket_rejects_then_refills(clock):
+    admission = _controller(clock)
+    assert admission.admit("a", 8) == 0.0
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.admit("a", 5)
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers == {"Retry-After": "3"}  # 3 pages short at 1 page/s
+
+    clock.advance(3)
+    assert admission.admit("a", 5) == 0.0
+
+
+def test_service_bucket_is_shared_and_refunds_the_client(clock):
+    admission = _controller(clock)
+    admission.admit("a", 10)
+
+    with pytest.raises(AdmissionRejected):
+        admission.admit("b", 6)  # b has budget, the service has 5 pages left
+    assert admission.remaining("b")["client"] == 10  # b's pages were given back
+
+    assert admission.admit("b", 5) == 0.0
+
+
+def test_queue_within_the_wait_budget(clock):
+    admission = _controller(clock, max_wait=30)
+    admission.admit("a", 10)
+
+    # Mongo keeps milliseconds, so the clock reads back a fraction late
+    assert admission.admit("a", 4) == pytest.approx(4.0, abs=0.01)
+    # The queued job took its pages, the next one waits behind it
+    assert admission.admit("a", 2) == pytest.approx(6.0, abs=0.01)
+    assert admission.remaining("a")["client"] == pytest.approx(-6, abs=0.01)
+
+
+def test_job_larger_than_any_bucket(clock):
+    with pytest.raises(AdmissionRejected) as rejected:
+        _controller(clock).admit("a", 11)
+    assert rejected.value.status_code == 413
+    assert rejected.value.headers is None
+
+
+def test_admission_disabled(clock):
+    admission = _controller(clock)
+    admission = AdmissionController(admission.buckets, AdmissionConfig(enabled=False), clock=clock)
+    assert admission.admit("a", 10_000) == 0.0
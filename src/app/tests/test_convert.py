@@ -0,0 +1,104 @@
+""" Test the offline bulk conversion CLI. """
+
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from src.app.main_workflow import main as workflow
+from src.app.main_workflow.workflow_arguments import ConvertArguments
+from src.app.utilities.docx_tool import DocxTool
+from src.app.utilities.omml_pass import MathPass
+from src.app.utilities.stub_ocr import StubOCR
+
+
+class _Intake:
+    """ pdf_to_jpeg() stand in, one blank page per "page" line of the fake PDF, no poppler needed """
+
+    def __init__(self) -> None:
+        self.converted: list[str] = []
+
+    def pdf_to_jpeg(self, pdf_path: Path, out_dir: Path, dpi: int = 250) -> list[Path]:
+        self.converted.append(pdf_path.name)
+        pages = []
+        for i in range(pdf_path.read_text().count("page")):
+            path = out_dir / f"{pdf_path.stem}_page_{i + 1}.jpg"  # the render stand in tells files apart by it
+            cv2.imwrite(str(path), np.full((330, 255), 255, np.uint8))
+            pages.append(path)
+        return pages
+
+
+class _Docx(DocxTool):
+    """ Writes the document, then fails for inputs named broken*, like a crash mid render """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.written: list[Path] = []
+
+    def render_document(self, ocr_tagged, out_path):
+        self.written.append(Path(out_path))
+        out = super().render_document(ocr_tagged, out_path)
+        if any("broken" in p["image_path"] for p in ocr_tagged["pages"]):
+            raise RuntimeError("render crashed")
+        return out
+
+
+@pytest.fixture
+def tools(monkeypatch):
+    intake, docx = _Intake(), _Docx()
+
+    def init_tools(torch_threads: int = 0) -> None:
+        workflow._tools = (intake, StubOCR(seconds_per_page=0.0, lines_per_page=2), MathPass(), docx)
+
+    monkeypatch.setattr(workflow, "_init_tools", init_tools)
+    monkeypatch.setattr(workflow, "_tools", None)
+    return intake, docx
+
+
+def _pdf(path: Path, pages: int = 1) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("%PDF-1.4\n" + "page\n" * pages)
+    return path
+
+
+def test_convert_mirrors_the_tree_and_skips_finished_outputs(tools, tmp_path):
+    intake, docx = tools
+    _pdf(tmp_path / "in" / "a.pdf", pages=2)
+    _pdf(tmp_path / "in" / "week 2" / "b.PDF")
+    (tmp_path / "in" / "notes.txt").write_text("not a pdf")
+    args = ConvertArguments(input_path=tmp_path / "in", output_dir=tmp_path / "out")
+
+    assert workflow.convert(args) == 0
+    outputs = sorted(p.relative_to(tmp_path / "out").as_posix() for p in (tmp_path / "out").rglob("*") if p.is_file())
+    assert outputs == ["a.docx", "week 2/b.docx"]
+    # Rendered under a temporary name, renamed once complete
+    assert all(p.name.endswith(".docx.part") for p in docx.written)
+
+    intake.converted.clear()
+    assert workflow.convert(args) == 0
+    assert intake.converted == []
+
+    assert workflow.convert(ConvertArguments(input_path=tmp_path / "in", output_dir=tmp_path / "out", overwrite=True)) == 0
+    assert sorted(intake.converted) == ["a.pdf", "b.PDF"]
+
+
+def test_failed_file_leaves_nothing_behind_and_is_retried(tools, tmp_path):
+    intake, _ = tools
+    _pdf(tmp_path / "in" / "good.pdf")
+    _pdf(tmp_path / "in" / "broken.pdf")
+    args = ConvertArguments(input_path=tmp_path / "in", output_dir=tmp_path / "out")
+
+    assert workflow.convert(args) == 1
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["good.docx"]  # no broken.docx(.part)
+
+    intake.converted.clear()
+    assert workflow.convert(args) == 1
+    assert intake.converted == ["broken.pdf"]
+
+
+def test_convert_arguments_are_validated(tmp_path):
+    with pytest.raises(ValueError):
+        ConvertArguments(input_path=tmp_path, output_dir=tmp_path / "out", processes=0)
+    with pytest.raises(SystemExit):
+        workflow.main(["convert", str(tmp_path / "missing"), str(tmp_path / "out")])
@@ -1 +1,100 @@
-""" Test the docx functionality. """
\ No newline at end of file
+""" Test the docx functionality. """
+
+import re
+
+import pytest
+
+from docx import Document
+from lxml import etree
+
+from src.app.utilities.docx_tool import DocxTool
+from src.app.utilities.math_render import MathRenderer
+
+
+def _layout(o_math) -> str:
+    """ Compact view of an m:oMath: structure tags plus [text] for every m:t """
+    xml = etree.tostring(o_math, encoding="unicode")
+    found = re.findall(r"<m:(f|sSup|sSub|rad|d|func)\b|<m:t>([^<]*)</m:t>", xml)
+    return "".join(tag or f"[{text}]" for tag, text in found)
+
+
+def _ocr(*blocks: tuple[str, bool]) -> dict:
+    return {
+        "page_count": 1,
+        "total_blocks": len(blocks),
+        "pages": [
+            {
+                "page_index": 1,
+                "image_path": "page_1.jpg",
+                "blocks": [{"text": text, "is_math": is_math} for text, is_math in blocks],
+            }
+        ],
+    }
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("x² + 3x - 4 = 0", "sSup[x][2][+][3][x][−][4][=][0]"),
+        ("dy/dx = 2x", "f[dy][dx][=][2][x]"),
+        ("√(x+1)/2", "frad[x][+][1][2]"),
+        ("F = -kx", "[F][=][−][k][x]"),
+        ("E = mc^2", "[E][=][m]sSup[c][2]"),
+        ("ω = 2πf", "[ω][=][2][π][f]"),
+        ("Δx = v t", "[Δ][x][=][v][t]"),
+        ("f(x) = 2x", "[f]d[x][=][2][x]"),
+        ("ln(x) = 2", "func[ln]d[x][=][2]"),
+        ("x! = 6", "[x][!][=][6]"),
+        ("x = 1e5", "[x][=][1e5]"),
+        ("x^-1", "sSup[x][−][1]"),
+        ("a/b", "f[a][b]"),
+        ("3.5*10^-3", "[3.5][·]sSup[10][−][3]"),
+    ],
+)
+def test_known_expressions(text, expected):
+    o_math = MathRenderer().to_omml(text)
+    assert o_math is not None
+    assert _layout(o_math) == expected
+
+
+def test_huge_factorials_are_not_computed():
+    renderer = MathRenderer()
+    assert _layout(renderer.to_omml("x = 99999999!")) == "[x][=][99999999][!]"
+    assert _layout(renderer.to_omml("y = 99999999!!")) == "[y][=][99999999][!!]"
+    assert _layout(renderer.to_omml("(n+1)! = 2")) == "d[n][+][1][!][=][2]"
+
+
+def test_prose_is_not_math():
+    assert MathRenderer().to_omml("Homework 3 - Problem 2") is None
+
+
+def test_cache_hits_return_separate_copies():
+    renderer = MathRenderer()
+    first = renderer.to_omml("y = mx + b")
+    second = renderer.to_omml("y  =  mx + b")
+
+    assert first is not second
+    assert etree.tostring(first) == etree.tostring(second)
+    assert renderer.cache.stats()["hits"] == 1
+
+    first.clear()
+    assert _layout(renderer.to_omml("y = mx + b")) == "[y][=][m][x][+][b]"
+
+
+def test_math_block_renders_as_omath(tmp_path):
+    out = DocxTool().render_document(_ocr(("Intro", False), ("y = mx + b", True)), tmp_path / "out.docx")
+
+    body = Document(str(out)).element.body
+    o_maths = body.xpath("./w:p/m:oMath")
+    assert len(o_maths) == 1
+    assert _layout(o_maths[0]) == "[y][=][m][x][+][b]"
+
+
+def test_unrenderable_math_keeps_consolas_run(tmp_path):
+    out = DocxTool().render_document(_ocr(("Homework 3 - Problem 2", True)), tmp_path / "out.docx")
+
+    doc = Document(str(out))
+    assert not doc.element.body.xpath("./w:p/m:oMath")
+    runs = [run for p in doc.paragraphs for run in p.runs if run.text == "Homework 3 - Problem 2"]
+    assert len(runs) == 1
+    assert runs[0].font.name == "Consolas"
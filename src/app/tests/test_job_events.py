@@ -0,0 +1,163 @@
+""" Test the job progress events. """
+
+import asyncio
+import importlib
+import json
+import threading
+
+import pytest
+
+from src.app.main_workflow.job_events import JobEventBus, format_sse
+from src.app.main_workflow.job_status_enums import JobStatus
+
+
+def _event(status: JobStatus, progress: int = 0) -> dict:
+    return {"type": "job", "status": status.value, "progress": progress}
+
+
+def _drain(queue: asyncio.Queue) -> list[dict]:
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+class _BlockingWatch:
+    """ remote_watch stand in, runs until stopped and lets the test push changes """
+
+    def __init__(self) -> None:
+        self.started = threading.Event()
+        self.stopped = threading.Event()
+        self.on_change = None
+
+    def __call__(self, job_id, on_change, stop) -> None:
+        self.on_change = on_change
+        self.started.set()
+        stop.wait()
+        self.stopped.set()
+
+
+def test_publish_fans_out_to_the_job_subscribers_only():
+    async def run():
+        bus = JobEventBus()
+        bus.bind_loop(asyncio.get_running_loop())
+        with bus.subscribe("a") as first, bus.subscribe("a") as second, bus.subscribe("b") as other:
+            bus.publish("a", _event(JobStatus.PROCESSING, 40))
+            await asyncio.sleep(0)
+            assert [e["progress"] for e in _drain(first)] == [40]
+            assert [e["progress"] for e in _drain(second)] == [40]
+            assert _drain(other) == []
+            assert bus.subscriber_count("a") == 2
+        assert bus.subscriber_count("a") == 0
+
+    asyncio.run(run())
+
+
+def test_terminal_event_forgets_the_job():
+    bus = JobEventBus()
+    bus.mark_local("a")
+    bus.publish("a", _event(JobStatus.PROCESSING, 40))
+    assert bus.latest("a")["progress"] == 40
+
+    bus.publish("a", _event(JobStatus.SUCCEEDED, 100))
+    assert bus.latest("a") is None
+    assert not bus.is_local("a")
+
+
+def test_remote_events_of_a_local_job_are_dropped():
+    async def run():
+        watch = _BlockingWatch()
+        bus = JobEventBus(remote_watch=watch)
+        bus.bind_loop(asyncio.get_running_loop())
+        with bus.subscribe("a") as queue:
+            assert watch.started.wait(1)
+            watch.on_change({"_id": "a", "status": JobStatus.PROCESSING.value, "progress": 20})
+            await asyncio.sleep(0.01)
+            assert [e["progress"] for e in _drain(queue)] == [20]
+
+            # The job starts running here: the watcher stops and late remote events are ignored
+            bus.mark_local("a")
+            assert watch.stopped.wait(1)
+            watch.on_change({"_id": "a", "status": JobStatus.PROCESSING.value, "progress": 30})
+            bus.publish("a", _event(JobStatus.PROCESSING, 35))
+            await asyncio.sleep(0.01)
+            assert [e["progress"] for e in _drain(queue)] == [35]
+
+    asyncio.run(run())
+
+
+def test_watcher_stops_when_the_last_subscriber_leaves():
+    async def run():
+        watch = _BlockingWatch()
+        bus = JobEventBus(remote_watch=watch)
+        bus.bind_loop(asyncio.get_running_loop())
+        with bus.subscribe("a"):
+            with bus.subscribe("a"):
+                assert watch.started.wait(1)
+            assert bus.watcher_count() == 1  # one watcher per job, not per client
+            assert not watch.stopped.is_set()
+        assert watch.stopped.wait(1)
+        assert bus.watcher_count() == 0
+
+    asyncio.run(run())
+
+
+def test_deleted_job_sends_expired():
+    mongomock = pytest.importorskip("mongomock")
+    from src.app.utilities.mongodb_utils.job_store_util import MongoJobStore
+
+    store = MongoJobStore(mongomock.MongoClient()["app_events"]["jobs"])
+    store.create_job("a")
+    bus = JobEventBus(remote_watch=lambda job_id, on_change, stop: store.watch_job(job_id, on_change, stop, 0.01))
+
+    async def run():
+        bus.bind_loop(asyncio.get_running_loop())
+        with bus.subscribe("a") as queue:
+            await asyncio.sleep(0.05)
+            store.jobs.delete_one({"_id": "a"})  # TTL expiry
+            event = await asyncio.wait_for(queue.get(), timeout=2)
+        assert event["status"] == JobStatus.EXPIRED.value
+        assert bus.watcher_count() == 0
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def api(monkeypatch):
+    pytest.importorskip("mongomock")
+    pytest.importorskip("httpx")  # fastapi's TestClient
+    monkeypatch.setenv("DOC_OCR_MONGO_ATLAS_URI", "mongomock://localhost")
+    monkeypatch.setenv("DOC_OCR_API_MODE", "enqueue")  # no OCR models
+    return importlib.import_module("src.app.main")
+
+
+def _frames(body: str) -> list[dict]:
+    return [json.loads(line[len("data: "):]) for line in body.splitlines() if line.startswith("data: ")]
+
+
+def test_event_stream_closes_on_a_terminal_event(api):
+    from fastapi.testclient import TestClient
+
+    with TestClient(api.app) as client:
+        api.job_store.create_job("done")
+        api.job_store.update_job("done", status=JobStatus.SUCCEEDED, progress=100)
+        frames = _frames(client.get("/v1/jobs/done/events").text)
+        assert [f["status"] for f in frames] == [JobStatus.SUCCEEDED.value]
+
+        api.job_store.create_job("running")
+        api.job_store.update_job("running", status=JobStatus.PROCESSING, progress=40)
+        # The test client reads the whole stream, so the job fails from another thread meanwhile
+        fail = threading.Timer(0.2, api.job_store.update_job, ("running",), {"status": JobStatus.FAILED, "progress": 100})
+        fail.start()
+        frames = _frames(client.get("/v1/jobs/running/events").text)  # returns once FAILED was sent
+        fail.join()
+        assert frames[0]["progress"] == 40
+        assert frames[-1]["status"] == JobStatus.FAILED.value
+
+        assert client.get("/v1/jobs/missing/events").status_code == 404
+
+
+def test_sse_frame():
+    frame = format_sse({"type": "page", "jobId": "a", "pageIndex": 2})
+    assert frame.startswith("event: page\ndata: ")
+    assert frame.endswith("\n\n")
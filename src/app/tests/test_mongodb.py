@@ -1 +1,267 @@
-""" Test the mongodb functionality. """
\ No newline at end of file
+""" Test the mongodb functionality. """
+
+import asyncio
+
+from datetime import timedelta
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from mongomock.gridfs import enable_gridfs_integration  # noqa: E402
+
+from src.app.main_workflow.job_events import JobEventBus  # noqa: E402
+from src.app.main_workflow.job_pipeline import JobPipeline  # noqa: E402
+from src.app.main_workflow.job_status_enums import JobStatus  # noqa: E402
+from src.app.utilities.mongodb_utils.artifact_store import MongoArtifactStore  # noqa: E402
+from src.app.utilities.mongodb_utils.job_store_util import MongoJobStore, utcnow  # noqa: E402
+from src.app.utilities.mongodb_utils.work_queue import MongoWorkQueue  # noqa: E402
+
+
+enable_gridfs_integration()
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["app_events"]
+
+
+@pytest.fixture
+def store(db):
+    return MongoJobStore(db["jobs"])
+
+
+@pytest.fixture
+def queue(db):
+    return MongoWorkQueue(db["work_queue"])
+
+
+def _expire(queue: MongoWorkQueue, job_id: str) -> None:
+    """ Fast forward past the item's visibility timeout / retry backoff """
+    queue.items.update_one({"jobId": job_id}, {"$set": {"visibleAt": utcnow() - timedelta(seconds=1)}})
+
+
+def _stall(store: MongoJobStore, job_id: str, owner: str = "dead-instance") -> None:
+    store.jobs.update_one(
+        {"_id": job_id},
+        {"$set": {
+            "status": JobStatus.PROCESSING.value,
+            "leaseOwner": owner,
+            "leaseExpiresAt": utcnow() - timedelta(seconds=1),
+        }},
+    )
+
+
+def test_lease_is_exclusive_until_it_expires(store):
+    store.create_job("a")
+
+    assert store.claim_job("a", "one", 60) is not None
+    assert store.claim_job("a", "two", 60) is None
+    assert store.claim_job("a", "one", 60) is not None  # renewing your own lease is fine
+
+    store.release_lease("a", "one")
+    assert store.claim_job("a", "two", 60)["leaseOwner"] == "two"
+
+
+def test_heartbeat_only_for_the_owner(store):
+    store.create_job("a")
+    store.claim_job("a", "one", 60)
+
+    assert store.heartbeat("a", "one", 60)
+    assert not store.heartbeat("a", "two", 60)
+
+
+def test_stalled_job_is_claimed_once(store):
+    store.create_job("live")
+    store.claim_job("live", "one", 60)
+    store.jobs.update_one({"_id": "live"}, {"$set": {"status": JobStatus.PROCESSING.value}})
+    store.create_job("stalled")
+    _stall(store, "stalled")
+    store.create_job("never-uploaded")
+
+    claimed = store.claim_stalled_job("two", 60)
+    assert claimed["_id"] == "stalled"
+    assert claimed["leaseOwner"] == "two"
+    assert store.claim_stalled_job("three", 60) is None
+
+
+def test_finished_jobs_are_not_claimed(store):
+    store.create_job("a")
+    _stall(store, "a")
+    store.update_job("a", status=JobStatus.FAILED)
+
+    assert store.claim_stalled_job("two", 60) is None
+
+
+def test_checkpoint(store):
+    store.create_job("a")
+    store.checkpoint_stage("a", "CONVERT_PAGES")
+    store.checkpoint_page("a", 2)
+    store.checkpoint_page("a", 2)
+    store.checkpoint_page("a", 1)
+    assert store.get_job("a")["checkpoint"] == {"stages": ["CONVERT_PAGES"], "pagesDone": [2, 1]}
+
+    store.reset_checkpoint("a")
+    assert store.get_job("a")["checkpoint"] == {"stages": [], "pagesDone": []}
+
+
+def test_artifacts_round_trip(db, tmp_path):
+    artifacts = MongoArtifactStore(db)
+    src = tmp_path / "in.pdf"
+    src.write_bytes(b"%PDF-1 first")
+    artifacts.save_file("a", "input.pdf", src)
+    src.write_bytes(b"%PDF-1 second")
+    artifacts.save_file("a", "input.pdf", src)
+
+    restored = artifacts.restore_file("a", "input.pdf", tmp_path / "other" / "input.pdf")
+    assert restored.read_bytes() == b"%PDF-1 second"
+    assert artifacts.restore_file("a", "result.docx", tmp_path / "result.docx") is None
+
+    artifacts.save_page("a", {"page_index": 2, "blocks": [{"text": "b"}]})
+    artifacts.save_page("a", {"page_index": 1, "blocks": [{"text": "a"}]})
+    artifacts.save_page("a", {"page_index": 1, "blocks": [{"text": "a again"}]})
+    assert [p["blocks"][0]["text"] for p in artifacts.load_pages("a")] == ["a again", "b"]
+
+    artifacts.delete_job("a")
+    assert artifacts.load_pages("a") == []
+    assert artifacts.restore_file("a", "input.pdf", tmp_path / "gone.pdf") is None
+
+
+def test_released_unfinished_job_is_claimable(store):
+    store.create_job("a")
+    store.claim_job("a", "one", 60)
+    store.update_job("a", status=JobStatus.PROCESSING)
+    store.release_lease("a", "one")
+
+    assert store.claim_stalled_job("two", 60)["_id"] == "a"
+
+
+def test_delayed_job_waits_for_its_delay(store, queue):
+    # Admitted ahead of its page budget: uploaded, lease released, queued with a start delay
+    store.create_job("a")
+    store.claim_job("a", "api-1", 60)
+    store.update_job("a", status=JobStatus.UPLOADED)
+    store.set_queued("a", True)
+    store.release_lease("a", "api-1")
+    queue.enqueue("a", delay_seconds=100)
+
+    assert queue.claim("w1", 60) is None
+    assert store.claim_stalled_job("api-2", 60) is None
+
+    _expire(queue, "a")
+    assert queue.claim("w1", 60)["jobId"] == "a"
+
+
+class _FailingIntake:
+    """ Rasterizing always fails, like a full disk """
+
+    def pdf_to_jpeg(self, pdf_path, images_dir):
+        raise OSError("No space left on device")
+
+
+def test_failed_queued_attempt_is_only_retried_by_the_queue(db, store, queue, tmp_path):
+    queue.max_attempts = 2
+    pipeline = JobPipeline(
+        job_store=store,
+        artifacts=MongoArtifactStore(db),
+        queue=queue,
+        events=JobEventBus(),
+        pdf_intake=_FailingIntake(),
+        math_pass=None,
+        docx_tool=None,
+        scheduler=object(),  # never reached
+        base_dir=tmp_path / "jobs",
+        owner="worker-1",
+    )
+    pdf = tmp_path / "input.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    store.create_job("a")
+    pipeline.artifacts.save_file("a", "input.pdf", pdf)
+    store.update_job("a", status=JobStatus.UPLOADED)
+    store.set_queued("a", True)
+    queue.enqueue("a")
+
+    asyncio.run(pipeline._run_queued(queue.claim("worker-1", 60), 0))
+    job = store.get_job("a")
+    assert job["status"] == JobStatus.UPLOADED.value and job["error"]["retrying"]
+    # Backing off, and the recovery loop of an inline instance must not take it either
+    assert store.claim_stalled_job("api-1", 60) is None
+    assert queue.claim("worker-1", 60) is None
+
+    _expire(queue, "a")
+    asyncio.run(pipeline._run_queued(queue.claim("worker-1", 60), 0))
+    job = store.get_job("a")
+    assert job["status"] == JobStatus.FAILED.value and not job["queued"]
+    assert queue.depth()["dead"] == 1
+
+
+def test_queue_claims_in_order(queue):
+    for job_id in ("first", "second"):
+        queue.enqueue(job_id)
+
+    assert queue.claim("w1", 60)["jobId"] == "first"
+    assert queue.claim("w2", 60)["jobId"] == "second"
+    assert queue.claim("w3", 60) is None
+
+    queue.ack("first", "w1")
+    queue.ack("second", "someone-else")  # only the claimer can ack
+    assert queue.depth()["inflight"] == 1
+
+
+def test_queue_redelivers_when_visibility_runs_out(queue):
+    queue.enqueue("a")
+    queue.claim("dead-worker", 60)
+    assert queue.claim("w2", 60) is None
+
+    _expire(queue, "a")
+    item = queue.claim("w2", 60)
+    assert (item["owner"], item["attempts"]) == ("w2", 2)
+    assert not queue.extend("a", "dead-worker", 60)
+    assert queue.extend("a", "w2", 60)
+
+
+def test_queue_retries_then_dead_letters(queue):
+    dead = []
+    queue.on_dead = dead.append
+    queue.enqueue("a")
+
+    queue.claim("w1", 60)
+    assert queue.retry("a", "w1", "boom")
+    assert queue.claim("w1", 60) is None  # backing off
+    assert queue.depth()["delayed"] == 1
+
+    _expire(queue, "a")
+    queue.claim("w1", 60)
+    assert queue.retry("a", "w1", "boom")
+    _expire(queue, "a")
+    queue.claim("w1", 60)
+    assert not queue.retry("a", "w1", "boom again")  # third attempt was the last
+
+    assert [(d["jobId"], d["error"]) for d in dead] == [("a", "boom again")]
+    assert queue.depth()["dead"] == 1
+    assert queue.claim("w1", 60) is None
+
+
+def test_queue_dead_letters_items_whose_claimers_keep_dying(queue):
+    dead = []
+    queue.on_dead = dead.append
+    queue.enqueue("a")
+    for _ in range(queue.max_attempts):
+        queue.claim("crashing", 60)
+        _expire(queue, "a")
+
+    assert queue.claim("w2", 60) is None
+    assert [d["jobId"] for d in dead] == ["a"]
+
+    queue.enqueue("a")  # a resume starts over
+    assert queue.claim("w2", 60)["attempts"] == 1
+
+
+def test_queue_release_does_not_spend_an_attempt(queue):
+    queue.enqueue("a")
+    queue.claim("w1", 60)
+    queue.release("a", "w1")
+    assert queue.claim("w2", 60)["attempts"] == 1
+
+    depth = queue.depth()
+    assert (depth["ready"], depth["inflight"], depth["dead"]) == (0, 1, 0)
@@ -2,5 +2,241 @@
 
 import pytest
 
+import cv2
+import numpy as np
 
+from src.app.main_workflow.job_pipeline import JobPipeline
+from src.app.utilities.document_ocr import DocumentOCR, OCRArguments, RefineConfig
+from src.app.utilities.image_preprocess import ImagePreprocessor, PreprocessConfig
+from src.app.utilities.layout_analysis import XYCutLayout
+from src.app.utilities.ocr_backend import OCRBackend
+from src.app.utilities.reader_registry import ReaderRegistry
+from src.app.utilities.stub_ocr import StubOCR
 
+
+def _block(text: str, x: float, y: float, w: float = 90.0, h: float = 40.0) -> dict:
+    return {
+        "text": text,
+        "x_min": x, "y_min": y, "x_max": x + w, "y_max": y + h,
+        "cx": x + w / 2.0, "cy": y + h / 2.0, "w": w, "h": h,
+    }
+
+
+def _two_column_page(lines: int = 6) -> list[dict]:
+    """ Two columns of 3 words per line, lines aligned across columns, 100px gutter """
+    blocks = []
+    for line in range(lines):
+        y = 300.0 + line * 56.0
+        for col, x0 in enumerate((100.0, 510.0)):
+            for word in range(3):
+                blocks.append(_block(f"c{col}l{line}w{word}", x0 + word * 110.0, y))
+    return blocks
+
+
+def _texts(blocks: list[dict]) -> list[str]:
+    return [b["text"] for b in blocks]
+
+
+def test_xycut_reads_two_columns_one_after_the_other():
+    blocks = _two_column_page()
+    ordered = _texts(XYCutLayout().order(list(reversed(blocks))))
+
+    left = [t for t in ordered if t.startswith("c0")]
+    assert ordered[:len(left)] == left
+    assert left == [f"c0l{line}w{word}" for line in range(6) for word in range(3)]
+
+
+def test_xycut_full_width_title_comes_first():
+    blocks = _two_column_page() + [_block("TITLE", 100.0, 100.0, w=850.0, h=60.0)]
+    ordered = XYCutLayout().order(blocks)
+
+    assert ordered[0]["text"] == "TITLE"
+    assert _texts(ordered)[1:4] == ["c0l0w0", "c0l0w1", "c0l0w2"]
+    assert ordered[0]["region"] != ordered[1]["region"]
+
+
+def test_xycut_keeps_table_rows_together():
+    blocks = [
+        _block("Name", 100.0, 100.0),
+        _block("Age", 600.0, 100.0),
+        _block("Bob", 100.0, 156.0),
+        _block("42", 600.0, 156.0),
+    ]
+    assert _texts(XYCutLayout().order(blocks)) == ["Name", "Age", "Bob", "42"]
+
+
+def test_xycut_single_column_matches_line_order():
+    blocks = [_block(f"l{line}w{word}", 100.0 + word * 110.0, 100.0 + line * 56.0) for line in range(5) for word in range(4)]
+    expected = _texts(blocks)
+    assert _texts(XYCutLayout().order(list(reversed(blocks)))) == expected
+
+
+def test_xycut_empty_page():
+    assert XYCutLayout().order([]) == []
+
+
+def _lined_page(angle: float) -> np.ndarray:
+    import cv2
+
+    page = np.full((900, 700), 255, np.uint8)
+    for y in range(80, 840, 40):
+        cv2.putText(page, "the quick brown fox 42", (40, y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2)
+    return ImagePreprocessor.rotate(page, angle)
+
+
+@pytest.mark.parametrize("angle", [3.0, -4.5])
+def test_deskew_finds_the_page_angle(angle):
+    found = ImagePreprocessor().estimate_skew(_lined_page(angle), PreprocessConfig(enabled=True))
+    assert found == pytest.approx(angle, abs=0.3)
+
+
+def test_preprocess_blank_page():
+    blank = np.full((200, 100), 255, np.uint8)
+    assert ImagePreprocessor().estimate_skew(blank) == 0.0
+    assert ImagePreprocessor().process(blank, PreprocessConfig(enabled=True)).shape == blank.shape
+
+
+def test_preprocess_settings():
+    assert JobPipeline.ocr_options(None) == {}
+    assert JobPipeline.ocr_options({"preprocess": {"enabled": False}}) == {}
+    options = JobPipeline.ocr_options({"preprocess": {"enabled": True, "block_size": 41, "unknown": 1}})
+    assert options["preprocess"].block_size == 41
+
+    with pytest.raises(ValueError):
+        PreprocessConfig.from_settings({"block_size": 40})
+
+
+class _BeamReader:
+    """ recognize() stand in, reads every crop back as "sharper" with a better score """
+
+    def __init__(self):
+        self.calls = []
+
+    def recognize(self, canvas, horizontal_list, free_list, decoder, **kw):
+        self.calls.append((canvas.shape, horizontal_list, decoder))
+        return [
+            ([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], f"sharper {i}", 0.9)
+            for i, (x0, x1, y0, y1) in enumerate(horizontal_list)
+        ]
+
+
+def _two_pass_ocr(**refine) -> DocumentOCR:
+    ocr = DocumentOCR.__new__(DocumentOCR)
+    ocr.args = OCRArguments(refine=RefineConfig(enabled=True, **refine))
+    ocr.reader = _BeamReader()
+    return ocr
+
+
+def test_refine_only_the_confidence_band():
+    ocr = _two_pass_ocr(scale=2.0, padding=0)
+    blocks = [
+        dict(_block("sure", 10, 10, w=50, h=20), confidence=0.95),
+        dict(_block("unsure", 10, 50, w=50, h=20), confidence=0.40),
+        dict(_block("speck", 10, 90, w=5, h=5), confidence=0.01),
+    ]
+    counts = ocr._refine_blocks(np.full((200, 200), 255, np.uint8), blocks)
+
+    assert counts == {"refined_blocks": 1, "improved_blocks": 1}
+    assert [b["text"] for b in blocks] == ["sure", "sharper 0", "speck"]
+    _, boxes, decoder = ocr.reader.calls[0]
+    assert decoder == "beamsearch"
+    x0, x1, y0, y1 = boxes[0]
+    assert (x1 - x0, y1 - y0) == (100, 40)  # upscaled crop
+
+
+def test_refine_keeps_the_better_reading():
+    ocr = _two_pass_ocr()
+    ocr.reader.recognize = lambda canvas, horizontal_list, **kw: [
+        ([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], "worse", 0.2) for x0, x1, y0, y1 in horizontal_list
+    ]
+    blocks = [dict(_block("kept", 10, 10), confidence=0.5)]
+    assert ocr._refine_blocks(np.full((100, 200), 255, np.uint8), blocks) == {"refined_blocks": 1, "improved_blocks": 0}
+    assert blocks[0]["text"] == "kept"
+
+
+def test_refine_disabled_never_recognizes_again():
+    ocr = _two_pass_ocr()
+    ocr.args = OCRArguments()
+    blocks = [dict(_block("unsure", 10, 10), confidence=0.4)]
+    assert ocr._refine_blocks(np.full((100, 200), 255, np.uint8), blocks) == {"refined_blocks": 0, "improved_blocks": 0}
+    assert ocr.reader.calls == []
+
+
+def test_backend_choice():
+    assert OCRBackend("stock").reader_kwargs() == {"quantize": True}
+    assert OCRBackend("fp32").reader_kwargs() == {"quantize": False}
+    assert OCRBackend("onnx").reader_kwargs() == {"quantize": False}  # quantized LSTMs don't export
+
+    with pytest.raises(ValueError):
+        OCRArguments(backend="tensorrt")
+    with pytest.raises(ValueError):
+        OCRBackend("stock", num_threads=-1)
+
+
+def test_stub_engine_pages_go_through_the_real_layout(tmp_path):
+    image = tmp_path / "page_1.jpg"
+    cv2.imwrite(str(image), np.full((1100, 850), 255, np.uint8))
+
+    page = StubOCR(seconds_per_page=0.0, lines_per_page=3).ocr_page(1, image)
+    assert page["page_index"] == 1
+    assert _texts(page["blocks"])[:3] == ["Problem", "4:", "find"]
+    assert all("region" in b for b in page["blocks"])
+    with pytest.raises(FileNotFoundError):
+        StubOCR().ocr_page(2, tmp_path / "missing.jpg")
+
+
+def test_reader_registry_loads_language_sets_on_first_use_and_evicts_the_oldest():
+    loads = []
+
+    def load(languages):
+        loads.append(languages)
+        return object()
+
+    registry = ReaderRegistry(load, max_readers=2, pinned=[["en"]])
+    assert loads == [("en",)]
+
+    french = registry.get(["fr", "en"])
+    assert registry.get(["en", "FR", "en"]) is french  # same set, another spelling
+    registry.get(["de"])
+    registry.get(["fr", "en"])
+    registry.get(["es"])  # ("de",) is the least recently used
+    assert loads == [("en",), ("en", "fr"), ("de",), ("es",)]
+    assert registry.loaded() == [("en",), ("en", "fr"), ("es",)]
+
+    registry.get(["de"])
+    registry.get(["en"])  # pinned, never evicted or reloaded
+    assert loads[-1] == ("de",) and loads.count(("en",)) == 1
+
+    stats = registry.stats()
+    assert stats["evictions"] == 2
+    assert stats["languageSets"]["de"]["loads"] == 2 and stats["languageSets"]["de"]["evictions"] == 1
+    assert stats["languageSets"]["de"]["lastLoadSeconds"] >= 0
+    assert [e["event"] for e in stats["events"]][-3:] == ["evict", "load", "evict"]
+    with pytest.raises(ValueError):
+        registry.get([" "])
+
+
+class _TextReader:
+    """ readtext() stand in, reads every page as its own language set """
+
+    def __init__(self, languages):
+        self.languages = languages
+
+    def readtext(self, image, **kw):
+        return [([[10, 10], [200, 10], [200, 50], [10, 50]], "+".join(self.languages), 0.9)]
+
+
+def test_job_languages_pick_their_reader(tmp_path):
+    image = tmp_path / "page_1.jpg"
+    cv2.imwrite(str(image), np.full((400, 300), 255, np.uint8))
+
+    ocr = DocumentOCR.__new__(DocumentOCR)
+    ocr.args = OCRArguments()
+    ocr.readers = ReaderRegistry(_TextReader, max_readers=1, pinned=[ocr.args.languages])
+    ocr.reader = ocr.readers.get(ocr.args.languages)
+    ocr.layout = XYCutLayout(ocr.args.layout)
+
+    assert _texts(ocr.ocr_page(1, image)["blocks"]) == ["en"]
+    options = JobPipeline.ocr_options({"languages": ["fr", "en"]})
+    assert _texts(ocr.ocr_page(1, image, **options)["blocks"]) == ["en+fr"]
+    assert ocr.readers.loaded() == [("en",), ("en", "fr")]
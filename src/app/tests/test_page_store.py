@@ -0,0 +1,119 @@
+""" Test the per-page record store used for partial results and resume. """
+
+import mmap
+
+import numpy as np
+
+from src.app.utilities.ocr_codec import ColumnarPages, decode_pages, encode_pages, write_pages
+from src.app.utilities.omml_pass import MathPass
+from src.app.utilities.page_store import PageStore
+
+
+def _page(idx: int, text: str = "x") -> dict:
+    return {"page_index": idx, "image_path": f"page_{idx}.jpg", "blocks": [{"text": text}]}
+
+
+def test_pages_load_in_page_order(tmp_path):
+    store = PageStore.for_job(tmp_path)
+    for idx in (3, 1, 2):
+        store.append(_page(idx))
+
+    assert [p["page_index"] for p in store.load()] == [1, 2, 3]
+    assert store.page_indexes() == {1, 2, 3}
+
+
+def test_later_record_of_a_page_wins(tmp_path):
+    store = PageStore.for_job(tmp_path)
+    store.append(_page(1, "first"))
+    store.append(_page(1, "second"))
+
+    assert [p["blocks"][0]["text"] for p in store.load()] == ["second"]
+
+
+def test_torn_last_line_is_skipped_and_not_glued_to_the_next(tmp_path):
+    PageStore.for_job(tmp_path).append(_page(1))
+    with (tmp_path / PageStore.FILENAME).open("a") as f:
+        f.write('{"page_index": 2, "blo')
+
+    store = PageStore.for_job(tmp_path)
+    assert store.page_indexes() == {1}
+
+    store.append(_page(3))
+    assert store.page_indexes() == {1, 3}
+
+
+def test_numpy_bbox_is_stored_as_lists(tmp_path):
+    store = PageStore.for_job(tmp_path)
+    page = _page(1)
+    page["blocks"][0]["bbox"] = np.array([[0, 0], [10, 0], [10, 5], [0, 5]], dtype=np.int32)
+    store.append(page)
+
+    assert store.load()[0]["blocks"][0]["bbox"] == [[0, 0], [10, 0], [10, 5], [0, 5]]
+
+
+def test_missing_store_and_clear(tmp_path):
+    store = PageStore.for_job(tmp_path)
+    assert store.load() == []
+
+    store.append(_page(1))
+    store.clear()
+    assert store.load() == []
+
+
+def _ocr_block(text: str, x: int, conf: float, **extra) -> dict:
+    bbox = [[x, 10], [x + 40, 10], [x + 40, 30], [x, 30]]
+    return {
+        "text": text, "confidence": conf, "bbox": bbox,
+        "x_min": float(x), "y_min": 10.0, "x_max": float(x + 40), "y_max": 30.0,
+        "cx": x + 20.0, "cy": 20.0, "w": 40.0, "h": 20.0, **extra,
+    }
+
+
+def test_codec_round_trips_page_records():
+    pages = [
+        {
+            "page_index": 2, "image_path": "page_2.jpg", "refined_blocks": 1, "improved_blocks": 0,
+            "blocks": [_ocr_block("x = 2", 0, 0.91, region=0, is_math=True), _ocr_block("héllo", 50, 0.5, note=[1, 2])],
+        },
+        {"page_index": 1, "blocks": [{"text": "bare"}], "lang": "en"},
+        {"page_index": 3, "blocks": []},
+    ]
+    pages[0]["blocks"][1]["bbox"] = np.array(pages[0]["blocks"][1]["bbox"], dtype=np.int32)
+
+    decoded = decode_pages(encode_pages(pages))
+    pages[0]["blocks"][1]["bbox"] = pages[0]["blocks"][1]["bbox"].tolist()
+    assert decoded == pages
+    assert decode_pages(encode_pages([])) == []
+
+
+def test_codec_keeps_float32_precision_of_fractional_boxes():
+    block = _ocr_block("a", 0, 0.123456789)
+    block["bbox"] = [[0.25, 10], [40.5, 10], [40.5, 30.75], [0.25, 30.75]]
+
+    decoded = decode_pages(encode_pages([{"page_index": 1, "blocks": [block]}]))[0]["blocks"][0]
+    assert decoded["bbox"] == block["bbox"]
+    assert decoded["confidence"] == 0.123457
+
+
+def test_codec_file_is_memory_mapped_and_readable_per_page(tmp_path):
+    pages = [{"page_index": i, "blocks": [_ocr_block(f"p{i}", x, 0.5) for x in range(0, 200, 50)]} for i in (1, 2, 3)]
+    path = tmp_path / "pages.npz"
+    write_pages(path, pages)
+
+    columns = ColumnarPages.open(path)
+    assert isinstance(columns.column("confidence").base, mmap.mmap)
+    assert len(columns) == 3 and columns.block_count == 12
+    assert columns.column("rect", page=1)[:, 0].tolist() == [0, 50, 100, 150]
+    assert columns.page(1) == pages[1]
+    assert ColumnarPages.open(path, mmap=False).pages() == pages
+    assert sorted(np.load(path).files) == sorted(columns.arrays)  # still a plain npz
+
+
+def test_tag_page_matches_tag_blocks():
+    page = {"page_index": 1, "blocks": [{"text": "x = 2"}, {"text": "hello"}]}
+    math_pass = MathPass()
+
+    tagged = math_pass.tag_page(page)
+    assert [b["is_math"] for b in tagged["blocks"]] == [True, False]
+    assert math_pass.tag_blocks({"pages": [page]})["pages"] == [tagged]
+    assert "is_math" not in page["blocks"][0]
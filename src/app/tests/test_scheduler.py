@@ -0,0 +1,164 @@
+""" Test the page scheduler. """
+
+import threading
+import time
+
+from pathlib import Path
+
+import pytest
+
+from src.app.main_workflow.scheduler import PageScheduler, SchedulerConfig
+from src.app.utilities.job_profiler import PROFILE_FILES, JobProfiler
+
+
+class FakeOCR:
+    """ process_page stand-in that records the order pages ran in and how many ran at once """
+
+    def __init__(self, delay: float = 0.01) -> None:
+        self.delay = delay
+        self.order: list[str] = []
+        self.running = 0
+        self.max_running = 0
+        self.gate: dict[str, threading.Event] = {}
+        self.fail: set[str] = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, page_index: int, path: Path) -> dict:
+        key = f"{path.parent.name}/{page_index}"
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            if key in self.gate:
+                self.gate[key].wait(timeout=5)
+            time.sleep(self.delay)
+            if key in self.fail:
+                raise ValueError(f"bad page {key}")
+            with self._lock:
+                self.order.append(key)
+            return {"page_index": page_index, "image_path": str(path), "blocks": [{"text": key}]}
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+def _pages(job: str, n: int) -> list[Path]:
+    return [Path(job) / f"page_{i}.jpg" for i in range(1, n + 1)]
+
+
+@pytest.fixture
+def make_scheduler():
+    started: list[PageScheduler] = []
+
+    def _make(ocr: FakeOCR, **cfg) -> PageScheduler:
+        scheduler = PageScheduler(ocr, SchedulerConfig(**cfg))
+        scheduler.start()
+        started.append(scheduler)
+        return scheduler
+
+    yield _make
+    for scheduler in started:
+        scheduler.stop()
+
+
+def test_sjf_runs_small_job_before_the_rest_of_a_big_one(make_scheduler):
+    ocr = FakeOCR()
+    ocr.gate["big/1"] = threading.Event()
+    scheduler = make_scheduler(ocr, workers=1)
+
+    big = scheduler.submit("big", _pages("big", 5))
+    time.sleep(0.05)
+    small = scheduler.submit("small", _pages("small", 1))
+    assert scheduler.snapshot("small")["state"] == "queued"
+    ocr.gate["big/1"].set()
+
+    assert small.result(timeout=5)["page_count"] == 1
+    result = big.result(timeout=5)
+
+    assert ocr.order[:2] == ["big/1", "small/1"]
+    assert [p["page_index"] for p in result["pages"]] == [1, 2, 3, 4, 5]
+    assert result["total_blocks"] == 5
+
+
+def test_round_robin_alternates_jobs():
+    ocr = FakeOCR()
+    scheduler = PageScheduler(ocr, SchedulerConfig(workers=1, policy="round_robin"))
+
+    # Both jobs are queued before a worker exists, so neither gets a head start
+    a = scheduler.submit("a", _pages("a", 3))
+    b = scheduler.submit("b", _pages("b", 3))
+    scheduler.start()
+    try:
+        a.result(timeout=5)
+        b.result(timeout=5)
+    finally:
+        scheduler.stop()
+
+    assert ocr.order == ["a/1", "b/1", "a/2", "b/2", "a/3", "b/3"]
+
+
+@pytest.mark.parametrize("cap", [1, 2])
+def test_per_job_page_cap(make_scheduler, cap):
+    ocr = FakeOCR(delay=0.05)
+    scheduler = make_scheduler(ocr, workers=4, max_pages_in_flight_per_job=cap)
+
+    scheduler.submit("job", _pages("job", 6)).result(timeout=5)
+    assert ocr.max_running == cap
+
+
+def test_page_failure_fails_only_that_job(make_scheduler):
+    ocr = FakeOCR()
+    ocr.fail.add("bad/2")
+    scheduler = make_scheduler(ocr, workers=1)
+
+    bad = scheduler.submit("bad", _pages("bad", 4))
+    good = scheduler.submit("good", _pages("good", 2))
+
+    with pytest.raises(ValueError, match="bad page bad/2"):
+        bad.result(timeout=5)
+    assert good.result(timeout=5)["page_count"] == 2
+    assert "bad/3" not in ocr.order
+    assert scheduler.snapshot("bad") is None
+
+
+def test_stop_fails_unfinished_jobs(make_scheduler):
+    ocr = FakeOCR()
+    ocr.gate["job/1"] = threading.Event()
+    scheduler = make_scheduler(ocr, workers=1)
+
+    future = scheduler.submit("job", _pages("job", 3))
+    time.sleep(0.05)
+    stopper = threading.Thread(target=scheduler.stop)
+    stopper.start()
+
+    with pytest.raises(RuntimeError, match="Scheduler stopped"):
+        future.result(timeout=5)
+
+    ocr.gate["job/1"].set()
+    stopper.join(timeout=5)
+    assert ocr.order == ["job/1"]
+
+
+def test_profile_covers_only_the_profiled_job(make_scheduler, tmp_path):
+    ocr = FakeOCR(delay=0.05)
+    scheduler = make_scheduler(ocr, workers=2)
+
+    profiler = JobProfiler(interval=0.002)
+    profiler.start()
+    profiled = scheduler.submit("a", _pages("a", 3), page_context=lambda: profiler.track("ocr_page"))
+    other = scheduler.submit("b", _pages("b", 3))
+    profiled.result(timeout=5)
+    other.result(timeout=5)
+    profiler.stop()
+
+    paths = profiler.write(tmp_path)
+    assert [p.name for p in paths] == list(PROFILE_FILES)
+
+    stacks = [line.rsplit(" ", 1) for line in paths[1].read_text().splitlines()]
+    assert stacks
+    assert all(stack.startswith("ocr_page;") and "__call__ (" in stack for stack, _ in stacks)
+    # Only job a's three pages were tracked, 0.05s each, job b's would double it
+    report = paths[0].read_text()
+    seconds = float(next(line for line in report.splitlines() if line.endswith("  ocr_page")).split()[0])
+    assert 0.14 < seconds < 0.25
+    assert "Peak traced memory" in paths[2].read_text()
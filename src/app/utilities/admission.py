@@ -0,0 +1,148 @@
+""" Admission control: page-per-minute token buckets per client and for the whole service """
+
+
+import math
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+from src.app.utilities.mongodb_utils.job_store_util import utcnow
+
+
+@dataclass(frozen=True)
+class BucketLimit:
+    pages_per_minute: float
+    burst_pages: float   # bucket size, also the largest job that can ever be admitted
+
+    def __post_init__(self):
+        if self.pages_per_minute <= 0 or self.burst_pages <= 0:
+            raise ValueError("Bucket rate and size must be positive")
+
+    @property
+    def per_second(self) -> float:
+        return self.pages_per_minute / 60.0
+
+
+@dataclass(frozen=True)
+class AdmissionConfig:
+    enabled: bool = True
+    client: BucketLimit = field(default_factory=lambda: BucketLimit(pages_per_minute=30, burst_pages=200))
+    service: BucketLimit = field(default_factory=lambda: BucketLimit(pages_per_minute=300, burst_pages=1000))
+    # A job the buckets can't cover yet is queued to start once they can, if that is at most this far out.
+    # Anything later is rejected with 429 and Retry-After. 0 never queues.
+    max_queue_wait_seconds: float = 120.0
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Optional[dict[str, str]]:
+        if self.retry_after is None:
+            return None
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+@dataclass
+class AdmissionController:
+    """
+    Token buckets of pages, kept in Mongo so every API replica draws from the same budget.
+
+    A bucket document is {tokens, updatedAt, v}. Refill is computed lazily on read, and updates are
+    compare-and-set on the version `v`, retried on conflict. A job admitted ahead of the refill
+    (queued) takes its pages anyway, leaving the bucket in debt. That makes later jobs wait behind it
+    instead of overtaking it.
+    """
+    buckets: Collection
+    cfg: AdmissionConfig = field(default_factory=AdmissionConfig)
+    clock: Callable[[], datetime] = utcnow
+
+    MAX_CAS_RETRIES = 20
+
+    def ensure_indexes(self) -> None:
+        # A bucket left alone long enough to refill completely is the same as no bucket at all
+        self.buckets.create_index("expiresAt", expireAfterSeconds=0)
+
+    def admit(self, client_id: str, pages: int) -> float:
+        """
+        Take `pages` from the client's and the service's buckets. Returns the seconds the job has to
+        wait before it may start (0.0 to start now), raises AdmissionRejected when it can't be admitted.
+        """
+        if not self.cfg.enabled:
+            return 0.0
+
+        largest = min(self.cfg.client.burst_pages, self.cfg.service.burst_pages)
+        if pages > largest:
+            raise AdmissionRejected(413, f"The PDF has {pages} pages, at most {int(largest)} are accepted per job.")
+
+        client_key = f"client:{client_id}"
+        client_wait = self._take(client_key, self.cfg.client, pages)
+        if client_wait > self.cfg.max_queue_wait_seconds:
+            raise AdmissionRejected(429, "Page budget for this client used up, try again later.", client_wait)
+
+        service_wait = self._take("service", self.cfg.service, pages)
+        if service_wait > self.cfg.max_queue_wait_seconds:
+            self._refund(client_key, pages)
+            raise AdmissionRejected(429, "The service is at capacity, try again later.", service_wait)
+
+        return max(client_wait, service_wait)
+
+    def remaining(self, client_id: str) -> dict[str, float]:
+        """ Pages each bucket could admit right now (negative while in debt) """
+        now = self.clock()
+        return {
+            "client": self._level(self.buckets.find_one({"_id": f"client:{client_id}"}), self.cfg.client, now),
+            "service": self._level(self.buckets.find_one({"_id": "service"}), self.cfg.service, now),
+        }
+
+    def _take(self, key: str, limit: BucketLimit, pages: int) -> float:
+        """
+        Seconds until the bucket holds `pages`. The pages are taken only when that wait is within
+        max_queue_wait_seconds, otherwise the bucket is left alone.
+        """
+        for _ in range(self.MAX_CAS_RETRIES):
+            now = self.clock()
+            doc = self.buckets.find_one({"_id": key})
+            tokens = self._level(doc, limit, now)
+            wait = max(0.0, (pages - tokens) / limit.per_second)
+            if wait > self.cfg.max_queue_wait_seconds:
+                return wait
+
+            update = {
+                "tokens": tokens - pages,
+                "updatedAt": now,
+                "expiresAt": now + timedelta(seconds=(limit.burst_pages - tokens + pages) / limit.per_second),
+            }
+            if doc is None:
+                try:
+                    self.buckets.insert_one({"_id": key, "v": 1, **update})
+                    return wait
+                except DuplicateKeyError:
+                    continue
+
+            result = self.buckets.update_one({"_id": key, "v": doc["v"]}, {"$set": update, "$inc": {"v": 1}})
+            if result.matched_count == 1:
+                return wait
+
+        raise AdmissionRejected(429, "Too many uploads at once, try again shortly.", 1.0)
+
+    def _refund(self, key: str, pages: int) -> None:
+        self.buckets.update_one({"_id": key}, {"$inc": {"tokens": pages, "v": 1}})
+
+    @staticmethod
+    def _level(doc: Optional[dict], limit: BucketLimit, now: datetime) -> float:
+        if doc is None:
+            return limit.burst_pages
+        updated = doc["updatedAt"]
+        if updated.tzinfo is None:
+            updated = updated.replace(tzinfo=now.tzinfo)  # pymongo hands back naive UTC by default
+        elapsed = max(0.0, (now - updated).total_seconds())
+        return min(limit.burst_pages, doc["tokens"] + elapsed * limit.per_second)
@@ -2,17 +2,50 @@
 
 
 
-from typing import Any, Sequence
+from typing import Any, Optional, Sequence
 from pathlib import Path
 from dataclasses import dataclass
 
+import cv2
 import easyocr
+import numpy as np
+
+from src.app.utilities.image_preprocess import ImagePreprocessor, PreprocessConfig
+from src.app.utilities.layout_analysis import XYCutLayout, XYCutConfig
+from src.app.utilities.ocr_backend import BACKENDS, OCRBackend
+from src.app.utilities.reader_registry import LanguageKey, ReaderRegistry
+
+
+@dataclass(frozen=True)
+class RefineConfig:
+    """ Second, slower recognition pass for the blocks the greedy pass was unsure about """
+    enabled: bool = False
+
+    min_confidence: float = 0.05   # below this it is mostly specks and smudges, not worth a second look
+    max_confidence: float = 0.60   # blocks at or above this keep their greedy result
+    decoder: str = "beamsearch"    # "beamsearch" or "wordbeamsearch"
+    beam_width: int = 5
+
+    scale: float = 2.0             # crops are upscaled by this before they are recognized again
+    padding: int = 4               # pixels of context kept around each crop
+    max_blocks_per_page: int = 64  # bounds the cost of a page that is low confidence everywhere
+
+    def __post_init__(self):
+        if self.decoder not in ("beamsearch", "wordbeamsearch"):
+            raise ValueError(f"Unknown refine decoder: {self.decoder}")
+        if not 0.0 <= self.min_confidence < self.max_confidence <= 1.0:
+            raise ValueError("Refine confidence band must satisfy 0 <= min_confidence < max_confidence <= 1")
+        if self.scale < 1.0:
+            raise ValueError("Refine scale must be >= 1")
 
 
 @dataclass(frozen=True)
 class OCRArguments:
-    languages: tuple[str, ...] = ("en",)
+    languages: tuple[str, ...] = ("en",)  # loaded with the engine, jobs may ask for other sets
+    max_readers: int = 2          # other language sets kept loaded at once, least recently used is evicted
     gpu: bool = False
+    backend: str = "stock"        # CPU inference backend, see OCRBackend: "stock", "fp32", "torchscript" or "onnx"
+    num_threads: int = 0          # torch / onnxruntime intra-op threads, 0 keeps the library default
 
     min_confidence: float = 0.30  # min 30% on text
     detail: int = 1               
@@ -23,25 +56,67 @@ class OCRArguments:
     low_text: float = 0.4
     link_threshold: float = 0.4
 
+    reading_order: str = "xycut"  # "xycut" for column aware layout, "grid" for the old y-bucket then x sort
+    layout: XYCutConfig = XYCutConfig()
+    refine: RefineConfig = RefineConfig()  # two pass mode: greedy on the page, beam search on the unsure blocks
+
+    def __post_init__(self):
+        if self.reading_order not in ("xycut", "grid"):
+            raise ValueError(f"Unknown reading order: {self.reading_order}")
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown OCR backend: {self.backend}")
+
 
 class DocumentOCR:
     """ Contains helper functions for OCR processing. """
 
     def __init__(self, args: OCRArguments = OCRArguments()) -> None:
         self.args = args
-        self.reader = easyocr.Reader(list(self.args.languages), gpu=self.args.gpu)
+        self.backend = OCRBackend(self.args.backend, self.args.num_threads)
+        # The default languages load now and stay, other sets load the first time a job asks for them
+        self.readers = ReaderRegistry(self._load_reader, max_readers=self.args.max_readers, pinned=[self.args.languages])
+        self.reader = self.readers.get(self.args.languages)
+        self.layout = XYCutLayout(self.args.layout)
+        self.preprocessor = ImagePreprocessor()
+
+    def _load_reader(self, languages: LanguageKey) -> Any:
+        reader = easyocr.Reader(list(languages), gpu=self.args.gpu, **self.backend.reader_kwargs())
+        self.backend.install(reader)
+        return reader
 
+    def _reader_for(self, languages: Optional[Sequence[str]]) -> Any:
+        """ The engine's default reader, or the one for a job's own language set """
+        return self.reader if languages is None else self.readers.get(languages)
 
-    def ocr_image(self, image_path: Path) -> list[dict[str, Any]]:
-        """ Run OCR on one single image"""
+    def ocr_image(
+        self, image_path: Path, preprocess: Optional[PreprocessConfig] = None, languages: Optional[Sequence[str]] = None
+    ) -> list[dict[str, Any]]:
+        """ Run OCR on one single image, cleaned up in memory first when `preprocess` is enabled """
+        return self._read_image(image_path, preprocess, languages)[0]
+
+    def _read_image(
+        self,
+        image_path: Path,
+        preprocess: Optional[PreprocessConfig] = None,
+        languages: Optional[Sequence[str]] = None,
+    ) -> tuple[list[dict[str, Any]], dict[str, int]]:
+        """ ocr_image() plus the counts of the refine pass """
         if image_path is None:
             raise ValueError("Image path is None")
 
         if not image_path.exists():
             raise FileNotFoundError(f"Image not found at path: {image_path}")
-        
-        raw_read = self.reader.readtext(
-            str(image_path),
+
+        image: Any = str(image_path)
+        if preprocess is not None and preprocess.enabled:
+            pixels = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+            if pixels is None:
+                raise ValueError(f"Could not decode image: {image_path}")
+            image = self.preprocessor.process(pixels, preprocess)
+
+        reader = self._reader_for(languages)
+        raw_read = reader.readtext(
+            image,
             detail=self.args.detail,
             paragraph=self.args.paragraph,
             decoder=self.args.decoder,
@@ -51,33 +126,54 @@ class DocumentOCR:
         )
 
         blocks = self._normalize_easyocr_result(raw_read)
+        # Before the filter, a block the second pass rescues must not be dropped for its greedy score
+        refined = self._refine_blocks(image, blocks, reader)
         blocks = self._filter_blocks(blocks, min_conf=self.args.min_confidence)
-        blocks = self._sort_reading_order(blocks)
-        return blocks
+        if self.args.reading_order == "xycut":
+            blocks = self.layout.order(blocks)
+        else:
+            blocks = self._sort_reading_order(blocks)
+        return blocks, refined
     
-    def ocr_pages(self, image_paths: Sequence[Path]) -> dict[str, Any]:
+    def ocr_page(
+        self,
+        page_index: int,
+        image_path: Path,
+        preprocess: Optional[PreprocessConfig] = None,
+        languages: Optional[Sequence[str]] = None,
+    ) -> dict[str, Any]:
+        """ OCR one page into the per-page record that ocr_pages() collects """
+        blocks, refined = self._read_image(image_path, preprocess, languages)
+        return {
+            "page_index": page_index,
+            "image_path": str(image_path),
+            "blocks": blocks,
+            **refined,
+        }
+
+    def ocr_pages(
+        self,
+        image_paths: Sequence[Path],
+        preprocess: Optional[PreprocessConfig] = None,
+        languages: Optional[Sequence[str]] = None,
+    ) -> dict[str, Any]:
         """
         OCR many page images. calls ocr_on_one_image() implicitly
         Returns a dict with per-page results + simple aggregate info.
         """
-        pages: list[dict[str, Any]] = []
-        total_blocks = 0
-
-        for idx, p in enumerate(image_paths, start=1):
-            blocks = self.ocr_image(p)
-            total_blocks += len(blocks)
-            pages.append(
-                {
-                    "page_index": idx,
-                    "image_path": str(p),
-                    "blocks": blocks,
-                }
-            )
+        pages = [self.ocr_page(idx, p, preprocess, languages) for idx, p in enumerate(image_paths, start=1)]
+        return self.collect_pages(pages)
 
+    @staticmethod
+    def collect_pages(pages: Sequence[dict[str, Any]]) -> dict[str, Any]:
+        """ Assemble page records (in any order) into the ocr_pages() result """
+        ordered = sorted(pages, key=lambda page: page["page_index"])
         return {
-            "page_count": len(image_paths),
-            "total_blocks": total_blocks,
-            "pages": pages,
+            "page_count": len(ordered),
+            "total_blocks": sum(len(page["blocks"]) for page in ordered),
+            "refined_blocks": sum(page.get("refined_blocks", 0) for page in ordered),
+            "improved_blocks": sum(page.get("improved_blocks", 0) for page in ordered),
+            "pages": ordered,
         }
     
     def _normalize_easyocr_result(self, raw: list[Any]) -> list[dict[str, Any]]:
@@ -116,6 +212,98 @@ class DocumentOCR:
 
         return blocks
 
+    def _refine_blocks(self, image: Any, blocks: list[dict[str, Any]], reader: Any = None) -> dict[str, int]:
+        """
+        Second pass of the two pass mode. Blocks inside the confidence band are cropped from the page,
+        upscaled and recognized again with the beam search decoder, all in one batched recognize() call.
+        A block takes the new reading only when it is more confident. Updates `blocks` in place.
+        """
+        cfg = self.args.refine
+        counts = {"refined_blocks": 0, "improved_blocks": 0}
+        if not cfg.enabled:
+            return counts
+
+        candidates = [
+            b for b in blocks
+            if cfg.min_confidence <= b["confidence"] < cfg.max_confidence and b["w"] > 0 and b["h"] > 0
+        ]
+        if not candidates:
+            return counts
+        candidates = sorted(candidates, key=lambda b: b["confidence"])[:cfg.max_blocks_per_page]
+
+        gray = image if isinstance(image, np.ndarray) else cv2.imread(str(image), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            return counts
+
+        canvas, boxes = self._crop_canvas(gray, candidates, cfg)
+        reader = self.reader if reader is None else reader
+        raw = reader.recognize(
+            canvas,
+            horizontal_list=boxes,
+            free_list=[],
+            decoder=cfg.decoder,
+            beamWidth=cfg.beam_width,
+            batch_size=len(boxes),
+            detail=1,
+            paragraph=False,
+        )
+
+        # Merge back by bbox: each result lands inside exactly one crop's slot on the canvas
+        readings: list[list[tuple[float, str, float]]] = [[] for _ in boxes]
+        for item in raw:
+            if not isinstance(item, (list, tuple)) or len(item) < 3 or not item[1]:
+                continue
+            x_min, y_min, _, y_max = self._bbox_to_rect(item[0])
+            cy = (y_min + y_max) / 2.0
+            for slot, (_, _, top, bottom) in enumerate(boxes):
+                if top <= cy < bottom:
+                    readings[slot].append((x_min, str(item[1]).strip(), float(item[2])))
+                    break
+
+        counts["refined_blocks"] = len(candidates)
+        for block, reading in zip(candidates, readings):
+            if not reading:
+                continue
+            reading.sort()
+            text = " ".join(part for _, part, _ in reading if part)
+            confidence = float(np.mean([conf for _, _, conf in reading]))
+            if text and confidence > block["confidence"]:
+                block["text"] = text
+                block["confidence"] = confidence
+                counts["improved_blocks"] += 1
+
+        return counts
+
+    @staticmethod
+    def _crop_canvas(
+        gray: np.ndarray, blocks: list[dict[str, Any]], cfg: RefineConfig, gap: int = 8
+    ) -> tuple[np.ndarray, list[list[int]]]:
+        """ Stack the upscaled crops of `blocks` on one white canvas, with their boxes in horizontal_list form """
+        page_h, page_w = gray.shape[:2]
+        crops: list[np.ndarray] = []
+        for b in blocks:
+            x0 = max(0, int(b["x_min"]) - cfg.padding)
+            y0 = max(0, int(b["y_min"]) - cfg.padding)
+            x1 = min(page_w, int(np.ceil(b["x_max"])) + cfg.padding)
+            y1 = min(page_h, int(np.ceil(b["y_max"])) + cfg.padding)
+            crop = gray[y0:max(y1, y0 + 1), x0:max(x1, x0 + 1)]
+            if cfg.scale != 1.0:
+                crop = cv2.resize(crop, None, fx=cfg.scale, fy=cfg.scale, interpolation=cv2.INTER_CUBIC)
+            crops.append(crop)
+
+        width = max(c.shape[1] for c in crops) + 2 * gap
+        height = sum(c.shape[0] for c in crops) + gap * (len(crops) + 1)
+        canvas = np.full((height, width), 255, dtype=gray.dtype)
+
+        boxes: list[list[int]] = []
+        y = gap
+        for crop in crops:
+            h, w = crop.shape[:2]
+            canvas[y:y + h, gap:gap + w] = crop
+            boxes.append([gap, gap + w, y, y + h])  # x_min, x_max, y_min, y_max
+            y += h + gap
+        return canvas, boxes
+
     @staticmethod
     def _filter_blocks(blocks: list[dict[str, Any]], min_conf: float) -> list[dict[str, Any]]:
         return [b for b in blocks if b.get("confidence", 0.0) >= min_conf and b.get("text")]
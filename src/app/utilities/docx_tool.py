@@ -2,12 +2,14 @@
 
 
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 from dataclasses import dataclass, field
 
 from docx import Document
 from docx.shared import Pt
 
+from src.app.utilities.math_render import MathRenderer
+
 
 @dataclass
 class DocxConfig:
@@ -17,6 +19,7 @@ class DocxConfig:
 
     math_font_name: str = "Consolas"
     math_font_size: int = 11
+    render_math: bool = True  # math blocks as native Office Math, the font switch is the fallback
 
 
 class DocxTool:
@@ -29,8 +32,9 @@ class DocxTool:
     
     """
 
-    def __init__(self, cfg: DocxConfig = DocxConfig()) -> None:
+    def __init__(self, cfg: DocxConfig = DocxConfig(), math_renderer: Optional[MathRenderer] = None) -> None:
         self._cfg = cfg
+        self._math = math_renderer or MathRenderer()
 
 
     def render_document(self, ocr_tagged: dict[str, Any], out_path: Path) -> Path:
@@ -52,14 +56,21 @@ class DocxTool:
                     continue
 
                 p = doc.add_paragraph()
+
+                if blk.get("is_math") and self._cfg.render_math:
+                    o_math = self._math.to_omml(text)
+                    if o_math is not None:
+                        p._p.append(o_math)
+                        continue
+
                 run = p.add_run(text)
 
-                run.font.name = self._cfg.font_name
-                run.font.size = Pt(self._cfg.font_size_pt)
+                run.font.name = self._cfg.font_style
+                run.font.size = Pt(self._cfg.output_font_size)
 
                 if blk.get("is_math"):
                     run.font.name = self._cfg.math_font_name
-                    run.font.size = Pt(self._cfg.math_font_size_pt)
+                    run.font.size = Pt(self._cfg.math_font_size)
 
             doc.add_page_break()
 
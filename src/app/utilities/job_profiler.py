@@ -0,0 +1,200 @@
+""" On demand CPU and memory profile of a single job """
+
+
+import sys
+import sysconfig
+import threading
+import time
+import tracemalloc
+
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+
+# What write() produces: the report, the folded stacks for a flame graph, the allocation sites
+PROFILE_FILES: tuple[str, ...] = ("profile.txt", "profile.collapsed", "memory.txt")
+
+# Stripped from file names in the report, longest first so site-packages wins over the stdlib
+_PATH_PREFIXES = sorted(
+    {str(Path(sysconfig.get_paths()[key])) + "/" for key in ("purelib", "platlib", "stdlib")}
+    | {str(Path(__file__).resolve().parents[3]) + "/"},
+    key=len,
+    reverse=True,
+)
+
+# tracemalloc is process wide, it stays on while any job is being profiled
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+class JobProfiler:
+    """
+    Sampling profiler (pyinstrument style) for the threads working on one job, plus tracemalloc.
+
+    cProfile can't be used per job: since python 3.12 it hooks sys.monitoring, which is process wide,
+    so it would mix in every other job's pages and refuses to run twice at once. Instead, code working
+    for the job runs inside `track(section)`, which registers its thread. A background thread samples
+    the stacks of just the registered threads every `interval` seconds. Native time (torch, OpenCV)
+    shows up under the python frame that called it.
+
+    Nothing is created for jobs that are not profiled, callers use `JobProfiler.maybe_wrap()`. tracemalloc
+    can't be limited to one job though: while it runs, every allocation in the process is traced.
+    """
+
+    def __init__(self, interval: float = 0.005, top_allocations: int = 30, max_depth: int = 80) -> None:
+        self.interval = interval
+        self.top_allocations = top_allocations
+        self.max_depth = max_depth
+
+        self._threads: dict[int, str] = {}   # thread ident -> section it is working on
+        self._stacks: Counter[tuple[str, ...]] = Counter()
+        self._section_seconds: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._wall = 0.0
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._peak = 0
+
+    @staticmethod
+    def maybe_wrap(profiler: Optional["JobProfiler"], section: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        return profiler.wrap(section, fn) if profiler is not None else fn
+
+    def start(self) -> None:
+        global _tracemalloc_users
+        with _tracemalloc_lock:
+            if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+            else:
+                tracemalloc.reset_peak()
+            _tracemalloc_users += 1
+
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name="job-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        global _tracemalloc_users
+        if self._sampler is None:
+            return
+        self._stop.set()
+        self._sampler.join()
+        self._sampler = None
+        self._wall = time.perf_counter() - self._started
+
+        with _tracemalloc_lock:
+            self._snapshot = tracemalloc.take_snapshot()
+            self._peak = tracemalloc.get_traced_memory()[1]
+            _tracemalloc_users -= 1
+            if _tracemalloc_users == 0:
+                tracemalloc.stop()
+
+    @contextmanager
+    def track(self, section: str) -> Iterator[None]:
+        """ Profile the current thread while the block runs, under `section` """
+        ident = threading.get_ident()
+        started = time.perf_counter()
+        with self._lock:
+            outer = self._threads.get(ident)
+            self._threads[ident] = section if outer is None else f"{outer};{section}"
+        try:
+            yield
+        finally:
+            with self._lock:
+                if outer is None:
+                    self._threads.pop(ident, None)
+                else:
+                    self._threads[ident] = outer
+                self._section_seconds[section] += time.perf_counter() - started
+
+    def wrap(self, section: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        def tracked(*args: Any, **kwargs: Any) -> Any:
+            with self.track(section):
+                return fn(*args, **kwargs)
+        return tracked
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads.items())
+            for ident, section in threads:
+                frame = frames.get(ident)
+                if frame is None or ident == own:
+                    continue
+                stack: list[str] = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(self._frame_name(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                self._stacks[tuple(section.split(";")) + tuple(stack)] += 1
+
+    @staticmethod
+    def _frame_name(frame: Any) -> str:
+        code = frame.f_code
+        path = code.co_filename
+        for prefix in _PATH_PREFIXES:
+            if path.startswith(prefix):
+                path = path[len(prefix):]
+                break
+        return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+    def write(self, out_dir: Path) -> list[Path]:
+        """ profile.txt (report), profile.collapsed (flame graph input) and memory.txt, returns their paths """
+        out_dir.mkdir(parents=True, exist_ok=True)
+        report, collapsed, memory = (out_dir / name for name in PROFILE_FILES)
+
+        # Brendan Gregg's folded format, loads in speedscope / flamegraph.pl
+        collapsed.write_text(
+            "".join(f"{';'.join(stack)} {count}\n" for stack, count in self._stacks.most_common()),
+            encoding="utf-8",
+        )
+        report.write_text(self._cpu_report(), encoding="utf-8")
+        memory.write_text(self._memory_report(), encoding="utf-8")
+        return [report, collapsed, memory]
+
+    def _cpu_report(self, top: int = 40) -> str:
+        total = sum(self._stacks.values())
+        own: Counter[str] = Counter()
+        inclusive: Counter[str] = Counter()
+        for stack, count in self._stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                inclusive[name] += count
+
+        lines = [
+            f"Job wall time {self._wall:.2f}s, {total} samples every {self.interval * 1000:.0f}ms of the job's threads",
+            "",
+            "Wall seconds per section (summed over threads):",
+        ]
+        lines += [f"  {seconds:10.2f}  {section}" for section, seconds in self._section_seconds.most_common()]
+
+        for title, counter in (("Own time (sampled at the top of the stack)", own), ("Inclusive time", inclusive)):
+            lines += ["", f"{title}:", f"  {'samples':>8} {'share':>6}  function"]
+            lines += [
+                f"  {count:>8} {count / max(total, 1):>6.1%}  {name}"
+                for name, count in counter.most_common(top)
+            ]
+        return "\n".join(lines) + "\n"
+
+    def _memory_report(self) -> str:
+        lines = [
+            f"Peak traced memory {self._peak / 2**20:.1f} MiB while the job ran "
+            "(process wide, other jobs running at the same time are included)",
+            "",
+            f"Top {self.top_allocations} allocation sites still alive at the end of the job:",
+        ]
+        if self._snapshot is not None:
+            snapshot = self._snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ])
+            for stat in snapshot.statistics("lineno")[: self.top_allocations]:
+                frame = stat.traceback[0]
+                lines.append(f"  {stat.size / 2**20:9.2f} MiB {stat.count:>8} blocks  {frame.filename}:{frame.lineno}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,162 @@
+""" Layout analysis for the OCR blocks, recursive XY-cut over the block bounding boxes """
+
+
+from typing import Any
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class XYCutConfig:
+    # Gap sizes are in multiples of the median block height on the page, so the same
+    # settings work for 150 dpi scans and 300 dpi scans alike.
+    min_col_gap_ratio: float = 1.5   # whitespace gutter needed to call it a column split
+    min_column_lines: int = 3        # every column of a split needs at least this many text lines
+    min_col_width_ratio: float = 2.0 # and has to be this many times wider than the gutter
+    min_row_gap_ratio: float = 1.2   # vertical whitespace needed to call it a region split
+    cut_tolerance: float = 0.75      # also cut on gaps at least this fraction of the widest one
+    max_depth: int = 16
+    min_region_blocks: int = 2
+
+    line_tol_ratio: float = 0.6      # same line bucketing as the grid order
+    min_line_tol: float = 8.0
+
+
+class XYCutLayout:
+    """
+    Recursive XY-cut reading order.
+
+    Each region is split along the axis with the widest whitespace gap in its projection profile
+    (columns left to right, rows top to bottom), until no gap is wide enough. Blocks inside a leaf
+    region are read line by line like the old grid order, so single column pages come out the same.
+
+    Projection profiles are computed on the box intervals instead of a pixel raster, sort + running
+    max of the interval ends, so every level is O(n log n) no matter the page resolution.
+    """
+
+    def __init__(self, cfg: XYCutConfig = XYCutConfig()) -> None:
+        self.cfg = cfg
+
+    def order(self, blocks: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """ Return the blocks in reading order, each tagged with the `region` it was read from """
+        if not blocks:
+            return blocks
+
+        rects = np.array(
+            [[b["x_min"], b["y_min"], b["x_max"], b["y_max"]] for b in blocks],
+            dtype=np.float64,
+        )
+        heights = rects[:, 3] - rects[:, 1]
+        median_h = float(np.median(heights))
+        if median_h <= 0:
+            median_h = 10.0
+
+        regions: list[np.ndarray] = []
+        self._cut(rects, np.arange(len(blocks)), median_h, 0, regions)
+
+        ordered: list[dict[str, Any]] = []
+        for region_idx, members in enumerate(regions):
+            for i in self._line_order(rects[members], median_h):
+                blk = blocks[members[i]]
+                blk["region"] = region_idx
+                ordered.append(blk)
+
+        return ordered
+
+    def _cut(
+        self,
+        rects: np.ndarray,
+        idx: np.ndarray,
+        median_h: float,
+        depth: int,
+        out: list[np.ndarray],
+    ) -> None:
+        if depth >= self.cfg.max_depth or idx.size < self.cfg.min_region_blocks:
+            out.append(idx)
+            return
+
+        sub = rects[idx]
+        col_min = self.cfg.min_col_gap_ratio * median_h
+        row_min = self.cfg.min_row_gap_ratio * median_h
+
+        col_cuts, col_widths = self._gaps(sub[:, 0], sub[:, 2], col_min)
+        row_cuts, row_widths = self._gaps(sub[:, 1], sub[:, 3], row_min)
+
+        if col_cuts.size == 0 and row_cuts.size == 0:
+            out.append(idx)
+            return
+
+        # Compare the axes relative to their own thresholds, a column gutter wins ties
+        # since interleaving two columns is the worse failure.
+        col_score = col_widths.max() / col_min if col_cuts.size else 0.0
+        row_score = row_widths.max() / row_min if row_cuts.size else 0.0
+
+        candidates = [
+            (col_score, True, col_cuts, col_widths),
+            (row_score, False, row_cuts, row_widths),
+        ]
+        candidates.sort(key=lambda c: (c[0], c[1]), reverse=True)
+
+        for score, is_col, cuts, widths in candidates:
+            if score == 0.0:
+                continue
+
+            keep = widths >= self.cfg.cut_tolerance * widths.max()
+            cuts, widths = cuts[keep], widths[keep]
+            starts = sub[:, 0] if is_col else sub[:, 1]
+            parts = self._split(idx, starts, cuts)
+
+            # Aligned rows of a table or form also have a vertical gutter, only read column by
+            # column when every side looks like a column of text: several lines, wider than the gap.
+            if is_col and not self._is_column_split(rects, parts, widths.max(), median_h):
+                continue
+
+            for part in parts:
+                self._cut(rects, part, median_h, depth + 1, out)
+            return
+
+        out.append(idx)
+
+    @staticmethod
+    def _split(idx: np.ndarray, starts: np.ndarray, cuts: np.ndarray) -> list[np.ndarray]:
+        segment = np.searchsorted(cuts, starts, side="right")
+        seg_order = np.argsort(segment, kind="stable")
+        bounds = np.searchsorted(segment[seg_order], np.arange(1, cuts.size + 1))
+        return [part for part in np.split(idx[seg_order], bounds) if part.size]
+
+    def _is_column_split(self, rects: np.ndarray, parts: list[np.ndarray], gap: float, median_h: float) -> bool:
+        y_tol = max(self.cfg.min_line_tol, self.cfg.line_tol_ratio * median_h)
+        for part in parts:
+            sub = rects[part]
+            lines = np.unique(np.floor((sub[:, 1] + sub[:, 3]) / 2.0 / y_tol)).size
+            width = sub[:, 2].max() - sub[:, 0].min()
+            if lines < self.cfg.min_column_lines or width < self.cfg.min_col_width_ratio * gap:
+                return False
+        return True
+
+    @staticmethod
+    def _gaps(starts: np.ndarray, ends: np.ndarray, min_gap: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Whitespace gaps in the projection of [start, end] intervals onto one axis.
+        Returns the cut positions (middle of each gap) and the gap widths, both ascending by position.
+        """
+        if starts.size < 2:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty
+
+        order = np.argsort(starts, kind="stable")
+        s = starts[order]
+        e = np.maximum.accumulate(ends[order])
+
+        widths = s[1:] - e[:-1]
+        hit = np.nonzero(widths >= min_gap)[0]
+        return (e[hit] + s[hit + 1]) / 2.0, widths[hit]
+
+    def _line_order(self, rects: np.ndarray, median_h: float) -> np.ndarray:
+        """ Line-ish order inside one region, bucket by y with a tolerance then sort by x """
+        y_tol = max(self.cfg.min_line_tol, self.cfg.line_tol_ratio * median_h)
+        cy = (rects[:, 1] + rects[:, 3]) / 2.0
+        cx = (rects[:, 0] + rects[:, 2]) / 2.0
+        line_bucket = np.floor(cy / y_tol)
+        return np.lexsort((cx, line_bucket))
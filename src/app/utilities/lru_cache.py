@@ -0,0 +1,86 @@
+""" Small thread safe LRU cache shared by the tools """
+
+
+import threading
+
+from collections import OrderedDict
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar
+
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class LRUCache(Generic[V]):
+    """
+    Least recently used cache with hit/miss counters.
+
+    functools.lru_cache is per function and has no eviction hook, so this is kept around for the
+    caches that need a configurable size per instance or need to release something on eviction.
+    """
+
+    def __init__(self, max_size: int, on_evict: Optional[Callable[[Hashable, V], None]] = None) -> None:
+        if max_size < 1:
+            raise ValueError(f"LRU max_size must be >= 1, got {max_size}")
+
+        self.max_size = max_size
+        self._on_evict = on_evict
+        self._data: OrderedDict[Hashable, V] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        """ Return the cached value (and mark it recently used), or `default` on a miss """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def put(self, key: Hashable, value: V) -> None:
+        evicted: list[tuple[Hashable, V]] = []
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+
+        # Callbacks run outside the lock, they may be slow (freeing models and so on)
+        if self._on_evict is not None:
+            for k, v in evicted:
+                self._on_evict(k, v)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def keys(self) -> list[Hashable]:
+        """ Keys from least to most recently used """
+        with self._lock:
+            return list(self._data.keys())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxSize": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,475 @@
+"""
+Render math-tagged OCR text as Office Math (OMML)
+
+OCR text -> normalized linear math (the cache key) -> sympy expression -> m:oMath element.
+When sympy can't parse the text, the linear form is still laid out token by token with
+^ and _ turned into super/subscripts, so a math block never comes out worse than plain text.
+"""
+
+
+import re
+import copy
+import unicodedata
+
+from tokenize import NAME, NUMBER, OP
+
+from typing import Any, Optional
+from dataclasses import dataclass
+
+import sympy
+
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from sympy.parsing.sympy_parser import (
+    parse_expr,
+    standard_transformations,
+    split_symbols_custom,
+    implicit_multiplication,
+    implicit_application,
+    function_exponentiation,
+    convert_xor,
+)
+
+from src.app.utilities.lru_cache import LRUCache
+
+
+@dataclass(frozen=True)
+class MathRenderConfig:
+    cache_size: int = 4096
+    use_sympy: bool = True
+    max_expr_chars: int = 160  # longer than this is a paragraph that happens to have symbols in it
+
+
+# OCR'd unicode -> linear math sympy can read.
+# Greek letters get spaces around their names so 2πf reads as 2 pi f, not the name "pif".
+_UNICODE_TO_LINEAR: dict[str, str] = {
+    "×": "*", "·": "*", "∙": "*", "÷": "/", "−": "-", "–": "-", "—": "-",
+    "√": "sqrt", "∞": "oo", "²": "^2", "³": "^3", "¹": "^1",
+    "π": " pi ", "θ": " theta ", "λ": " lamda ", "μ": " mu ", "Ω": " Omega ",
+    "α": " alpha ", "β": " beta ", "γ": " gamma ", "Δ": " Delta ", "δ": " delta ",
+    "σ": " sigma ", "φ": " phi ", "ω": " omega ", "ε": " epsilon ", "ρ": " rho ", "τ": " tau ",
+    "{": "(", "}": ")", "[": "(", "]": ")",
+}
+
+_GREEK: dict[str, str] = {
+    "alpha": "α", "beta": "β", "gamma": "γ", "delta": "δ", "epsilon": "ε", "theta": "θ",
+    "lamda": "λ", "lambda": "λ", "mu": "μ", "pi": "π", "rho": "ρ", "sigma": "σ", "tau": "τ",
+    "phi": "φ", "omega": "ω", "Delta": "Δ", "Omega": "Ω", "Sigma": "Σ",
+}
+
+_RELATIONS: dict[str, str] = {
+    "<=": "≤", ">=": "≥", "!=": "≠", "==": "=", "=": "=", "<": "<", ">": ">",
+    "≤": "≤", "≥": "≥", "≠": "≠", "≈": "≈", "→": "→", "←": "←", "↔": "↔",
+}
+_RELATION_RE = re.compile(r"(<=|>=|!=|==|≤|≥|≠|≈|→|←|↔|=|<|>)")
+
+# Names that are allowed to be more than 3 letters long in an expression, anything else is prose
+_MATH_NAMES = frozenset(
+    {"sqrt", "sin", "cos", "tan", "sec", "csc", "cot", "sinh", "cosh", "tanh", "asin", "acos", "atan",
+     "log", "ln", "exp", "lim", "max", "min", "det", "mod"}
+    | set(_GREEK)
+)
+# Differentials stay one symbol, otherwise dy/dx turns into d*y/(d*x)
+_ATOMIC = frozenset({"dx", "dy", "dz", "dt", "du", "dv", "dr"})
+
+_WORD_RE = re.compile(r"[A-Za-z]{4,}")
+_ALLOWED_RE = re.compile(r"^[A-Za-z0-9\s+\-*/^_().,=<>!|'±≤≥≠≈→←↔]*$")
+_TOKEN_RE = re.compile(r"\d+(?:\.\d+)?|[A-Za-z]+|\S")
+
+_NEG_EXP = "NEGEXP"  # marks a written negative exponent, x^-1 is not 1/x
+_POW_OPS = ((OP, "**"), (OP, "^"))
+
+
+def _keep_source_text(tokens: list, local_dict: dict, global_dict: dict) -> list:
+    """
+    Parser transform, runs before sympy's own ones.
+    Decimals keep the text the user wrote (1e5 stays 1e5, not 100000.0): they become a placeholder
+    name bound to Symbol("1e5") in local_dict. A minus right after ^ or ** is wrapped in NEGEXP(...)
+    so written negative powers don't come out of evaluate=False looking exactly like a division.
+    """
+    def decimal(val: str) -> tuple[int, str]:
+        name = f"DEC{len(local_dict)}"
+        local_dict[name] = sympy.Symbol(val)
+        return NAME, name
+
+    def plain(tok: Any) -> tuple[int, str]:
+        if tok[0] == NUMBER and any(c in tok[1] for c in ".eE"):
+            return decimal(tok[1])
+        return tok[0], tok[1]
+
+    out: list = []
+    i = 0
+    while i < len(tokens):
+        num, val = tokens[i][0], tokens[i][1]
+
+        # convert_xor hasn't run yet, so the power can still be spelled ^
+        after_pow = (
+            (len(out) >= 1 and out[-1] in _POW_OPS)
+            or (len(out) >= 2 and out[-2] in _POW_OPS and out[-1] == (OP, "("))
+        )
+        if num == OP and val == "-" and after_pow and i + 1 < len(tokens):
+            out.extend([(NAME, _NEG_EXP), (OP, "("), plain(tokens[i + 1]), (OP, ")")])
+            i += 2
+            continue
+
+        out.append(plain(tokens[i]))
+        i += 1
+    return out
+
+
+def _splittable(name: str) -> bool:
+    """ Multi letter names split into one letter symbols (xy is x*y), except subscripted and greek letter names """
+    if "_" in name or len(name) < 2 or name in _ATOMIC or name in _MATH_NAMES:
+        return False
+    try:
+        unicodedata.lookup(f"GREEK SMALL LETTER {name}")
+    except KeyError:
+        return True
+    return False
+
+
+_TRANSFORMS = (_keep_source_text,) + standard_transformations + (
+    split_symbols_custom(_splittable),
+    implicit_multiplication,
+    implicit_application,
+    function_exponentiation,
+    convert_xor,
+)
+
+# Single letters sympy would otherwise read as constants or functions (E = mc^2 is not Euler's number),
+# and function names sympy would rename (ln -> log).
+_LOCALS: dict[str, Any] = {name: sympy.Symbol(name) for name in ("E", "I", "N", "O", "Q", "S")}
+_LOCALS["ln"] = sympy.Function("ln")
+_LOCALS[_NEG_EXP] = sympy.Function(_NEG_EXP)
+# n! and n!! stay as written: sympy's own factorials compute 99999999! even with evaluate=False
+_FACTORIAL = _LOCALS["factorial"] = sympy.Function("factorial")
+_FACTORIAL2 = _LOCALS["factorial2"] = sympy.Function("factorial2")
+
+_ONE_LETTER_RE = re.compile(r"(?<![A-Za-z])([A-Za-z])(?![A-Za-z])(\s*\()?")
+
+
+def _local_dict(linear: str) -> dict[str, Any]:
+    """ One letter names that are only ever followed by ( are functions: f(x) is f of x, not f*x """
+    names: dict[str, bool] = {}
+    for m in _ONE_LETTER_RE.finditer(linear):
+        names[m.group(1)] = names.get(m.group(1), True) and m.group(2) is not None
+
+    local = dict(_LOCALS)
+    for name, is_call in names.items():
+        if is_call:
+            local[name] = sympy.Function(name)
+    return local
+
+
+_NO_OMML = object()  # negative cache entry, prose gets looked up as often as math does
+
+
+class MathRenderer:
+    """
+    Convert math-tagged spans into OMML elements for python-docx.
+
+    Results are cached by normalized text: worked solutions repeat the same handful of
+    expressions on every page, so parsing is mostly paid once per document.
+    """
+
+    def __init__(self, cfg: MathRenderConfig = MathRenderConfig()) -> None:
+        self.cfg = cfg
+        self.cache: LRUCache[Any] = LRUCache(cfg.cache_size)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """ OCR text -> linear math, used as the cache key """
+        out = "".join(_UNICODE_TO_LINEAR.get(c, c) for c in text.replace("->", "→"))
+        out = re.sub(r"sqrt\s*(?=[A-Za-z0-9])", "sqrt ", out)
+        return " ".join(out.split())
+
+    def to_omml(self, text: str) -> Optional[Any]:
+        """
+        Return a fresh m:oMath element for `text`, or None when it doesn't read as an expression.
+        Callers own the returned element, the cached copy is never handed out.
+        """
+        key = self.normalize(text)
+        if not key:
+            return None
+
+        cached = self.cache.get(key, None)
+        if cached is None:
+            cached = self._convert(key)
+            self.cache.put(key, cached)
+
+        if cached is _NO_OMML:
+            return None
+        return copy.deepcopy(cached)
+
+    def _convert(self, linear: str) -> Any:
+        if len(linear) > self.cfg.max_expr_chars or not _ALLOWED_RE.match(linear):
+            return _NO_OMML
+        if "__" in linear or any(w not in _MATH_NAMES for w in _WORD_RE.findall(linear)):
+            return _NO_OMML
+
+        o_math = OxmlElement("m:oMath")
+        for i, part in enumerate(_RELATION_RE.split(linear)):
+            part = part.strip()
+            if i % 2 == 1:
+                o_math.append(_run(_RELATIONS[part]))
+            elif part:
+                for el in self._side_to_omml(part):
+                    o_math.append(el)
+
+        return o_math if len(o_math) else _NO_OMML
+
+    def _side_to_omml(self, linear: str) -> list[Any]:
+        if self.cfg.use_sympy:
+            try:
+                expr = parse_expr(linear, local_dict=_local_dict(linear), transformations=_TRANSFORMS, evaluate=False)
+                if isinstance(expr, sympy.Expr):
+                    return _expr(expr)
+            except Exception:
+                # Any parse failure (bad tokens, half an expression, recursion) just falls back to linear
+                pass
+
+        return _linear(linear)
+
+
+# OMML element builders
+
+def _el(tag: str, *children: Any) -> Any:
+    el = OxmlElement(tag)
+    for child in children:
+        el.append(child)
+    return el
+
+
+def _wrap(tag: str, items: list[Any]) -> Any:
+    return _el(tag, *items)
+
+
+def _run(text: str, plain: bool = False) -> Any:
+    r = OxmlElement("m:r")
+    if plain:
+        sty = OxmlElement("m:sty")
+        sty.set(qn("m:val"), "p")
+        r.append(_el("m:rPr", sty))
+    t = OxmlElement("m:t")
+    t.text = text
+    r.append(t)
+    return r
+
+
+def _frac(num: list[Any], den: list[Any]) -> Any:
+    return _el("m:f", _wrap("m:num", num), _wrap("m:den", den))
+
+
+def _sup(base: list[Any], sup: list[Any]) -> Any:
+    return _el("m:sSup", _wrap("m:e", base), _wrap("m:sup", sup))
+
+
+def _sub(base: list[Any], sub: list[Any]) -> Any:
+    return _el("m:sSub", _wrap("m:e", base), _wrap("m:sub", sub))
+
+
+def _paren(items: list[Any]) -> Any:
+    return _el("m:d", _wrap("m:e", items))
+
+
+def _sqrt(items: list[Any]) -> Any:
+    deg_hide = OxmlElement("m:degHide")
+    deg_hide.set(qn("m:val"), "1")
+    return _el("m:rad", _el("m:radPr", deg_hide), OxmlElement("m:deg"), _wrap("m:e", items))
+
+
+def _func(name: str, args: list[Any]) -> Any:
+    return _el("m:func", _el("m:fName", _run(name, plain=True)), _wrap("m:e", [_paren(args)]))
+
+
+# sympy -> OMML
+
+def _symbol(name: str) -> list[Any]:
+    if name[:1].isdigit():
+        return [_run(name)]
+    base, _, sub = name.partition("_")
+    base_el = [_run(_GREEK.get(base, base))]
+    if sub:
+        return [_sub(base_el, [_run(_GREEK.get(sub, sub))])]
+    return base_el
+
+
+def _is_negative(term: sympy.Basic) -> bool:
+    if term.is_Number:
+        return bool(term.is_negative)
+    if isinstance(term, sympy.Mul) and term.args:
+        # unevaluated -kx comes out as Mul(Mul(-1, k), x)
+        return _is_negative(term.args[0])
+    return False
+
+
+def _negate(term: sympy.Basic) -> sympy.Basic:
+    if term.is_Number:
+        return -term
+    first = _negate(term.args[0])
+    factors = ([] if first == 1 else [first]) + list(term.args[1:])
+    return factors[0] if len(factors) == 1 else sympy.Mul(*factors, evaluate=False)
+
+
+def _grouped(expr: sympy.Basic) -> list[Any]:
+    """ Parenthesize anything that binds looser than a product """
+    if isinstance(expr, sympy.Add) or (isinstance(expr, sympy.Mul) and _is_negative(expr)):
+        return [_paren(_expr(expr))]
+    return _expr(expr)
+
+
+def _grouped_power_base(base: sympy.Basic) -> list[Any]:
+    """ Bases of x^n and n! need parens unless they are a single letter or number """
+    if isinstance(base, (sympy.Add, sympy.Mul, sympy.Pow, _FACTORIAL, _FACTORIAL2)) or _is_negative(base):
+        return [_paren(_expr(base))]
+    return _expr(base)
+
+
+def _expr(expr: sympy.Basic) -> list[Any]:
+    if isinstance(expr, sympy.Symbol):
+        return _symbol(expr.name)
+
+    if expr is sympy.pi:
+        return [_run("π")]
+    if expr is sympy.oo:
+        return [_run("∞")]
+    if expr is sympy.E:
+        return [_run("e")]
+    if expr is sympy.I:
+        return [_run("i")]
+
+    if isinstance(expr, sympy.Rational) and not isinstance(expr, sympy.Integer):
+        if expr.q != 1:
+            sign = [_run("−")] if expr.p < 0 else []
+            return sign + [_frac([_run(str(abs(expr.p)))], [_run(str(expr.q))])]
+
+    if expr.is_Number:
+        text = sympy.sstr(expr, full_prec=False)
+        return [_run("−" + text[1:] if text.startswith("-") else text)]
+
+    if isinstance(expr, sympy.Add):
+        out: list[Any] = []
+        for i, term in enumerate(expr.args):
+            if _is_negative(term):
+                out.append(_run("−"))
+                out.extend(_grouped(_negate(term)))
+            else:
+                if i:
+                    out.append(_run("+"))
+                out.extend(_expr(term))
+        return out
+
+    if isinstance(expr, sympy.Mul):
+        if _is_negative(expr):
+            return [_run("−")] + _expr(_negate(expr))
+
+        num: list[sympy.Basic] = []
+        den: list[sympy.Basic] = []
+        for factor in expr.args:
+            # a/b parses to a * b^-1, written negative powers are NEGEXP exponents (see _keep_source_text)
+            if isinstance(factor, sympy.Pow) and factor.exp == -1:
+                den.append(factor.base)
+            else:
+                num.append(factor)
+
+        if den:
+            num = [f for f in num if f != 1] or [sympy.Integer(1)]
+            return [_frac(_product(num), _product(den))]
+        return _product(num)
+
+    if isinstance(expr, sympy.Pow):
+        base, exp = expr.args
+        if exp == sympy.Rational(1, 2):
+            return [_sqrt(_expr(base))]
+        if exp == -1:
+            return [_frac([_run("1")], _expr(base))]
+
+        return [_sup(_grouped_power_base(base), _expr(exp))]
+
+    if isinstance(expr, _FACTORIAL):
+        return _grouped_power_base(expr.args[0]) + [_run("!")]
+    if isinstance(expr, _FACTORIAL2):
+        return _grouped_power_base(expr.args[0]) + [_run("!!")]
+
+    if isinstance(expr, sympy.Function):
+        name = type(expr).__name__
+        if name == _NEG_EXP:
+            return [_run("−")] + _expr(expr.args[0])
+
+        args: list[Any] = []
+        for i, arg in enumerate(expr.args):
+            if i:
+                args.append(_run(","))
+            args.extend(_expr(arg))
+
+        # f(x), g(t): user function names stay italic like any other letter
+        if len(name) == 1:
+            return [_run(name), _paren(args)]
+        return [_func(name, args)]
+
+    # Anything else (Integral, Derivative, ...) just keeps sympy's linear form
+    return [_run(sympy.sstr(expr))]
+
+
+def _product(factors: list[sympy.Basic]) -> list[Any]:
+    out: list[Any] = []
+    for i, factor in enumerate(factors):
+        # Only put a dot between two numbers, 2x and xy read fine side by side
+        if i and _leads_with_number(factor) and _is_numeral(factors[i - 1]):
+            out.append(_run("·"))
+        out.extend(_grouped(factor))
+    return out
+
+
+def _is_numeral(expr: sympy.Basic) -> bool:
+    """ Numbers, including decimals kept as their source text """
+    return bool(expr.is_Number or (isinstance(expr, sympy.Symbol) and expr.name[:1].isdigit()))
+
+
+def _leads_with_number(expr: sympy.Basic) -> bool:
+    return _is_numeral(expr) or (isinstance(expr, sympy.Pow) and _is_numeral(expr.base))
+
+
+# Fallback: lay out the linear tokens directly
+
+def _linear(linear: str) -> list[Any]:
+    tokens = _TOKEN_RE.findall(linear)
+    out: list[Any] = []
+    i = 0
+
+    def operand(j: int) -> tuple[list[Any], int]:
+        """ One token, or a whole (...) group with the parens dropped """
+        if j >= len(tokens):
+            return [], j
+        if tokens[j] != "(":
+            return [_linear_token(tokens[j])], j + 1
+
+        depth, k = 0, j
+        while k < len(tokens):
+            depth += tokens[k] == "("
+            depth -= tokens[k] == ")"
+            if depth == 0:
+                break
+            k += 1
+        return _linear(" ".join(tokens[j + 1:k])), k + 1
+
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok in ("^", "_") and out:
+            script, i = operand(i + 1)
+            base = [out.pop()]
+            out.append(_sup(base, script) if tok == "^" else _sub(base, script))
+            continue
+
+        out.append(_linear_token(tok))
+        i += 1
+
+    return out
+
+
+def _linear_token(tok: str) -> Any:
+    if tok in _MATH_NAMES and tok not in _GREEK:
+        return _run(tok, plain=True)
+    if tok == "-":
+        return _run("−")
+    return _run(_GREEK.get(tok, tok))
@@ -0,0 +1,91 @@
+""" Durable copies of a job's intermediate artifacts, so a job outlives the instance that started it """
+
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import gridfs
+
+from bson.binary import Binary
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from src.app.utilities.mongodb_utils.job_store_util import utcnow
+from src.app.utilities.mongodb_utils.mongo_client import MongoDBCollections
+from src.app.utilities.ocr_codec import decode_pages, encode_pages
+
+
+@dataclass
+class MongoArtifactStore:
+    """
+    `/tmp/jobs` goes away with a Cloud Run instance. Everything needed to pick a job up on another
+    instance lives here instead: the input PDF and result DOCX in GridFS, one document per finished
+    page in `job_pages`. A page is stored as an ocr_codec blob, several times smaller and faster to
+    read back than the same page as nested BSON.
+    """
+    db: Database
+    default_ttl_hours: int = 24
+
+    def __post_init__(self) -> None:
+        self.pages: Collection = self.db[MongoDBCollections.JOB_PAGES.value]
+        self.fs = gridfs.GridFS(self.db, collection=MongoDBCollections.JOB_FILES.value)
+
+    def ensure_indexes(self) -> None:
+        self.pages.create_index([("jobId", ASCENDING), ("pageIndex", ASCENDING)], unique=True)
+        self.pages.create_index("expiresAt", expireAfterSeconds=0)
+
+    def save_file(self, job_id: str, kind: str, path: Path) -> None:
+        """ Store a job file, replacing an earlier one of the same kind ("input.pdf", "result.docx") """
+        old = [f._id for f in self.fs.find({"jobId": job_id, "kind": kind})]
+        with path.open("rb") as f:
+            self.fs.put(f, filename=f"{job_id}/{kind}", jobId=job_id, kind=kind)
+        for file_id in old:
+            self.fs.delete(file_id)
+
+    def restore_file(self, job_id: str, kind: str, dest: Path) -> Optional[Path]:
+        """ Write the stored file to `dest`, None when there is no such file """
+        stored = self.fs.find_one({"jobId": job_id, "kind": kind}, sort=[("uploadDate", -1)])
+        if stored is None:
+            return None
+
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_suffix(dest.suffix + ".part")
+        with tmp.open("wb") as f:
+            for chunk in stored:
+                f.write(chunk)
+        tmp.replace(dest)
+        return dest
+
+    def save_page(self, job_id: str, page: Dict[str, Any]) -> None:
+        self.pages.replace_one(
+            {"_id": f"{job_id}:{page['page_index']}"},
+            {
+                "jobId": job_id,
+                "pageIndex": page["page_index"],
+                "blob": Binary(encode_pages([page])),
+                "expiresAt": utcnow() + timedelta(hours=self.default_ttl_hours),
+            },
+            upsert=True,
+        )
+
+    def load_pages(self, job_id: str) -> List[Dict[str, Any]]:
+        pages: List[Dict[str, Any]] = []
+        for doc in self.pages.find({"jobId": job_id}).sort("pageIndex", ASCENDING):
+            # Checkpoints written before the codec hold the page as a plain document
+            pages.extend(decode_pages(doc["blob"]) if "blob" in doc else [doc["page"]])
+        return pages
+
+    def delete_job(self, job_id: str) -> None:
+        self.pages.delete_many({"jobId": job_id})
+        for stored in self.fs.find({"jobId": job_id}):
+            self.fs.delete(stored._id)
+
+    def purge_files(self, older_than: datetime) -> int:
+        """ GridFS has no TTL index that also removes chunks, expired job files are deleted here """
+        expired = [f._id for f in self.fs.find({"uploadDate": {"$lt": older_than}})]
+        for file_id in expired:
+            self.fs.delete(file_id)
+        return len(expired)
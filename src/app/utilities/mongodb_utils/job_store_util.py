@@ -1,15 +1,23 @@
 """ Wrapper for storing jobs to mongodb"""
 
 
+import threading
+
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Optional
 
+from pymongo import ReturnDocument
 from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
 
 from src.app.main_workflow.job_status_enums import JobStatus, JobStep
 
 
+# A job in one of these states belongs to whichever instance holds its lease
+ACTIVE_STATUSES = (JobStatus.UPLOADED.value, JobStatus.PROCESSING.value)
+
+
 def utcnow() -> datetime:
     return datetime.now(timezone.utc)
 
@@ -18,10 +26,12 @@ def utcnow() -> datetime:
 class MongoJobStore:
     jobs: Collection
     default_ttl_hours: int = 24
+    on_update: Optional[Callable[[Dict[str, Any]], None]] = None  # called with the job doc after every update
 
     def ensure_indexes(self) -> None:
         self.jobs.create_index("expiresAt", expireAfterSeconds=0)
         self.jobs.create_index("createdAt")
+        self.jobs.create_index([("status", 1), ("leaseExpiresAt", 1)])
 
     def create_job(self, job_id: str, settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         now = utcnow()
@@ -37,6 +47,10 @@ class MongoJobStore:
             "settings": settings or {},
             "input": {},
             "output": {},
+            "checkpoint": {"stages": [], "pagesDone": []},
+            "leaseOwner": None,
+            "leaseExpiresAt": None,
+            "queued": False,
         }
         self.jobs.insert_one(doc)
         return doc
@@ -54,6 +68,7 @@ class MongoJobStore:
         error: Optional[Dict[str, Any]] = None,
         input_update: Optional[Dict[str, Any]] = None,
         output_update: Optional[Dict[str, Any]] = None,
+        settings_update: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
         update: Dict[str, Any] = {"$set": {"updatedAt": utcnow()}}
         set_fields: Dict[str, Any] = {}
@@ -80,9 +95,124 @@ class MongoJobStore:
             for k, v in output_update.items():
                 update["$set"][f"output.{k}"] = v
 
+        if settings_update:
+            update.setdefault("$set", {})
+            for k, v in settings_update.items():
+                update["$set"][f"settings.{k}"] = v
+
         self.jobs.update_one({"_id": job_id}, update)
         doc = self.get_job(job_id)
         if doc is None:
             raise KeyError(f"Job not found: {job_id}")
 
+        if self.on_update is not None:
+            self.on_update(doc)
+
         return doc
+
+    def claim_job(self, job_id: str, owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """ Take (or renew) the lease on one job, None when another owner holds an unexpired lease """
+        now = utcnow()
+        return self.jobs.find_one_and_update(
+            {
+                "_id": job_id,
+                "$or": [
+                    {"leaseOwner": owner},
+                    {"leaseExpiresAt": None},
+                    {"leaseExpiresAt": {"$lte": now}},
+                ],
+            },
+            {"$set": {"leaseOwner": owner, "leaseExpiresAt": now + timedelta(seconds=lease_seconds)}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def claim_stalled_job(self, owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        Atomically take over the oldest active job whose lease ran out, its owner stopped heartbeating
+        (instance recycled or crashed mid job). None when there is nothing to take over.
+        Jobs with an item in the work queue are left to the queue, which owns their start delay,
+        retry backoff and attempt count.
+        """
+        now = utcnow()
+        return self.jobs.find_one_and_update(
+            {
+                "status": {"$in": list(ACTIVE_STATUSES)},
+                "leaseExpiresAt": {"$ne": None, "$lte": now},
+                "queued": {"$ne": True},
+            },
+            {"$set": {"leaseOwner": owner, "leaseExpiresAt": now + timedelta(seconds=lease_seconds)}},
+            sort=[("leaseExpiresAt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """ Extend the lease, False when the lease was lost to another instance """
+        result = self.jobs.update_one(
+            {"_id": job_id, "leaseOwner": owner},
+            {"$set": {"leaseExpiresAt": utcnow() + timedelta(seconds=lease_seconds)}},
+        )
+        return result.matched_count == 1
+
+    def release_lease(self, job_id: str, owner: str) -> None:
+        """ Give the job up. The lease is expired rather than cleared, so a job left unfinished is claimable right away """
+        self.jobs.update_one(
+            {"_id": job_id, "leaseOwner": owner},
+            {"$set": {"leaseOwner": None, "leaseExpiresAt": utcnow()}},
+        )
+
+    def set_queued(self, job_id: str, queued: bool) -> None:
+        """ Whether the job has an item in the work queue, only the queue delivers it while it does """
+        self.jobs.update_one({"_id": job_id}, {"$set": {"queued": queued}})
+
+    def checkpoint_stage(self, job_id: str, stage: str) -> None:
+        self.jobs.update_one({"_id": job_id}, {"$addToSet": {"checkpoint.stages": stage}})
+
+    def checkpoint_page(self, job_id: str, page_index: int) -> None:
+        self.jobs.update_one({"_id": job_id}, {"$addToSet": {"checkpoint.pagesDone": page_index}})
+
+    def reset_checkpoint(self, job_id: str) -> None:
+        self.jobs.update_one({"_id": job_id}, {"$set": {"checkpoint": {"stages": [], "pagesDone": []}}})
+
+    def watch_job(
+        self,
+        job_id: str,
+        on_change: Callable[[Optional[Dict[str, Any]]], None],
+        stop: threading.Event,
+        poll_interval: float = 2.0,
+    ) -> None:
+        """
+        Block until `stop` is set, calling `on_change` with the job doc whenever another instance updates it.
+        When the doc is deleted (TTL expiry) `on_change(None)` is called once and the watch ends.
+
+        Uses a change stream when the deployment supports one (Atlas does), otherwise polls the
+        document every `poll_interval` seconds and only reports when updatedAt moves.
+        """
+        try:
+            with self.jobs.watch(
+                [{"$match": {"documentKey._id": job_id}}],
+                full_document="updateLookup",
+                max_await_time_ms=int(poll_interval * 1000),
+            ) as stream:
+                while not stop.is_set() and stream.alive:
+                    change = stream.try_next()
+                    if not change:
+                        continue
+                    if change.get("operationType") == "delete" or change.get("fullDocument") is None:
+                        on_change(None)
+                        return
+                    on_change(change["fullDocument"])
+            return
+        except (PyMongoError, NotImplementedError, TypeError):
+            # Standalone mongod has no change streams, in-memory stand-ins have no watch() at all
+            pass
+
+        doc = self.get_job(job_id)
+        last_seen = doc.get("updatedAt") if doc is not None else None
+        while not stop.wait(poll_interval):
+            doc = self.get_job(job_id)
+            if doc is None:
+                on_change(None)
+                return
+            if doc.get("updatedAt") != last_seen:
+                last_seen = doc.get("updatedAt")
+                on_change(doc)
@@ -14,10 +14,15 @@ from enum import StrEnum
 
 from pymongo import MongoClient
 from pymongo.collection import Collection
+from pymongo.database import Database
 
 
 class MongoDBCollections(StrEnum):
     JOBS = "jobs"
+    JOB_PAGES = "job_pages"   # finished page records, so another instance can resume the job
+    JOB_FILES = "job_files"   # GridFS bucket for the input PDF and the result DOCX
+    WORK_QUEUE = "work_queue" # jobs waiting for any instance to run them
+    RATE_LIMITS = "rate_limits" # page budget token buckets, per client and for the whole service
 
 
 @dataclass(frozen=True)
@@ -59,19 +64,41 @@ class MongoStore:
             if cls._cfg is None:
                 raise RuntimeError("MongoStore config not initialized")
 
-            cls._client = MongoClient(
-                cls._cfg.uri,
-                serverSelectionTimeoutMS=20000,
-            )
+            if cls._cfg.uri.startswith("mongomock://"):
+                cls._client = cls._in_memory_client()
+            else:
+                cls._client = MongoClient(
+                    cls._cfg.uri,
+                    serverSelectionTimeoutMS=20000,
+                )
         return cls._client
 
+    @staticmethod
+    def _in_memory_client() -> MongoClient:
+        """
+        DOC_OCR_MONGO_ATLAS_URI=mongomock:// runs against an in-memory stand-in (dev / tests only).
+        Its data lives and dies with the process, so it can't be shared between an API and its workers.
+        """
+        try:
+            import mongomock
+            from mongomock.gridfs import enable_gridfs_integration
+        except ImportError as e:
+            raise RuntimeError("mongomock:// needs the mongomock package, pip install mongomock") from e
+
+        enable_gridfs_integration()
+        return mongomock.MongoClient()
+
     @classmethod
-    def collection(cls, name: MongoDBCollections) -> Collection:
+    def database(cls) -> Database:
         if cls._cfg is None:
             cls.init()
         if cls._cfg is None:
             raise RuntimeError("MongoStore config not initialized")
-        return cls.client()[cls._cfg.db_name][name.value]
+        return cls.client()[cls._cfg.db_name]
+
+    @classmethod
+    def collection(cls, name: MongoDBCollections) -> Collection:
+        return cls.database()[name.value]
 
     @classmethod
     def close(cls) -> None:
@@ -81,4 +108,16 @@ class MongoStore:
 
 
 def get_jobs_collection() -> Collection:
-    return MongoStore.collection(MongoDBCollections.JOBS)
\ No newline at end of file
+    return MongoStore.collection(MongoDBCollections.JOBS)
+
+
+def get_job_pages_collection() -> Collection:
+    return MongoStore.collection(MongoDBCollections.JOB_PAGES)
+
+
+def get_work_queue_collection() -> Collection:
+    return MongoStore.collection(MongoDBCollections.WORK_QUEUE)
+
+
+def get_rate_limits_collection() -> Collection:
+    return MongoStore.collection(MongoDBCollections.RATE_LIMITS)
\ No newline at end of file
@@ -0,0 +1,186 @@
+""" Shared work queue in MongoDB, any instance can claim the next job to run """
+
+
+from dataclasses import dataclass
+from datetime import timedelta
+from enum import StrEnum
+from typing import Any, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+
+from src.app.utilities.mongodb_utils.job_store_util import utcnow
+
+
+class QueueItemStatus(StrEnum):
+    READY = "ready"         # waiting, claimable once visibleAt has passed
+    INFLIGHT = "inflight"   # claimed, claimable again when the claimer stops extending visibleAt
+    DEAD = "dead"           # out of attempts, kept for inspection until expiresAt
+
+
+@dataclass
+class MongoWorkQueue:
+    """
+    One document per queued job, `_id` is "<queue>:<jobId>", so queueing a job again resets its item
+    instead of adding a second one.
+
+    A claim is a single find_one_and_update that hides the item for `visibility_seconds` and counts the
+    delivery. The claimer extends the visibility while it works and deletes the item when it is done.
+    An instance that dies mid job simply stops extending, and the item is delivered again once its
+    visibility runs out. After `max_attempts` deliveries the item is dead lettered and `on_dead` is
+    called with it, so the job can be marked failed.
+    """
+    items: Collection
+    name: str = "ocr"
+    max_attempts: int = 3
+    retry_delay_seconds: float = 30.0   # first retry, doubled for every attempt after that
+    dead_ttl_hours: int = 24 * 7
+    on_dead: Optional[Callable[[Dict[str, Any]], None]] = None
+
+    def ensure_indexes(self) -> None:
+        self.items.create_index([("queue", 1), ("status", 1), ("visibleAt", 1)])
+        self.items.create_index("expiresAt", expireAfterSeconds=0)
+
+    def _id(self, job_id: str) -> str:
+        return f"{self.name}:{job_id}"
+
+    def enqueue(self, job_id: str, delay_seconds: float = 0.0) -> Dict[str, Any]:
+        """ Queue a job (again), a dead or already queued item starts over with a fresh attempt count """
+        now = utcnow()
+        return self.items.find_one_and_update(
+            {"_id": self._id(job_id)},
+            {"$set": {
+                "queue": self.name,
+                "jobId": job_id,
+                "status": QueueItemStatus.READY.value,
+                "attempts": 0,
+                "owner": None,
+                "error": None,
+                "enqueuedAt": now,
+                "visibleAt": now + timedelta(seconds=delay_seconds),
+                "expiresAt": None,
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def claim(self, owner: str, visibility_seconds: float) -> Optional[Dict[str, Any]]:
+        """ The oldest visible item, hidden from everyone else for `visibility_seconds`. None when the queue is empty """
+        while True:
+            now = utcnow()
+            item = self.items.find_one_and_update(
+                {
+                    "queue": self.name,
+                    "status": {"$in": [QueueItemStatus.READY.value, QueueItemStatus.INFLIGHT.value]},
+                    "visibleAt": {"$lte": now},
+                },
+                {
+                    "$set": {
+                        "status": QueueItemStatus.INFLIGHT.value,
+                        "owner": owner,
+                        "claimedAt": now,
+                        "visibleAt": now + timedelta(seconds=visibility_seconds),
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("visibleAt", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if item is None or item["attempts"] <= self.max_attempts:
+                return item
+
+            # Delivered too often without an ack, its claimers keep dying on it
+            self.dead_letter(item["jobId"], owner, f"Gave up after {self.max_attempts} attempts")
+
+    def extend(self, job_id: str, owner: str, visibility_seconds: float) -> bool:
+        """ Keep a claimed item hidden, False when it was redelivered to someone else meanwhile """
+        result = self.items.update_one(
+            {"_id": self._id(job_id), "owner": owner, "status": QueueItemStatus.INFLIGHT.value},
+            {"$set": {"visibleAt": utcnow() + timedelta(seconds=visibility_seconds)}},
+        )
+        return result.matched_count == 1
+
+    def ack(self, job_id: str, owner: str) -> None:
+        """ Done with the item, it leaves the queue """
+        self.items.delete_one({"_id": self._id(job_id), "owner": owner})
+
+    def release(self, job_id: str, owner: str, delay_seconds: float = 0.0) -> None:
+        """ Hand the item back without spending an attempt, for when the job could not be started at all """
+        self.items.update_one(
+            {"_id": self._id(job_id), "owner": owner, "status": QueueItemStatus.INFLIGHT.value},
+            {
+                "$set": {
+                    "status": QueueItemStatus.READY.value,
+                    "owner": None,
+                    "visibleAt": utcnow() + timedelta(seconds=delay_seconds),
+                },
+                "$inc": {"attempts": -1},
+            },
+        )
+
+    def retry(self, job_id: str, owner: str, error: str) -> bool:
+        """ The attempt failed. Back in the queue after a backoff, or dead lettered when out of attempts. False when dead """
+        item = self.items.find_one({"_id": self._id(job_id), "owner": owner})
+        if item is None:
+            return False
+        if item["attempts"] >= self.max_attempts:
+            self.dead_letter(job_id, owner, error)
+            return False
+
+        delay = self.retry_delay_seconds * 2 ** (item["attempts"] - 1)
+        self.items.update_one(
+            {"_id": self._id(job_id), "owner": owner},
+            {"$set": {
+                "status": QueueItemStatus.READY.value,
+                "owner": None,
+                "error": error,
+                "visibleAt": utcnow() + timedelta(seconds=delay),
+            }},
+        )
+        return True
+
+    def dead_letter(self, job_id: str, owner: str, error: str) -> None:
+        now = utcnow()
+        item = self.items.find_one_and_update(
+            {"_id": self._id(job_id), "owner": owner},
+            {"$set": {
+                "status": QueueItemStatus.DEAD.value,
+                "owner": None,
+                "error": error,
+                "deadAt": now,
+                "expiresAt": now + timedelta(hours=self.dead_ttl_hours),
+            }},
+            return_document=ReturnDocument.AFTER,
+        )
+        if item is not None and self.on_dead is not None:
+            self.on_dead(item)
+
+    def depth(self) -> Dict[str, Any]:
+        """ Item counts of this queue by state, and how long the oldest claimable item has waited """
+        now = utcnow()
+        base = {"queue": self.name}
+        ready = {**base, "status": QueueItemStatus.READY.value}
+        oldest = self.items.find_one({**ready, "visibleAt": {"$lte": now}}, sort=[("enqueuedAt", 1)])
+
+        enqueued_at = oldest["enqueuedAt"] if oldest is not None else None
+        if enqueued_at is not None and enqueued_at.tzinfo is None:
+            enqueued_at = enqueued_at.replace(tzinfo=now.tzinfo)  # pymongo hands back naive UTC by default
+        return {
+            "queue": self.name,
+            "ready": self.items.count_documents({**ready, "visibleAt": {"$lte": now}}),
+            "delayed": self.items.count_documents({**ready, "visibleAt": {"$gt": now}}),
+            "inflight": self.items.count_documents({**base, "status": QueueItemStatus.INFLIGHT.value}),
+            # in flight but no longer extended, their claimer is gone and they are about to be redelivered
+            "stalled": self.items.count_documents(
+                {**base, "status": QueueItemStatus.INFLIGHT.value, "visibleAt": {"$lte": now}}
+            ),
+            "dead": self.items.count_documents({**base, "status": QueueItemStatus.DEAD.value}),
+            "oldestReadySeconds": (now - enqueued_at).total_seconds() if enqueued_at is not None else 0.0,
+        }
+
+    def depths(self) -> list[Dict[str, Any]]:
+        """ depth() of every queue sharing the collection """
+        return [
+            MongoWorkQueue(self.items, name=name).depth()
+            for name in sorted(self.items.distinct("queue"))
+        ]
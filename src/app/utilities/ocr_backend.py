@@ -0,0 +1,184 @@
+""" CPU inference backends for the EasyOCR detector (CRAFT) and recognizer (CRNN) """
+
+
+import hashlib
+
+from pathlib import Path
+from typing import Any, Optional
+
+from src.app.utilities.app_logger import AppLogger
+
+
+BACKENDS = ("stock", "fp32", "torchscript", "onnx")
+
+
+class _OnnxModel:
+    """ Stands in for the torch module easyocr calls, runs the exported graph with onnxruntime instead """
+
+    def __init__(self, session: Any) -> None:
+        self.session = session
+        self.input_names = [i.name for i in session.get_inputs()]
+
+    def eval(self) -> "_OnnxModel":
+        return self
+
+    def __call__(self, *inputs: Any) -> Any:
+        import torch
+
+        # The exporter may drop the recognizer's unused text input, feed whatever the graph kept
+        feed = {name: value.cpu().numpy() for name, value in zip(self.input_names, inputs)}
+        outputs = self.session.run(None, feed)
+        tensors = tuple(torch.from_numpy(out) for out in outputs)
+        return tensors if len(tensors) > 1 else tensors[0]
+
+
+class OCRBackend:
+    """
+    easyocr.Reader only ever calls `reader.detector(x)` and `reader.recognizer(image, text)` on torch
+    tensors, so a backend swaps those two attributes for a faster model with the same call shape.
+
+        stock        the Reader as easyocr builds it. On CPU that already applies torch dynamic int8
+                     quantization to the Linear and LSTM layers, which in practice is the recognizer
+        fp32         quantize=False, the unquantized models, kept as the accuracy reference
+        torchscript  the stock models traced, frozen and optimized for inference
+        onnx         the fp32 models exported once to ONNX and run with onnxruntime (optional dependency)
+
+    Converted models are checked against the eager ones on an input of a different shape than the one
+    they were traced with. A model that fails the check (or the conversion) stays eager, with a warning.
+    """
+
+    DETECTOR_SHAPES = ((1, 3, 480, 640), (1, 3, 736, 544))
+    RECOGNIZER_SHAPES = ((1, 1, 64, 320), (2, 1, 64, 512))
+
+    def __init__(self, name: str = "stock", num_threads: int = 0, cache_dir: Optional[Path] = None) -> None:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown OCR backend: {name}, expected one of {', '.join(BACKENDS)}")
+        if num_threads < 0:
+            raise ValueError("num_threads must be >= 0")
+
+        self.log = AppLogger.init_logger()
+        self.name = name
+        self.num_threads = num_threads
+        self.cache_dir = cache_dir
+
+    def reader_kwargs(self) -> dict[str, Any]:
+        """ Extra easyocr.Reader arguments, ONNX exports the float models since quantized LSTMs don't export """
+        return {"quantize": self.name in ("stock", "torchscript")}
+
+    def install(self, reader: Any) -> None:
+        if self.num_threads:
+            import torch
+            torch.set_num_threads(self.num_threads)
+
+        if self.name == "torchscript":
+            reader.detector = self._torchscript(reader.detector, self.DETECTOR_SHAPES, "detector")
+            reader.recognizer = self._torchscript(reader.recognizer, self.RECOGNIZER_SHAPES, "recognizer")
+        elif self.name == "onnx":
+            cache_dir = self.cache_dir or Path(reader.model_storage_directory) / "onnx"
+            recognizer_id = hashlib.sha1(reader.character.encode("utf-8")).hexdigest()[:10]
+            reader.detector = self._onnx(reader.detector, self.DETECTOR_SHAPES, cache_dir / "craft.onnx")
+            reader.recognizer = self._onnx(
+                reader.recognizer, self.RECOGNIZER_SHAPES, cache_dir / f"recognizer_{recognizer_id}.onnx"
+            )
+
+    def _torchscript(self, model: Any, shapes: tuple[tuple[int, ...], ...], what: str) -> Any:
+        import torch
+
+        try:
+            example = self._inputs(shapes[0])
+            with torch.no_grad():
+                traced = torch.jit.trace(model.eval(), example, check_trace=False)
+                converted = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+        except Exception as e:
+            self.log.warning(f"TorchScript conversion of the {what} failed, it stays eager: {e}")
+            return model
+
+        return converted if self._matches(model, converted, shapes[1], what) else model
+
+    def _onnx(self, model: Any, shapes: tuple[tuple[int, ...], ...], path: Path) -> Any:
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError("The onnx OCR backend needs onnxruntime, pip install onnxruntime") from e
+
+        what = path.stem
+        try:
+            if not path.exists():
+                self._export(model, shapes[0], path)
+
+            options = onnxruntime.SessionOptions()
+            if self.num_threads:
+                options.intra_op_num_threads = self.num_threads
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            converted = _OnnxModel(
+                onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+            )
+        except Exception as e:
+            self.log.warning(f"ONNX export of {what} failed, it stays on torch: {e}")
+            return model
+
+        if self._matches(model, converted, shapes[1], what):
+            return converted
+        path.unlink(missing_ok=True)
+        return model
+
+    def _export(self, model: Any, shape: tuple[int, ...], path: Path) -> None:
+        import torch
+
+        detector = shape[1] == 3
+        if detector:
+            outputs = ["y", "feature"]
+            dynamic = {"x": {0: "batch", 2: "height", 3: "width"}, "y": {0: "batch", 1: "h", 2: "w"},
+                       "feature": {0: "batch", 2: "h", 3: "w"}}
+        else:
+            outputs = ["preds"]
+            dynamic = {"x": {0: "batch", 3: "width"}, "preds": {0: "batch", 1: "steps"}}
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(path.name + ".part")
+        with torch.no_grad():
+            torch.onnx.export(
+                model.eval(),
+                self._inputs(shape),
+                str(partial),
+                input_names=["x"] if detector else ["x", "text"],
+                output_names=outputs,
+                dynamic_axes=dynamic,
+                opset_version=17,
+            )
+        # Other processes may be loading the same cache, only a complete file gets the real name
+        partial.replace(path)
+
+    def _matches(self, eager: Any, converted: Any, shape: tuple[int, ...], what: str) -> bool:
+        """ Same outputs on a second input shape, catches graphs that baked in the trace time shapes """
+        import torch
+
+        inputs = self._inputs(shape)
+        try:
+            with torch.no_grad():
+                expected = eager(*inputs)
+                actual = converted(*inputs)
+            expected = expected if isinstance(expected, tuple) else (expected,)
+            actual = actual if isinstance(actual, tuple) else (actual,)
+            same = all(
+                e.shape == a.shape and torch.allclose(e.float(), a.float(), atol=1e-3, rtol=1e-2)
+                for e, a in zip(expected, actual)
+            )
+        except Exception as e:
+            self.log.warning(f"Converted {what} failed on a {shape} input, keeping the eager model: {e}")
+            return False
+
+        if not same:
+            self.log.warning(f"Converted {what} disagrees with the eager model on a {shape} input, keeping the eager model")
+        return same
+
+    @staticmethod
+    def _inputs(shape: tuple[int, ...]) -> tuple[Any, ...]:
+        """ Example call arguments, the recognizer also takes an (unused) text tensor """
+        import torch
+
+        generator = torch.Generator().manual_seed(0)
+        x = torch.rand(shape, generator=generator)
+        if shape[1] == 3:
+            return (x,)
+        return x, torch.zeros((shape[0], 1), dtype=torch.long)
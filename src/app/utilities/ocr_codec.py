@@ -0,0 +1,324 @@
+""" Compact columnar encoding of OCR page records: an .npz of typed columns plus a string table """
+
+
+import io
+import json
+import mmap
+import os
+import struct
+import zipfile
+
+from pathlib import Path
+from typing import Any, Mapping, Optional, Sequence
+
+import numpy as np
+
+from src.app.utilities.page_store import jsonable
+
+
+FORMAT_VERSION = 1
+
+# Block / page keys that have a column, anything else a record carries rides along in the JSON extras
+BLOCK_KEYS = frozenset({"text", "confidence", "bbox", "x_min", "y_min", "x_max", "y_max", "cx", "cy", "w", "h", "region", "is_math"})
+PAGE_KEYS = frozenset({"page_index", "image_path", "blocks", "refined_blocks", "improved_blocks"})
+
+# Bits of the per block `present` column, so a block reads back with exactly the keys it was written with
+_CONFIDENCE, _BBOX, _RECT, _REGION, _IS_MATH = 1, 2, 4, 8, 16
+
+_NO_BOX = ((0, 0), (0, 0), (0, 0), (0, 0))
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")   # zip local file header, 30 bytes
+
+
+def encode_pages(pages: Sequence[Mapping[str, Any]]) -> bytes:
+    """ Page records (ocr_page() output, math tagged or not) as one npz blob """
+    buffer = io.BytesIO()
+    np.savez(buffer, **_columns(pages))
+    return buffer.getvalue()
+
+
+def decode_pages(data: bytes) -> list[dict[str, Any]]:
+    return ColumnarPages.from_bytes(data).pages()
+
+
+def write_pages(path: Path, pages: Sequence[Mapping[str, Any]]) -> None:
+    """ encode_pages() to a file, replaced atomically so a reader never sees half of it """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".part")
+    tmp.write_bytes(encode_pages(pages))
+    os.replace(tmp, path)
+
+
+def read_pages(path: Path) -> list[dict[str, Any]]:
+    return ColumnarPages.open(path).pages()
+
+
+class ColumnarPages:
+    """
+    Read side of the encoding. The columns stay numpy arrays, memory mapped when opened from a file,
+    so a large document can be scanned by column (confidences, boxes) or read one page at a time
+    without building every block dict. `pages()` materializes the full records.
+
+    Boxes and confidences are float32: a confidence reads back rounded to 6 decimals and coordinates
+    to 1/100 of a pixel. Integer bbox corners (the usual easyocr output) read back as ints.
+    """
+
+    def __init__(self, arrays: Mapping[str, np.ndarray]) -> None:
+        extras = json.loads(bytes(arrays["extras"]).decode("utf-8"))
+        if extras.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported OCR codec version: {extras.get('version')}")
+
+        self.arrays = arrays
+        self._page_extras: dict[str, dict[str, Any]] = extras.get("pages", {})
+        self._block_extras: dict[str, dict[str, Any]] = extras.get("blocks", {})
+        self._strings = arrays["strings"]
+        self._string_offsets = arrays["string_offsets"]
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "ColumnarPages":
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            return cls({name: npz[name] for name in npz.files})
+
+    @classmethod
+    def open(cls, path: Path, mmap: bool = True) -> "ColumnarPages":
+        if not mmap:
+            return cls.from_bytes(path.read_bytes())
+        return cls(_memmap_npz(path))
+
+    def __len__(self) -> int:
+        return len(self.arrays["page_index"])
+
+    @property
+    def page_indexes(self) -> np.ndarray:
+        return self.arrays["page_index"]
+
+    @property
+    def block_count(self) -> int:
+        return int(self.arrays["block_start"][-1])
+
+    def column(self, name: str, page: Optional[int] = None) -> np.ndarray:
+        """ A block column (confidence, rect, bbox, region, is_math, text ids), of one page by position or of all """
+        values = self.arrays[name]
+        if page is None:
+            return values
+        start, end = self.arrays["block_start"][page : page + 2]
+        return values[start:end]
+
+    def string(self, i: int) -> str:
+        start, end = self._string_offsets[i : i + 2]
+        return bytes(self._strings[start:end]).decode("utf-8")
+
+    def page(self, position: int) -> dict[str, Any]:
+        """ The record of the page at `position` (0-based, in stored order) """
+        return self._decode(position, position + 1)[0]
+
+    def pages(self) -> list[dict[str, Any]]:
+        return self._decode(0, len(self))
+
+    def _decode(self, first: int, last: int) -> list[dict[str, Any]]:
+        a = self.arrays
+        block_start = a["block_start"][first : last + 1].tolist()
+        lo, hi = block_start[0], block_start[-1]
+
+        text_ids = a["text"][lo:hi].tolist()
+        used = {i for i in text_ids if i >= 0} | {i for i in a["image_path"][first:last].tolist() if i >= 0}
+        if last - first == len(self):
+            # Whole document, one copy of the string table beats a slice of the memory map per string
+            raw = bytes(self._strings)
+            offsets = self._string_offsets.tolist()
+            strings = {i: raw[offsets[i] : offsets[i + 1]].decode("utf-8") for i in used}
+        else:
+            strings = {i: self.string(i) for i in used}
+
+        present = a["present"][lo:hi].tolist()
+        confidence = np.round(a["confidence"][lo:hi].astype(np.float64), 6).tolist()
+        rect = np.round(a["rect"][lo:hi].astype(np.float64), 2).tolist()
+        bbox = a["bbox"][lo:hi]
+        bbox = (bbox if bbox.dtype.kind == "i" else np.round(bbox.astype(np.float64), 2)).tolist()
+        region = a["region"][lo:hi].tolist()
+        is_math = a["is_math"][lo:hi].tolist()
+
+        pages: list[dict[str, Any]] = []
+        for p in range(first, last):
+            blocks: list[dict[str, Any]] = []
+            for j in range(block_start[p - first], block_start[p - first + 1]):
+                k = j - lo
+                mask = present[k]
+                block: dict[str, Any] = {}
+                if text_ids[k] >= 0:
+                    block["text"] = strings[text_ids[k]]
+                if mask & _CONFIDENCE:
+                    block["confidence"] = confidence[k]
+                if mask & _BBOX:
+                    block["bbox"] = bbox[k]
+                if mask & _RECT:
+                    x_min, y_min, x_max, y_max = rect[k]
+                    block.update(
+                        x_min=x_min, y_min=y_min, x_max=x_max, y_max=y_max,
+                        cx=(x_min + x_max) / 2.0, cy=(y_min + y_max) / 2.0, w=x_max - x_min, h=y_max - y_min,
+                    )
+                if mask & _REGION:
+                    block["region"] = region[k]
+                if mask & _IS_MATH:
+                    block["is_math"] = bool(is_math[k])
+                block.update(self._block_extras.get(str(j), {}))
+                blocks.append(block)
+
+            page: dict[str, Any] = {"page_index": int(a["page_index"][p])}
+            image_path = int(a["image_path"][p])
+            if image_path >= 0:
+                page["image_path"] = strings[image_path]
+            page["blocks"] = blocks
+            refined, improved = a["page_counts"][p].tolist()
+            if refined >= 0:
+                page["refined_blocks"] = refined
+            if improved >= 0:
+                page["improved_blocks"] = improved
+            page.update(self._page_extras.get(str(p), {}))
+            pages.append(page)
+
+        return pages
+
+
+def _columns(pages: Sequence[Mapping[str, Any]]) -> dict[str, np.ndarray]:
+    """ The arrays of the npz, one row per page or per block (all pages' blocks back to back) """
+    strings: dict[str, int] = {}
+
+    def intern(value: Any) -> int:
+        if not isinstance(value, str):
+            return -1
+        return strings.setdefault(value, len(strings))
+
+    page_index, image_path, page_counts, block_start = [], [], [], [0]
+    text, present, confidence, rect, bbox, region, is_math = [], [], [], [], [], [], []
+    page_extras: dict[str, dict[str, Any]] = {}
+    block_extras: dict[str, dict[str, Any]] = {}
+
+    for p, page in enumerate(pages):
+        page_index.append(int(page["page_index"]))
+        image_path.append(intern(page.get("image_path")))
+        page_counts.append((int(page.get("refined_blocks", -1)), int(page.get("improved_blocks", -1))))
+        extra = {k: v for k, v in page.items() if k not in PAGE_KEYS}
+        if page.get("image_path") is not None and not isinstance(page["image_path"], str):
+            extra["image_path"] = str(page["image_path"])
+        if extra:
+            page_extras[str(p)] = extra
+
+        for block in page.get("blocks", []):
+            j = len(text)
+            mask = 0
+            unknown = block.keys() - BLOCK_KEYS
+            extra = {k: block[k] for k in unknown} if unknown else {}
+
+            text.append(intern(block.get("text")))
+            if "text" in block and text[-1] < 0:
+                extra["text"] = block["text"]
+
+            confidence.append(block.get("confidence", 0.0))
+            mask |= _CONFIDENCE if "confidence" in block else 0
+
+            corners = block.get("bbox")
+            if hasattr(corners, "tolist"):
+                corners = corners.tolist()   # easyocr hands back numpy corners for rotated boxes
+            if isinstance(corners, (list, tuple)) and len(corners) == 4:
+                bbox.append(corners)
+                mask |= _BBOX
+            else:
+                bbox.append(_NO_BOX)
+                if "bbox" in block:
+                    extra["bbox"] = block["bbox"]
+
+            if "x_min" in block:
+                rect.append((block["x_min"], block["y_min"], block["x_max"], block["y_max"]))
+                mask |= _RECT
+            else:
+                rect.append((0.0, 0.0, 0.0, 0.0))
+
+            region.append(int(block.get("region", -1)))
+            mask |= _REGION if "region" in block else 0
+            is_math.append(bool(block.get("is_math", False)))
+            mask |= _IS_MATH if "is_math" in block else 0
+
+            present.append(mask)
+            if extra:
+                block_extras[str(j)] = extra
+
+        block_start.append(len(text))
+
+    bbox_array = _quads(bbox)
+    if bbox_array is None:
+        # Some box isn't 4 (x, y) corners, those go to the extras as they are
+        for j, corners in enumerate(bbox):
+            if not all(isinstance(pt, (list, tuple)) and len(pt) == 2 for pt in corners):
+                block_extras.setdefault(str(j), {})["bbox"] = corners
+                bbox[j] = _NO_BOX
+                present[j] &= ~_BBOX
+        bbox_array = _quads(bbox)
+    integral = bool(np.all(bbox_array == np.round(bbox_array))) and bool(np.all(np.abs(bbox_array) < 2**31))
+
+    encoded = [s.encode("utf-8") for s in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in encoded], out=string_offsets[1:])
+
+    extras = {"version": FORMAT_VERSION, "pages": page_extras, "blocks": block_extras}
+    return {
+        "page_index": np.asarray(page_index, dtype=np.int32),
+        "image_path": np.asarray(image_path, dtype=np.int32),
+        "page_counts": np.asarray(page_counts, dtype=np.int32).reshape(-1, 2),
+        "block_start": np.asarray(block_start, dtype=np.int64),
+        "text": np.asarray(text, dtype=np.int32),
+        "present": np.asarray(present, dtype=np.uint8),
+        "confidence": np.asarray(confidence, dtype=np.float32),
+        "rect": np.asarray(rect, dtype=np.float32).reshape(-1, 4),
+        "bbox": bbox_array.astype(np.int32 if integral else np.float32),
+        "region": np.asarray(region, dtype=np.int32),
+        "is_math": np.asarray(is_math, dtype=np.bool_),
+        "strings": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "string_offsets": string_offsets,
+        "extras": np.frombuffer(json.dumps(extras, default=jsonable).encode("utf-8"), dtype=np.uint8),
+    }
+
+
+def _quads(bbox: list[Any]) -> Optional[np.ndarray]:
+    """ The boxes as an (n, 4, 2) array, None when some box has another shape """
+    if not bbox:
+        return np.zeros((0, 4, 2))
+    try:
+        quads = np.asarray(bbox, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    return quads if quads.shape == (len(bbox), 4, 2) else None
+
+
+def _memmap_npz(path: Path) -> dict[str, np.ndarray]:
+    """
+    Memory map every member of an uncompressed npz (what np.savez writes). np.load ignores mmap_mode
+    for npz, but a stored member is a plain .npy at a known offset of the zip, so it maps like one.
+    The file is mapped once, every array is a view into that map.
+    """
+    arrays: dict[str, np.ndarray] = {}
+    with zipfile.ZipFile(path) as zf, path.open("rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for info in zf.infolist():
+            name = info.filename.removesuffix(".npy")
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = np.load(zf.open(info), allow_pickle=False)
+                continue
+
+            f.seek(info.header_offset)
+            header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            f.seek(header[-2] + header[-1], os.SEEK_CUR)  # file name and extra field
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if dtype.hasobject:
+                raise ValueError(f"{path}: object arrays can't be memory mapped")
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                order = "F" if fortran_order else "C"
+                arrays[name] = np.ndarray(shape, dtype=dtype, buffer=mapped, offset=f.tell(), order=order)
+    return arrays
@@ -32,23 +32,22 @@ class MathPass:
     def tag_blocks(self, ocr_result: dict[str, Any]) -> dict[str, Any]:
         """ Adds `is_math: bool` to each OCR block. For now still raw, but later feed into mathml"""
         out = dict(ocr_result)
-        out_pages: list[dict[str, Any]] = []
-
-        for page in ocr_result.get("pages", []):
-            page_copy = dict(page)
-            blocks_out: list[dict[str, Any]] = []
+        out["pages"] = [self.tag_page(page) for page in ocr_result.get("pages", [])]
+        return out
 
-            for b in page.get("blocks", []):
-                b2 = dict(b)
-                text = b2.get("text", "") or ""
-                b2["is_math"] = self._looks_like_math(text)
-                blocks_out.append(b2)
+    def tag_page(self, page: dict[str, Any]) -> dict[str, Any]:
+        """ tag_blocks() for a single page record, used as pages finish one by one """
+        page_copy = dict(page)
+        blocks_out: list[dict[str, Any]] = []
 
-            page_copy["blocks"] = blocks_out
-            out_pages.append(page_copy)
+        for b in page.get("blocks", []):
+            b2 = dict(b)
+            text = b2.get("text", "") or ""
+            b2["is_math"] = self._looks_like_math(text)
+            blocks_out.append(b2)
 
-        out["pages"] = out_pages
-        return out
+        page_copy["blocks"] = blocks_out
+        return page_copy
 
     def _looks_like_math(self, text: str) -> bool:
         signals = 0
@@ -0,0 +1,80 @@
+""" Per-page OCR records on disk, written as each page finishes so partial results survive the job """
+
+
+import json
+import os
+import threading
+
+from pathlib import Path
+from typing import Any
+
+
+def jsonable(value: Any) -> Any:
+    # easyocr hands back numpy ints/arrays inside bbox for rotated boxes
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class PageStore:
+    """
+    Append-only JSON Lines file of finished page records for one job, one line per page.
+
+    Pages are appended from the OCR worker threads in whatever order they finish. Readers (the partial
+    results endpoint, a resumed run) can load the file at any time: a half written last line is skipped,
+    and when a page shows up twice the later record wins.
+    """
+
+    FILENAME = "pages.jsonl"
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._tail_checked = False
+
+    @classmethod
+    def for_job(cls, job_dir: Path) -> "PageStore":
+        return cls(job_dir / cls.FILENAME)
+
+    def append(self, page: dict[str, Any]) -> None:
+        line = json.dumps(page, default=jsonable, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if not self._tail_checked:
+                # A crash mid-write leaves a line without its newline, don't glue the next page onto it
+                line = ("\n" if self._torn_tail() else "") + line
+                self._tail_checked = True
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def load(self) -> list[dict[str, Any]]:
+        """ Every stored page, ascending by page_index """
+        if not self.path.exists():
+            return []
+
+        pages: dict[int, dict[str, Any]] = {}
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    page = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                pages[int(page["page_index"])] = page
+
+        return [pages[idx] for idx in sorted(pages)]
+
+    def page_indexes(self) -> set[int]:
+        return {page["page_index"] for page in self.load()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self.path.unlink(missing_ok=True)
+
+    def _torn_tail(self) -> bool:
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return False
+        with self.path.open("rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
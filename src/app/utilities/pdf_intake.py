@@ -5,7 +5,8 @@ from pathlib import Path
 from dataclasses import dataclass, field
 
 from fastapi import UploadFile, HTTPException
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pdf2image.exceptions import PDFPageCountError, PDFPopplerTimeoutError, PDFSyntaxError
 
 from src.app.utilities.app_logger import AppLogger
 
@@ -15,6 +16,7 @@ class PDFValidationConfig:
     max_pdf_size_bytes: int = field(default=25* 1024 * 1024)  # Should be 25 MB, directly uploaded to cloud run instance
     chunk_size_bytes: int = 1024 * 1024  # 1MB per chunk analysis
     require_pdf_magic: bool = True
+    pdfinfo_timeout_seconds: int = 10
 
     def __post_init__(self):
         if self.max_pdf_size_bytes != (25 * 1024 * 1024) or not isinstance(self.max_pdf_size_bytes, int):
@@ -88,6 +90,18 @@ class PDFIntake:
         self.log.info(f"Saved PDF upload: {orig_name} -> {out_path} ({total} bytes)")
         return out_path
 
+    def page_count(self, pdf_file: Path) -> int:
+        """ Number of pages from the PDF's header via pdfinfo, nothing is rasterized """
+        try:
+            info = pdfinfo_from_path(str(pdf_file), timeout=self._cfg.pdfinfo_timeout_seconds)
+        except (PDFPageCountError, PDFSyntaxError, PDFPopplerTimeoutError) as e:
+            raise HTTPException(status_code=422, detail="Could not read the PDF's page count.") from e
+
+        pages = int(info.get("Pages") or 0)
+        if pages < 1:
+            raise HTTPException(status_code=422, detail="The PDF has no pages.")
+        return pages
+
     def pdf_to_jpeg(
         self,
         pdf_file: Path,
@@ -0,0 +1,155 @@
+""" OCR readers per language set, loaded on first use and evicted least recently used first """
+
+
+import gc
+import threading
+import time
+
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Hashable, Iterable
+
+from src.app.utilities.app_logger import AppLogger
+from src.app.utilities.lru_cache import LRUCache
+
+
+LanguageKey = tuple[str, ...]
+
+_MISSING = object()
+
+
+def language_key(languages: Iterable[str]) -> LanguageKey:
+    """ Order and duplicates don't change the models, ["fr", "en"] and ["en", "fr", "en"] share one reader """
+    key = tuple(sorted({str(lang).strip().lower() for lang in languages if str(lang).strip()}))
+    if not key:
+        raise ValueError("At least one OCR language is required")
+    return key
+
+
+class ReaderRegistry:
+    """
+    An EasyOCR reader holds the detector plus a recognizer and character set for its languages, a few
+    hundred MB each. Loading every language set a job might ask for up front would cost every instance
+    the memory of all of them, so only the `pinned` sets (the engine's default) are loaded right away.
+    Any other set is loaded by `load` the first time a page asks for it, and at most `max_readers` of
+    those stay loaded, the least recently used is dropped when another one comes in.
+
+    Two threads asking for the same missing set wait on one load. Pages already running on an evicted
+    reader keep their reference, its memory goes when they finish. Memory briefly holds
+    `max_readers + 1` sets while a new one loads next to the ones still cached.
+
+    Every load and eviction is timed, `stats()` has the counts, the per set timings and recent events.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[LanguageKey], Any],
+        max_readers: int = 2,
+        pinned: Iterable[Iterable[str]] = (),
+        history: int = 50,
+    ) -> None:
+        self.log = AppLogger.init_logger()
+        self._load = load
+        self._cache: LRUCache[Any] = LRUCache(max_readers, on_evict=self._evicted)
+        self._lock = threading.Lock()
+        self._loading: dict[LanguageKey, threading.Lock] = {}
+        self._released: list[tuple[Hashable, Any]] = []
+        self._timings: dict[LanguageKey, dict[str, Any]] = {}
+        self._events: deque[dict[str, Any]] = deque(maxlen=history)
+
+        self._pinned: dict[LanguageKey, Any] = {}
+        for languages in pinned:
+            key = language_key(languages)
+            if key not in self._pinned:
+                self._pinned[key] = self._timed_load(key)
+
+    @property
+    def max_readers(self) -> int:
+        return self._cache.max_size
+
+    def get(self, languages: Iterable[str]) -> Any:
+        """ The reader for `languages`, loaded (and something else evicted) when it isn't in memory """
+        key = language_key(languages)
+        reader = self._pinned.get(key, _MISSING)
+        if reader is _MISSING:
+            reader = self._cache.get(key, _MISSING)
+        if reader is not _MISSING:
+            return reader
+
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:
+            # Loaded by another thread while this one waited
+            if key in self._cache:
+                return self._cache.get(key)
+            reader = self._timed_load(key)
+            self._cache.put(key, reader)
+        with self._lock:
+            self._loading.pop(key, None)
+
+        self._release()
+        return reader
+
+    def loaded(self) -> list[LanguageKey]:
+        """ Pinned sets, then the cached ones from least to most recently used """
+        return list(self._pinned) + list(self._cache.keys())
+
+    def _timed_load(self, key: LanguageKey) -> Any:
+        started = time.perf_counter()
+        reader = self._load(key)
+        seconds = time.perf_counter() - started
+        self._record(key, "load", seconds)
+        self.log.info(f"Loaded OCR reader for {'+'.join(key)} in {seconds:.2f}s")
+        return reader
+
+    def _evicted(self, key: Hashable, reader: Any) -> None:
+        # LRUCache.put still holds the reader here, it is freed in _release() once put() returned
+        with self._lock:
+            self._released.append((key, reader))
+
+    def _release(self) -> None:
+        with self._lock:
+            released, self._released = self._released, []
+        while released:
+            key, reader = released.pop()
+            started = time.perf_counter()
+            del reader
+            gc.collect()
+            seconds = time.perf_counter() - started
+            self._record(key, "evict", seconds)
+            self.log.info(f"Evicted OCR reader for {'+'.join(key)} in {seconds:.2f}s")
+
+    def _record(self, key: LanguageKey, event: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.setdefault(
+                key, {"loads": 0, "loadSeconds": 0.0, "lastLoadSeconds": None, "evictions": 0, "evictSeconds": 0.0}
+            )
+            if event == "load":
+                timing["loads"] += 1
+                timing["loadSeconds"] += seconds
+                timing["lastLoadSeconds"] = seconds
+            else:
+                timing["evictions"] += 1
+                timing["evictSeconds"] += seconds
+            self._events.append({
+                "languages": list(key),
+                "event": event,
+                "seconds": round(seconds, 4),
+                "at": datetime.now(timezone.utc).isoformat(),
+            })
+
+    def stats(self) -> dict[str, Any]:
+        cache = self._cache.stats()
+        with self._lock:
+            timings = {"+".join(key): dict(timing) for key, timing in self._timings.items()}
+            events = list(self._events)
+        return {
+            "maxReaders": cache["maxSize"],
+            "pinned": [list(key) for key in self._pinned],
+            "loaded": [list(key) for key in self._cache.keys()],
+            "hits": cache["hits"],
+            "misses": cache["misses"],
+            "evictions": cache["evictions"],
+            "languageSets": timings,
+            "events": events,
+        }
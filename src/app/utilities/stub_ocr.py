@@ -0,0 +1,81 @@
+""" Stand-in OCR engine for load tests: no models, a fixed delay per page and synthetic text blocks """
+
+
+import time
+
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import cv2
+
+from src.app.utilities.document_ocr import DocumentOCR, OCRArguments
+from src.app.utilities.image_preprocess import ImagePreprocessor, PreprocessConfig
+from src.app.utilities.layout_analysis import XYCutLayout
+from src.app.utilities.ocr_backend import OCRBackend
+from src.app.utilities.reader_registry import LanguageKey, ReaderRegistry
+
+
+LINES = [
+    "Problem 4: find the tension in each rope",
+    "T1 cos 30 = T2 cos 45",
+    "so T1 = 71.7 N and T2 = 87.8 N",
+    "check: the sum of forces is zero",
+]
+
+
+class StubOCR(DocumentOCR):
+    """
+    DocumentOCR without EasyOCR, selected with DOC_OCR_ENGINE=stub. The page image is still decoded
+    (and preprocessed when the job asks for it), then the thread sleeps `seconds_per_page` in place of
+    inference. Torch releases the GIL while it runs, so a sleep loads the rest of the instance the
+    same way. The blocks then go through the real filter and reading order, like a recognized page.
+    Jobs asking for other languages still go through the reader registry, with nothing to load.
+    """
+
+    def __init__(self, args: OCRArguments = OCRArguments(), seconds_per_page: float = 0.5, lines_per_page: int = 30) -> None:
+        self.args = args
+        self.backend = OCRBackend("stock")
+        self.readers = ReaderRegistry(self._load_reader, max_readers=self.args.max_readers, pinned=[self.args.languages])
+        self.reader = self.readers.get(self.args.languages)
+        self.layout = XYCutLayout(self.args.layout)
+        self.preprocessor = ImagePreprocessor()
+        self.seconds_per_page = seconds_per_page
+        self.lines_per_page = lines_per_page
+
+    def _load_reader(self, languages: LanguageKey) -> Any:
+        return languages
+
+    def _read_image(
+        self,
+        image_path: Path,
+        preprocess: Optional[PreprocessConfig] = None,
+        languages: Optional[Sequence[str]] = None,
+    ) -> tuple[list[dict[str, Any]], dict[str, int]]:
+        if not image_path.exists():
+            raise FileNotFoundError(f"Image not found at path: {image_path}")
+        self._reader_for(languages)
+
+        pixels = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
+        if pixels is None:
+            raise ValueError(f"Could not decode image: {image_path}")
+        if preprocess is not None and preprocess.enabled:
+            pixels = self.preprocessor.process(pixels, preprocess)
+        time.sleep(self.seconds_per_page)
+
+        height, width = pixels.shape[:2]
+        line_height = max(1, height // (self.lines_per_page + 2))
+        raw = []
+        for i in range(self.lines_per_page):
+            y = (i + 1) * line_height
+            x = width // 10
+            for word in LINES[i % len(LINES)].split():
+                w = 18 * len(word)
+                raw.append(([[x, y], [x + w, y], [x + w, y + line_height // 2], [x, y + line_height // 2]], word, 0.9))
+                x += w + 12
+
+        blocks = self._filter_blocks(self._normalize_easyocr_result(raw), min_conf=self.args.min_confidence)
+        if self.args.reading_order == "xycut":
+            blocks = self.layout.order(blocks)
+        else:
+            blocks = self._sort_reading_order(blocks)
+        return blocks, {"refined_blocks": 0, "improved_blocks": 0}